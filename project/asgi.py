@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+# тулбар умеет только синхронный режим, см. DEBUG_TOOLBAR_ENABLED в settings
+os.environ.setdefault('DEBUG_TOOLBAR_ENABLED', 'False')
 
 application = get_asgi_application()
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     "rest_framework",
     "django_filters",
@@ -48,6 +49,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.metrics.MetricsMiddleware',
+    # до всех, кто читает или меняет тело ответа; метрики видят размер уже сжатого ответа
+    'store.compression.CompressionMiddleware',
+    'store.routers.ReplicaRoutingMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -55,10 +60,17 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
-    'debug_toolbar_force.middleware.ForceDebugToolbarMiddleware',
 ]
 
+# debug_toolbar 4.1 и debug_toolbar_force работают только синхронно: с ними Django гонял бы каждый
+# async view (/async/...) через переходы между потоками. Под ASGI (project/asgi.py) по умолчанию выключены
+DEBUG_TOOLBAR_ENABLED = config('DEBUG_TOOLBAR_ENABLED', default=DEBUG, cast=bool)
+if DEBUG_TOOLBAR_ENABLED:
+    MIDDLEWARE += [
+        "debug_toolbar.middleware.DebugToolbarMiddleware",
+        'debug_toolbar_force.middleware.ForceDebugToolbarMiddleware',
+    ]
+
 ROOT_URLCONF = "project.urls"
 
 TEMPLATES = [
@@ -91,9 +103,104 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        # постоянные соединения: не открывать новое на каждый запрос; проверка перед повторным использованием
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
     }
 }
 
+# Пул соединений в процессе (store.pooled_postgresql) - для ASGI и многопоточных серверов, где соединение
+# на поток держит лишние соединения открытыми. С пулом соединение возвращается в него после каждого запроса.
+if config('DB_POOL', default=False, cast=bool):
+    DATABASES['default'].update(
+        ENGINE='store.pooled_postgresql',
+        CONN_MAX_AGE=0,
+        OPTIONS={'pool': {
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=5, cast=float),
+        }},
+    )
+
+# Реплика для чтения каталога (store.routers.ReplicaRouter). Алиас есть всегда, но запросы идут в него,
+# только если задан DB_REPLICA_HOST; в тестах это зеркало default.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': config('DB_REPLICA_HOST', default=DATABASES['default']['HOST']),
+    'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_REPLICAS = ['replica'] if config('DB_REPLICA_HOST', default='') else []
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+# сколько секунд после изменения каталога клиент читает из primary; вошедший пользователь отмечается ещё и
+# в BOOK_API_VERSION_CACHE, поэтому с несколькими воркерами этот кеш должен быть общим.
+# Промахи кеша ответов всегда читаются из primary, реплики обслуживают остальные чтения
+BOOK_READ_YOUR_WRITES_SECONDS = config('BOOK_READ_YOUR_WRITES_SECONDS', default=5, cast=float)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# LocMemCache живёт в памяти процесса; для нескольких воркеров без внешнего сервиса подойдёт
+# django.core.cache.backends.filebased.FileBasedCache с CACHE_LOCATION=/path/to/dir.
+# Версии каталога и пользователей (store.cache) лежат в отдельном кеше BOOK_API_VERSION_CACHE, чтобы их не вытесняли
+# ответы. С несколькими воркерами он должен быть общим (не LocMemCache): иначе воркер, не видевший изменения,
+# отдаёт старые ответы из своего кеша до BOOK_API_CACHE_TIMEOUT. С LocMemCache ETag у списка книг не ставится.
+
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHE_LOCATION = config('CACHE_LOCATION', default='book-store')
+# у LocMemCache и FileBasedCache LOCATION - имя области памяти или каталог, версиям нужен свой
+_CACHE_IN_PROCESS_OR_FILE = CACHE_BACKEND.endswith(('LocMemCache', 'FileBasedCache'))
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+    },
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('VERSION_CACHE_LOCATION',
+                           default=f'{CACHE_LOCATION}-versions' if _CACHE_IN_PROCESS_OR_FILE else CACHE_LOCATION),
+        'KEY_PREFIX': 'versions',
+        'TIMEOUT': None,
+        # по версии на пользователя; вытесненная версия заменяется новой случайной - это только промахи кеша
+        **({'OPTIONS': {'MAX_ENTRIES': 100000}} if _CACHE_IN_PROCESS_OR_FILE else {}),
+    },
+}
+
+BOOK_API_CACHE = 'default'
+BOOK_API_VERSION_CACHE = 'versions'
+BOOK_API_CACHE_TIMEOUT = config('BOOK_API_CACHE_TIMEOUT', default=300, cast=int)
+
+# Отложенный пересчёт счётчиков книг: реакция только помечает книгу в очереди DirtyBook, а команда
+# flush_book_counters пересчитывает её, когда реакции стихнут на FLUSH_DELAY секунд,
+# но не позже MAX_STALENESS секунд после первой отметки. Выключено - счётчики меняются сразу.
+# Лидерборды при любом значении обновляет только flush_book_counters, её нужно запускать всегда: без неё доски
+# и активность стоят на месте, а очередь растёт (отметка - вставка строки на каждую реакцию).
+BOOK_COUNTERS_WRITE_BEHIND = config('BOOK_COUNTERS_WRITE_BEHIND', default=False, cast=bool)
+BOOK_COUNTERS_FLUSH_DELAY = config('BOOK_COUNTERS_FLUSH_DELAY', default=2, cast=float)
+BOOK_COUNTERS_MAX_STALENESS = config('BOOK_COUNTERS_MAX_STALENESS', default=30, cast=float)
+
+# Лидерборды (store.leaderboards, /book/top/): хранится BOOK_LEADERBOARD_SIZE лучших книг на доску, отдаётся
+# не больше BOOK_LEADERBOARD_MAX_LIMIT. Окна - через запятую в днях, пусто - только за всё время; для окон
+# flush_book_counters пишет изменения счётчиков в BookActivity, а выпадение старых дней из окна учитывает
+# rebuild_leaderboards.
+BOOK_LEADERBOARD_SIZE = config('BOOK_LEADERBOARD_SIZE', default=100, cast=int)
+BOOK_LEADERBOARD_MAX_LIMIT = config('BOOK_LEADERBOARD_MAX_LIMIT', default=50, cast=int)
+BOOK_LEADERBOARD_WINDOWS = config('BOOK_LEADERBOARD_WINDOWS', default='', cast=Csv(int))
+# минимум оценок, чтобы книга попала в доску по рейтингу
+BOOK_LEADERBOARD_MIN_RATINGS = config('BOOK_LEADERBOARD_MIN_RATINGS', default=3, cast=int)
+
+# Метрики запросов (store.metrics): доля замеряемых запросов, порог журнала медленных запросов
+# и токен для /metrics/ (Authorization: Bearer <токен>); без токена метрики видит только staff
+BOOK_METRICS_SAMPLE_RATE = config('BOOK_METRICS_SAMPLE_RATE', default=1.0, cast=float)
+BOOK_METRICS_SLOW_REQUEST_MS = config('BOOK_METRICS_SLOW_REQUEST_MS', default=500, cast=float)
+BOOK_METRICS_TOKEN = config('BOOK_METRICS_TOKEN', default='')
+
+# Сжатие ответов (store.compression): brotli, если установлен пакет brotli, иначе gzip - по Accept-Encoding.
+# Ответы меньше BOOK_COMPRESSION_MIN_SIZE байт не сжимаются: выигрыш меньше заголовков и времени на сжатие
+BOOK_COMPRESSION_MIN_SIZE = config('BOOK_COMPRESSION_MIN_SIZE', default=1024, cast=int)
+BOOK_COMPRESSION_GZIP_LEVEL = config('BOOK_COMPRESSION_GZIP_LEVEL', default=6, cast=int)
+BOOK_COMPRESSION_BROTLI_QUALITY = config('BOOK_COMPRESSION_BROTLI_QUALITY', default=5, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -136,12 +243,13 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# store.renderers: тот же JSON, что у JSONRenderer/JSONParser, но через orjson, если он установлен
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'store.renderers.FastJSONRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
-        'rest_framework.parsers.JSONParser',
+        'store.renderers.FastJSONParser',
     )
 }
 
@@ -17,8 +17,9 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework.routers import SimpleRouter
 
+from store import async_views
 from store.views import BookViewSet, UserBookRelationView
-from store.views import auth
+from store.views import auth, metrics
 
 
 router = SimpleRouter()
@@ -31,6 +32,11 @@ urlpatterns = [
 
     path("admin/", admin.site.urls),
     path('auth/', auth),
+    path('metrics/', metrics),
+
+    path('async/book/', async_views.book_list, name='async-book-list'),
+    path('async/book/<pk>/', async_views.book_detail, name='async-book-detail'),
+    path('async/book_relation/<book>/', async_views.book_relation, name='async-userbookrelation-detail'),
 ]
 
 urlpatterns += router.urls
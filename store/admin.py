@@ -1,15 +1,102 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
 
+from . import logic
 from . import models
+from .filters import BookSearchFilter
+from .pagination import EstimatedCountPaginator
+from .serializers import BookPricingSerializer
+
+
+class BookActionForm(ActionForm):
+    rule = forms.ChoiceField(label='Правило', required=False, choices=(
+        ('price_percent', 'Изменить цену на %'),
+        ('price', 'Новая цена'),
+        ('discount_percent', 'Скидка в % от цены'),
+        ('discount', 'Скидка в рублях'),
+    ))
+    value = forms.DecimalField(label='Значение', required=False, max_digits=7, decimal_places=2)
 
 
 @admin.register(models.Book)
-class Book(admin.ModelAdmin):
-    list_display = ('name', 'author_name', 'price')
+class BookAdmin(admin.ModelAdmin):
+    list_display = ('name', 'author_name', 'price', 'discount', 'rating', 'likes_count', 'readers_count', 'owner')
+    list_select_related = ('owner', )
+    # updated_at с индексом; остальные поля списка фильтровать по индексу нельзя
+    list_filter = ('updated_at', )
     search_fields = ('name', 'author_name')
-    ordering = ('price', )
+    search_help_text = 'Слова из названия или имени автора'
+    # id в сортировке, иначе админка добавит -pk и индекс (price, id) не подойдёт
+    ordering = ('price', 'id')
+    autocomplete_fields = ('owner', )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    action_form = BookActionForm
+    actions = ('reprice', 'recalculate_counters')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        # по GIN-индексу search_vector, как ?search= в API, а не ILIKE по двум колонкам
+        if not search_term.strip():
+            return queryset, False
+        query = BookSearchFilter().get_search_query([search_term])
+        if query is None:
+            return queryset.none(), False
+        return queryset.filter(search_vector=query), False
+
+    @admin.action(description='Изменить цены или скидки по правилу')
+    def reprice(self, request, queryset):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if not form.is_valid() or form.cleaned_data['value'] is None:
+            self.message_user(request, 'Выберите правило и укажите значение', messages.ERROR)
+            return
+        # те же проверки значения, что у POST /book/pricing/
+        serializer = BookPricingSerializer(data={'all': True, **form.cleaned_data})
+        if not serializer.is_valid():
+            errors = [error for field_errors in serializer.errors.values() for error in field_errors]
+            self.message_user(request, ' '.join(errors), messages.ERROR)
+            return
+        rule, value = serializer.validated_data['rule'], serializer.validated_data['value']
+        try:
+            updated = logic.apply_pricing(queryset, rule, value)
+        except ValidationError as exc:
+            self.message_user(request, exc.messages[0], messages.ERROR)
+            return
+        self.message_user(request, f'Изменено книг: {updated}', messages.SUCCESS)
+
+    @admin.action(description='Пересчитать счётчики и рейтинг')
+    def recalculate_counters(self, request, queryset):
+        counters = logic.recalculate_counters(queryset)
+        ratings = logic.recalculate_ratings(queryset)
+        self.message_user(request, f'Исправлено счётчиков: {counters}, рейтингов: {ratings}', messages.SUCCESS)
 
 
 @admin.register(models.UserBookRelation)
-class Book(admin.ModelAdmin):
-    pass
+class UserBookRelationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'book', 'like', 'in_bookmarks', 'rating')
+    list_select_related = ('user', 'book')
+    # like=True и in_bookmarks=True читаются частичными индексами
+    list_filter = ('like', 'in_bookmarks')
+    search_fields = ('user__username', 'book__id')
+    search_help_text = 'ID книги или точное имя пользователя'
+    ordering = ('-id', )
+    autocomplete_fields = ('user', 'book')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'book').defer('book__search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        # точное совпадение по индексу вместо ILIKE по двум JOIN
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(book_id=int(search_term)), False
+        return queryset.filter(user__username=search_term), False
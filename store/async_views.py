@@ -0,0 +1,162 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, ParseError
+from rest_framework.request import Request
+
+from . import models
+from . import serializers
+from .cache import cache_fill_reads, get_cache, get_catalog_version, record, response_cache_key
+from .filters import atrigram_available
+from .renderers import FastJSONRenderer
+from .views import BookViewSet
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def api_view(methods):
+    # ошибки в том же виде, что отдаёт exception handler DRF
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            try:
+                return await view_func(request, *args, **kwargs)
+            except APIException as exc:
+                data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return json_response(data, exc.status_code)
+        return wrapper
+    return decorator
+
+
+async def book_view(request, action, **kwargs):
+    # фильтры, поиск, сортировка, поля и пагинация берутся из BookViewSet без изменений;
+    # построение queryset ленивое, в БД ходят только await-вызовы ниже.
+    # Пользователь (для my_like и т.п.) загружается заранее: ленивый request.user в async-коде недоступен.
+    # Им же подменяется request.user - его читает ReplicaRouter при первом чтении каталога
+    user = request.user = await sync_to_async(get_user)(request)
+    view = BookViewSet(action=action, args=(), kwargs=kwargs, format_kwarg=None)
+    view.request = Request(request)
+    view.request.user = user
+    return view
+
+
+async def cached_response(request, view, get_data):
+    """
+    Кеш ответов и ETag/Last-Modified - те же, что у BookViewSet (VersionedCacheMixin, ConditionalGetMixin).
+    Валидаторы и чтение кеша делаются за один переход в sync_to_async, get_data вызывается только при промахе.
+    """
+    def lookup():
+        etag, last_modified = view.get_validators(view.request)
+        key = response_cache_key(view.request, get_catalog_version(), view.get_response_variant(view.request))
+        return etag, last_modified, key, get_cache().get(key)
+
+    etag, last_modified, key, data = await sync_to_async(lookup)()
+    response = None
+    if etag is not None:
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if data is not None:
+            record('hit')
+            response = json_response(data)
+            response['X-Cache'] = 'HIT'
+        else:
+            record('miss')
+            with cache_fill_reads(get_cache()):
+                data = await get_data()
+            await sync_to_async(get_cache().set)(key, data, settings.BOOK_API_CACHE_TIMEOUT)
+            response = json_response(data)
+            response['X-Cache'] = 'MISS'
+
+    if etag is not None:
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+@api_view(['GET'])
+async def book_list(request):
+    view = await book_view(request, 'list')
+
+    async def get_data():
+        await atrigram_available(models.Book.objects.db)
+        values_serializer = view.get_values_serializer()
+        if values_serializer is not None:
+            queryset = view.get_values_queryset(values_serializer)
+        else:
+            queryset = view.filter_queryset(view.get_queryset())
+
+        page = await view.paginator.apaginate_queryset(queryset, view.request, view)
+        if values_serializer is not None:
+            data = values_serializer.many(page)
+        else:
+            data = view.get_serializer(page, many=True).data
+        return view.paginator.get_paginated_response(data).data
+
+    return await cached_response(request, view, get_data)
+
+
+@api_view(['GET'])
+async def book_detail(request, pk):
+    view = await book_view(request, 'retrieve', pk=pk)
+
+    async def get_data():
+        await atrigram_available(models.Book.objects.db)
+        values_serializer = view.get_values_serializer()
+        if values_serializer is not None:
+            queryset = view.get_values_queryset(values_serializer)
+        else:
+            queryset = view.filter_queryset(view.get_queryset())
+
+        try:
+            book = await queryset.filter(pk=pk).afirst()
+        except (ValueError, TypeError, ValidationError):
+            book = None
+        if book is None:
+            raise NotFound()
+
+        if values_serializer is not None:
+            return values_serializer.to_representation(book)
+        return view.get_serializer(book).data
+
+    return await cached_response(request, view, get_data)
+
+
+@api_view(['PUT', 'PATCH'])
+async def book_relation(request, book):
+    user = request.user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        # как SessionAuthentication в DRF: без заголовка WWW-Authenticate это 403, а не 401
+        return json_response({'detail': NotAuthenticated.default_detail}, status.HTTP_403_FORBIDDEN)
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ParseError()
+
+    try:
+        book_exists = await models.Book.objects.filter(pk=book).aexists()
+    except (ValueError, TypeError, ValidationError):
+        book_exists = False
+    if not book_exists:
+        raise NotFound()
+
+    relation, _ = await models.UserBookRelation.objects.aget_or_create(user=user, book_id=book)
+    serializer = serializers.UserBookRelationSerializer(relation, data=data, partial=request.method == 'PATCH')
+    if not await sync_to_async(serializer.is_valid)():
+        return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+    # Model.asave() появился только в Django 4.2
+    await sync_to_async(serializer.save)()
+    return json_response(serializer.data)
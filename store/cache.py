@@ -0,0 +1,139 @@
+import threading
+import uuid
+from collections import Counter
+from contextlib import nullcontext
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from store.routers import primary_reads
+
+
+CATALOG_VERSION_KEY = 'store:catalog_version'
+USER_VERSION_KEY = 'store:user_version:{}'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.BOOK_API_CACHE]
+
+
+def get_version_cache():
+    return caches[settings.BOOK_API_VERSION_CACHE]
+
+
+def versions_shared():
+    # LocMemCache у каждого процесса свой: версия в нём не видит изменений, сделанных другими воркерами
+    return not isinstance(get_version_cache(), LocMemCache)
+
+
+def _new_version():
+    # случайная, а не счётчик: версия, пропавшая из кеша, не вернётся к значению, под которым
+    # уже лежат старые ответы
+    return uuid.uuid4().hex
+
+
+def _get_version(key):
+    cache = get_version_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _set_version(key):
+    get_version_cache().set(key, _new_version(), timeout=None)
+
+
+def _bump_version(key):
+    # сразу и ещё раз после коммита: иначе параллельный запрос успеет закешировать
+    # старые данные под новой версией, пока транзакция не зафиксирована
+    _set_version(key)
+    transaction.on_commit(lambda: _set_version(key))
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_user_version(user_id):
+    return _get_version(USER_VERSION_KEY.format(user_id))
+
+
+def bump_user_version(user_id):
+    # связи пользователя с книгами (my_like и т.д.) меняются без изменения каталога,
+    # например при BOOK_COUNTERS_WRITE_BEHIND
+    _bump_version(USER_VERSION_KEY.format(user_id))
+
+
+def record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        hits, misses = _stats['hit'], _stats['miss']
+    return {'hits': hits, 'misses': misses, 'version': get_catalog_version()}
+
+
+def normalized_params(request):
+    # параметры сортируются и пустые отбрасываются, чтобы ?a=1&b=2 и ?b=2&a=1 считались одним запросом
+    return sorted((key, value) for key, values in request.query_params.lists() for value in values if value != '')
+
+
+def cache_fill_reads(cache):
+    # ответ, который попадёт в кеш, читаем из primary: отставшая реплика положила бы старые данные под новую версию
+    return nullcontext() if isinstance(cache, DummyCache) else primary_reads()
+
+
+def response_cache_key(request, version, variant=''):
+    raw = f'{request.get_host()}{request.path}?{normalized_params(request)}{variant}'
+    return f'store:response:{version}:{md5(raw.encode()).hexdigest()}'
+
+
+class VersionedCacheMixin:
+    """Кеширует ответы list/retrieve под текущей версией каталога, см. bump_catalog_version."""
+    cached_actions = ('list', 'retrieve')
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.cached_actions:
+            return handler(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = response_cache_key(request, get_catalog_version(), self.get_response_variant(request))
+        data = cache.get(key)
+        if data is not None:
+            record('hit')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        record('miss')
+        with cache_fill_reads(cache):
+            response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.BOOK_API_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_response_variant(self, request):
+        # ответы, зависящие от пользователя, кешируются отдельно для каждого
+        return ''
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
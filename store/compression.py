@@ -0,0 +1,121 @@
+"""
+Сжатие ответов по Accept-Encoding: brotli (если установлен пакет brotli) или gzip. Как GZipMiddleware из Django,
+но с выбором кодировки по q-значениям, порогом BOOK_COMPRESSION_MIN_SIZE и уровнями сжатия из настроек;
+сжимаются только текстовые типы (JSON, HTML, CSS, JS), картинки и архивы уже сжаты.
+"""
+import re
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml')
+ACCEPT_ENCODING_PART = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def get_encodings():
+    # при равном q предпочитаем brotli: он сжимает JSON заметно лучше gzip
+    return ('br', 'gzip') if brotli is not None else ('gzip', )
+
+
+def choose_encoding(accept_encoding, encodings=None):
+    """Лучшая из encodings кодировка, которую клиент принимает (q > 0), или None."""
+    encodings = get_encodings() if encodings is None else encodings
+    accepted = {}
+    for part in accept_encoding.split(','):
+        match = ACCEPT_ENCODING_PART.match(part)
+        if not match:
+            continue
+        try:
+            quality = float(match[2]) if match[2] is not None else 1
+        except ValueError:
+            continue
+        accepted[match[1].lower()] = quality
+
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.BOOK_COMPRESSION_BROTLI_QUALITY)
+    # gzip с нулевым mtime, как django.utils.text.compress_string: одинаковый ответ - одинаковые байты
+    compressor = zlib.compressobj(settings.BOOK_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_sequence(sequence, encoding):
+    # как django.utils.text.compress_sequence: отдаём то, что компрессор успел выдать, без flush на каждый кусок
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.BOOK_COMPRESSION_BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(settings.BOOK_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for item in sequence:
+        data = process(item)
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress_response(request, await self.get_response(request))
+
+    def compress_response(self, request, response):
+        if response.has_header('Content-Encoding') or not self.is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < settings.BOOK_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            content = compress(response.content, encoding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+
+        # сильный ETag описывает байты ответа, после сжатия он становится слабым (RFC 7232, 2.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def is_compressible(response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
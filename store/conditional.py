@@ -0,0 +1,71 @@
+from hashlib import md5
+
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+
+from .cache import get_catalog_version, normalized_params, versions_shared
+
+
+class ConditionalGetMixin:
+    """
+    ETag/Last-Modified для retrieve по Book.updated_at (одна строка по первичному ключу) и ETag для list
+    по версии каталога из store.cache - той же, под которой кешируются ответы. Валидаторы считаются
+    до тяжёлого queryset с аннотациями и до сериализации, поэтому 304 почти ничего не стоит, а list
+    не читает таблицу вовсе. Last-Modified у list нет: Max(updated_at) не замечает удалённых книг,
+    а выбирать его по отфильтрованному queryset - тот же просмотр таблицы, от которого уходим.
+    Версии в LocMemCache у каждого воркера свои и не видят чужих изменений, поэтому с ним ETag,
+    зависящий от версий (list и ответы с полями пользователя), не ставится - иначе возможен ложный 304.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def get_validators(self, request):
+        variant = self.get_response_variant(request)
+        if (self.action != 'retrieve' or variant) and not versions_shared():
+            return None, None
+        if self.action == 'retrieve':
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            try:
+                updated_at = self.get_queryset().model.objects.filter(**{self.lookup_field: lookup}).values_list(
+                    'updated_at', flat=True).first()
+            except (ValueError, TypeError, ValidationError):
+                updated_at = None
+            if updated_at is None:
+                return None, None
+            state = f'{lookup}:{updated_at.isoformat()}'
+        else:
+            updated_at = None
+            state = f'catalog={get_catalog_version()}'
+
+        # одно и то же состояние с разными параметрами (страница, сортировка, поля) даёт разные ответы
+        raw = f'{request.get_host()}{request.path}?{normalized_params(request)}{variant}:{state}'
+        etag = '"%s"' % md5(raw.encode()).hexdigest()
+        last_modified = int(updated_at.timestamp()) if updated_at else None
+        return etag, last_modified
+
+    def get_response_variant(self, request):
+        return ''
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
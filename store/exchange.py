@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from store import models
+from store.cache import bump_catalog_version
+
+
+EXPORT_FIELDS = ('id', 'name', 'price', 'discount', 'author_name', 'owner_id', 'rating', 'rating_count',
+                 'likes_count', 'bookmarks_count', 'readers_count')
+IMPORT_FIELDS = ('name', 'price', 'discount', 'author_name', 'owner_id')
+FORMATS = ('ndjson', 'csv')
+
+
+def export_rows(queryset, chunk_size=2000):
+    # values() + серверный курсор: память не зависит от размера каталога
+    return queryset.order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def _export_value(value):
+    # Decimal строкой, как в API (COERCE_DECIMAL_TO_STRING)
+    return value if value is None or isinstance(value, (int, str)) else str(value)
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, map(_export_value, row))), ensure_ascii=False) + '\n'
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_export(queryset, export_format, chunk_size=2000):
+    rows = export_rows(queryset, chunk_size)
+    return iter_ndjson(rows) if export_format == 'ndjson' else iter_csv(rows)
+
+
+def read_rows(stream, import_format):
+    if import_format == 'ndjson':
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line    # сериализатор отклонит такую строку как не-словарь
+    else:
+        for row in csv.DictReader(stream):
+            yield {key: (None if value == '' else value) for key, value in row.items()}
+
+
+class BookImportSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    name = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=7, decimal_places=2)
+    discount = serializers.DecimalField(max_digits=7, decimal_places=2, required=False, default=0)
+    author_name = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+    owner_id = serializers.IntegerField(required=False, allow_null=True)
+
+
+def import_batch(rows):
+    """
+    Валидирует и записывает одну пачку: книги с существующим id - bulk_update, остальные - bulk_create.
+    rows - список пар (номер строки, dict). Возвращает (создано, обновлено, ошибки).
+    """
+    valid, errors = [], []
+    for line, row in rows:
+        serializer = BookImportSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((line, serializer.validated_data))
+        else:
+            errors.append((line, serializer.errors))
+
+    owner_ids = {data['owner_id'] for _, data in valid if data.get('owner_id')}
+    known_owners = set(get_user_model().objects.filter(id__in=owner_ids).values_list('id', flat=True))
+    ids = {data['id'] for _, data in valid if data.get('id')}
+
+    with transaction.atomic():
+        existing = models.Book.objects.select_for_update().in_bulk(ids)
+        to_create, to_update = [], []
+        seen_ids = {}
+        now = timezone.now()
+        for line, data in valid:
+            if data.get('owner_id') and data['owner_id'] not in known_owners:
+                errors.append((line, {'owner_id': ['Пользователь не найден']}))
+                continue
+            # второй новой книге с тем же id bulk_create ответил бы IntegrityError на всю пачку
+            if data.get('id') in seen_ids:
+                errors.append((line, {'id': [f'Этот id уже есть в строке {seen_ids[data["id"]]}']}))
+                continue
+            if data.get('id'):
+                seen_ids[data['id']] = line
+            book = existing.get(data.get('id'))
+            if book is None:
+                to_create.append(models.Book(**data))
+                continue
+            for name in IMPORT_FIELDS:
+                setattr(book, name, data.get(name, getattr(book, name)))
+            book.updated_at = now
+            to_update.append(book)
+
+        # книги с явным id - первыми, затем последовательность подтягивается к max(id): иначе книги без id
+        # из этой или следующих пачек получили бы уже занятые id и IntegrityError посреди импорта
+        with_ids = [book for book in to_create if book.id]
+        if with_ids:
+            models.Book.objects.bulk_create(with_ids)
+            reset_book_sequence()
+        models.Book.objects.bulk_create([book for book in to_create if not book.id])
+        models.Book.objects.bulk_update(to_update, [*IMPORT_FIELDS, 'updated_at'])
+        if to_create or to_update:
+            bump_catalog_version()
+    return len(to_create), len(to_update), errors
+
+
+def iter_batches(rows, batch_size):
+    numbered = enumerate(rows, start=1)
+    while True:
+        batch = list(islice(numbered, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def reset_book_sequence():
+    # после bulk_create с явными id последовательность нужно подтянуть к max(id); setval не откатывается
+    # вместе с транзакцией, но и не мешает: id выше max(id) просто останутся пропущенными
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [models.Book]):
+            cursor.execute(sql)
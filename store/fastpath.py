@@ -0,0 +1,49 @@
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+from .serializers import BookValuesSerializer
+
+
+class FastReadMixin:
+    """
+    list/retrieve через values() и BookValuesSerializer вместо экземпляров модели и BookSerializer.
+    Если ответу нужно то, чего values() не даёт (readers_preview), используется обычный путь.
+    """
+    fast_read_enabled = True
+
+    def get_values_serializer(self):
+        if not self.fast_read_enabled:
+            return None
+        fields = self.get_output_fields()
+        if 'readers_preview' in fields:
+            return None
+        return BookValuesSerializer(fields)
+
+    def get_values_queryset(self, values_serializer):
+        queryset = self.filter_queryset(self.get_queryset())
+        # колонки сортировки нужны курсору пагинации
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        columns = dict.fromkeys([*values_serializer.columns, 'id', *ordering])
+        return queryset.values(*columns)
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = self.get_values_serializer()
+        if values_serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = self.get_values_queryset(values_serializer)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(values_serializer.many(rows))
+        return self.get_paginated_response(values_serializer.many(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        values_serializer = self.get_values_serializer()
+        if values_serializer is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(self.get_values_queryset(values_serializer),
+                                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, row)
+        return Response(values_serializer.to_representation(row))
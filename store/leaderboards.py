@@ -0,0 +1,187 @@
+"""
+Лидерборды книг по рейтингу, лайкам и закладкам - за всё время и за последние N дней (BOOK_LEADERBOARD_WINDOWS).
+
+Доска хранится готовой в LeaderboardEntry: BOOK_LEADERBOARD_SIZE лучших книг, /book/top/ читает первые строки
+по индексу и не агрегирует связи. Реакции доски не трогают, а только отмечают книгу в очереди DirtyBook;
+flush_dirty_books пишет изменения её счётчиков с прошлого раза (LeaderboardBaseline) в BookActivity и пересчитывает
+очки только затронутых книг: книга попадает в доску, если обходит последнее место, и выпадает, если перестала
+проходить. Книги за пределами доски при этом не просматриваются, поэтому хранится с запасом больше, чем отдаётся,
+а rebuild_leaderboards периодически собирает доски заново - заодно учитывая дни, выпавшие из окна.
+Без запущенной flush_book_counters доски и активность не обновляются вовсе, в том числе
+при BOOK_COUNTERS_WRITE_BEHIND=False, когда счётчики самих книг меняются сразу.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Min, Sum
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from store import models
+
+
+BOARDS = ('rating', 'likes', 'bookmarks')
+
+# поле BookActivity для каждого счётчика книги
+ACTIVITY_FIELDS = {
+    'likes_count': 'likes',
+    'bookmarks_count': 'bookmarks',
+    'rating_sum': 'rating_sum',
+    'rating_count': 'rating_count',
+}
+BOARD_COUNTERS = {
+    'rating': ('rating_sum', 'rating_count'),
+    'likes': ('likes_count', ),
+    'bookmarks': ('bookmarks_count', ),
+}
+# поля книги в ответе /book/top/
+TOP_BOOK_FIELDS = ('id', 'name', 'author_name', 'price', 'rating', 'likes_count', 'bookmarks_count')
+
+
+def get_windows():
+    return [0, *settings.BOOK_LEADERBOARD_WINDOWS]
+
+
+def affected_boards(deltas):
+    return [board for board in BOARDS if any(deltas.get(name) for name in BOARD_COUNTERS[board])]
+
+
+def record_activity(deltas):
+    """
+    Прибавляет изменения счётчиков к активности книг за сегодня. deltas - {book_id: {счётчик книги: изменение}}.
+    Вызывается из flush_dirty_books, где строки LeaderboardBaseline этих книг заблокированы, так что параллельно
+    строки за день тех же книг никто не создаёт.
+    """
+    if not settings.BOOK_LEADERBOARD_WINDOWS:
+        return
+    changes = {}
+    for book_id, book_deltas in deltas.items():
+        book_changes = {ACTIVITY_FIELDS[name]: delta for name, delta in book_deltas.items()
+                        if name in ACTIVITY_FIELDS and delta}
+        if book_changes:
+            changes[book_id] = book_changes
+    if not changes:
+        return
+
+    day = timezone.localdate()
+    existing = list(models.BookActivity.objects.filter(book_id__in=changes, day=day).only('id', 'book_id'))
+    for activity in existing:
+        book_changes = changes.pop(activity.book_id)
+        for name in ACTIVITY_FIELDS.values():
+            setattr(activity, name, F(name) + book_changes.get(name, 0))
+    if existing:
+        models.BookActivity.objects.bulk_update(existing, list(ACTIVITY_FIELDS.values()))
+    models.BookActivity.objects.bulk_create([
+        models.BookActivity(book_id=book_id, day=day, **book_changes) for book_id, book_changes in changes.items()
+    ])
+
+
+def _totals(window_days):
+    if not window_days:
+        return models.Book.objects.values(book_id=F('pk')).annotate(
+            total_likes=F('likes_count'), total_bookmarks=F('bookmarks_count'),
+            total_rating_sum=F('rating_sum'), total_rating_count=F('rating_count'),
+        )
+    since = timezone.localdate() - timedelta(days=window_days - 1)
+    return models.BookActivity.objects.filter(day__gte=since).order_by().values('book_id').annotate(
+        total_likes=Sum('likes'), total_bookmarks=Sum('bookmarks'),
+        total_rating_sum=Sum('rating_sum'), total_rating_count=Sum('rating_count'),
+    )
+
+
+def scores(board, window_days, book_ids=None):
+    """
+    Очки книг, проходящих в доску: values() с book_id и score. Для окна - по BookActivity за последние
+    window_days дней, иначе по счётчикам Book. В доску по рейтингу попадают книги
+    с BOOK_LEADERBOARD_MIN_RATINGS оценками и больше, в остальные - с положительным счётчиком.
+    """
+    rows = _totals(window_days)
+    if book_ids is not None:
+        rows = rows.filter(**{'book_id__in' if window_days else 'pk__in': book_ids})
+    if board == 'rating':
+        rows = rows.filter(total_rating_count__gte=max(settings.BOOK_LEADERBOARD_MIN_RATINGS, 1))
+        # делим в numeric, иначе PostgreSQL выполнит целочисленное деление
+        score = ExpressionWrapper(
+            Cast('total_rating_sum', DecimalField(max_digits=12, decimal_places=2)) / F('total_rating_count'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    else:
+        rows = rows.filter(**{f'total_{board}__gt': 0})
+        score = F(f'total_{board}')
+    return rows.annotate(score=score).values('book_id', 'score')
+
+
+def reset_baselines():
+    # счётчики, изменённые в обход очереди (generate_dataset, recompute_books), - не активность: считаем их учтёнными.
+    # Книги с отметками пропускаем, их изменения ещё запишет flush_dirty_books
+    fields = ', '.join(ACTIVITY_FIELDS)
+    sql = f"""
+        INSERT INTO {models.LeaderboardBaseline._meta.db_table} (book_id, {fields})
+        SELECT id, {fields} FROM {models.Book._meta.db_table} book
+        WHERE NOT EXISTS (SELECT 1 FROM {models.DirtyBook._meta.db_table} mark WHERE mark.book_id = book.id)
+        ON CONFLICT (book_id) DO UPDATE SET {', '.join(f'{name} = EXCLUDED.{name}' for name in ACTIVITY_FIELDS)}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+
+def rebuild(windows=None):
+    """
+    Собирает все доски заново, считает текущие счётчики книг учтёнными и удаляет активность старше
+    самого длинного окна. Возвращает число мест.
+    """
+    windows = get_windows() if windows is None else windows
+    size = settings.BOOK_LEADERBOARD_SIZE
+    created = 0
+    with transaction.atomic():
+        models.LeaderboardEntry.objects.exclude(window_days__in=windows).delete()
+        for window_days in windows:
+            for board in BOARDS:
+                top = scores(board, window_days).order_by('-score', 'book_id')[:size]
+                models.LeaderboardEntry.objects.filter(board=board, window_days=window_days).delete()
+                entries = models.LeaderboardEntry.objects.bulk_create([
+                    models.LeaderboardEntry(board=board, window_days=window_days, book_id=row['book_id'],
+                                            score=row['score'])
+                    for row in top
+                ])
+                created += len(entries)
+        reset_baselines()
+        longest = max(windows)
+        models.BookActivity.objects.filter(day__lte=timezone.localdate() - timedelta(days=longest)).delete()
+    return created
+
+
+def update_entries(book_ids, boards=BOARDS):
+    """Пересчитывает очки книг book_ids и их места в досках boards; остальные книги не трогаются."""
+    book_ids = sorted(set(book_ids))
+    size = settings.BOOK_LEADERBOARD_SIZE
+    if not book_ids or not size:
+        return
+    for window_days in get_windows():
+        for board in boards:
+            current = {row['book_id']: row['score'] for row in scores(board, window_days, book_ids)}
+            entries = models.LeaderboardEntry.objects.filter(board=board, window_days=window_days)
+            stats = entries.aggregate(size=Count('id'), last_score=Min('score'))
+            if stats['size'] >= size:
+                current = {book_id: score for book_id, score in current.items() if score >= stats['last_score']}
+
+            dropped = set(book_ids) - set(current)
+            if dropped:
+                entries.filter(book_id__in=dropped).delete()
+            if not current:
+                continue
+            # book_id, а не book: Django 4.1 подставляет в ON CONFLICT имя поля, а не колонки
+            models.LeaderboardEntry.objects.bulk_create(
+                [models.LeaderboardEntry(board=board, window_days=window_days, book_id=book_id, score=score)
+                 for book_id, score in current.items()],
+                update_conflicts=True, unique_fields=['board', 'window_days', 'book_id'], update_fields=['score'],
+            )
+            if stats['size'] + len(current) > size:
+                overflow = entries.order_by('-score', 'book_id').values('id')[size:]
+                models.LeaderboardEntry.objects.filter(id__in=overflow).delete()
+
+
+def top(board, window_days=0, limit=20):
+    return models.LeaderboardEntry.objects.filter(board=board, window_days=window_days).select_related('book').only(
+        'score', 'book', *(f'book__{name}' for name in TOP_BOOK_FIELDS)).order_by('-score', 'book_id')[:limit]
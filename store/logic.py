@@ -1,9 +1,382 @@
-from django.db.models import Avg
+from datetime import timedelta
+from decimal import Decimal
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import (
+    Avg, Case, Count, DecimalField, ExpressionWrapper, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Least, Now, Round
+from django.utils import timezone
+
+from store import leaderboards
 from store import models
+from store.cache import bump_catalog_version, bump_user_version
+
+
+def _rating_from(rating_sum, rating_count):
+    # делим в numeric, иначе PostgreSQL выполнит целочисленное деление
+    return ExpressionWrapper(
+        Cast(rating_sum, DecimalField(max_digits=12, decimal_places=2)) / rating_count,
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def _rated_relations():
+    return models.UserBookRelation.objects.filter(book=OuterRef('pk'), rating__isnull=False).order_by().values('book')
+
+
+def actual_rating_fields():
+    relations = _rated_relations()
+    return {
+        'rating_sum': Coalesce(Subquery(relations.annotate(value=Sum('rating')).values('value')), 0),
+        'rating_count': Coalesce(Subquery(relations.annotate(value=Count('rating')).values('value')), 0),
+        'rating': Cast(Subquery(relations.annotate(value=Avg('rating')).values('value')),
+                       DecimalField(max_digits=3, decimal_places=2)),
+    }
+
+
+def counter_deltas(old_state, new_state):
+    # None вместо состояния: связи ещё нет (создание) или уже нет (удаление)
+    readers_delta = (new_state is not None) - (old_state is not None)
+    old_state, new_state = old_state or {}, new_state or {}
+    old_rating, new_rating = old_state.get('rating'), new_state.get('rating')
+    return {
+        'readers_count': readers_delta,
+        'likes_count': bool(new_state.get('like')) - bool(old_state.get('like')),
+        'bookmarks_count': bool(new_state.get('in_bookmarks')) - bool(old_state.get('in_bookmarks')),
+        'rating_sum': (new_rating or 0) - (old_rating or 0),
+        'rating_count': (new_rating is not None) - (old_rating is not None),
+    }
+
+
+def counter_updates(deltas):
+    updates = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if 'rating_sum' in updates or 'rating_count' in updates:
+        rating_sum = F('rating_sum') + deltas['rating_sum']
+        rating_count = F('rating_count') + deltas['rating_count']
+        updates.update(
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            rating=Case(When(rating_count__gt=-deltas['rating_count'], then=_rating_from(rating_sum, rating_count)),
+                        default=None),
+        )
+    return updates
+
+
+def write_behind_enabled():
+    return settings.BOOK_COUNTERS_WRITE_BEHIND
+
+
+def mark_dirty(book_ids):
+    # вместо пересчёта лидербордов (и при BOOK_COUNTERS_WRITE_BEHIND - UPDATE строки книги, за блокировку которой
+    # дерутся параллельные реакции) - отметка в очереди: только INSERT новой строки, без конфликтов и блокировок
+    now = timezone.now()
+    models.DirtyBook.objects.bulk_create(
+        [models.DirtyBook(book_id=book_id, marked_at=now) for book_id in sorted(set(book_ids))])
+
+
+def flush_dirty_books(delay=None, max_staleness=None, limit=500):
+    """
+    Обрабатывает книги из очереди DirtyBook, по одному разу на книгу: при BOOK_COUNTERS_WRITE_BEHIND
+    пересчитывает счётчики и рейтинг агрегатами, пишет их изменение с прошлого пересчёта (LeaderboardBaseline)
+    в BookActivity и обновляет места книг в лидербордах.
+    Берёт книги без новых отметок за delay секунд или с первой отметкой старше max_staleness секунд.
+    Книгу блокирует строка LeaderboardBaseline, параллельные вызовы её пропускают. Удаляются только прочитанные
+    отметки: пришедшая во время пересчёта останется и вызовет ещё один, уже без изменений.
+    Возвращает количество обработанных книг.
+    """
+    delay = settings.BOOK_COUNTERS_FLUSH_DELAY if delay is None else delay
+    max_staleness = settings.BOOK_COUNTERS_MAX_STALENESS if max_staleness is None else max_staleness
+    now = timezone.now()
+    due = models.DirtyBook.objects.order_by().values('book_id').annotate(
+        first=Min('marked_at'), last=Max('marked_at'),
+    ).filter(
+        Q(last__lte=now - timedelta(seconds=delay)) | Q(first__lte=now - timedelta(seconds=max_staleness))
+    ).order_by('first')
+    fields = list(leaderboards.ACTIVITY_FIELDS)
+    with transaction.atomic():
+        candidates = list(due.values_list('book_id', flat=True)[:limit])
+        if not candidates:
+            return 0
+        # строки для блокировки: нулевые счётчики верны для книг, которых ещё не было при миграции очереди
+        models.LeaderboardBaseline.objects.bulk_create(
+            [models.LeaderboardBaseline(book_id=book_id) for book_id in sorted(candidates)], ignore_conflicts=True)
+        baselines = {row['book_id']: row for row in models.LeaderboardBaseline.objects.filter(
+            book_id__in=candidates).select_for_update(skip_locked=True).values('book_id', *fields)}
+        if not baselines:
+            return 0
+        book_ids = sorted(baselines)
+        mark_ids = list(models.DirtyBook.objects.filter(book_id__in=book_ids).values_list('id', flat=True))
+        if write_behind_enabled():
+            models.Book.objects.filter(pk__in=book_ids).update(
+                **actual_rating_fields(), **actual_counter_fields(), updated_at=Now())
+        deltas, boards, counted = {}, set(), []
+        for book in models.Book.objects.filter(pk__in=book_ids).values('pk', *fields):
+            deltas[book['pk']] = {name: book[name] - baselines[book['pk']][name] for name in fields}
+            boards.update(leaderboards.affected_boards(deltas[book['pk']]))
+            counted.append(models.LeaderboardBaseline(book_id=book['pk'], **{name: book[name] for name in fields}))
+        leaderboards.record_activity(deltas)
+        models.LeaderboardBaseline.objects.bulk_update(counted, fields)
+        models.DirtyBook.objects.filter(id__in=mark_ids).delete()
+        leaderboards.update_entries(book_ids, [board for board in leaderboards.BOARDS if board in boards])
+        bump_catalog_version()
+    return len(book_ids)
+
+
+def update_counters(book_id, old_state, new_state):
+    # одним UPDATE: в SET все выражения видят старые значения строки,
+    # поэтому параллельные реакции не затирают друг друга
+    deltas = counter_deltas(old_state, new_state)
+    updates = counter_updates(deltas)
+    if not updates:
+        return
+    mark_dirty([book_id])
+    if not write_behind_enabled():
+        models.Book.objects.filter(pk=book_id).update(**updates, updated_at=Now())
+        bump_catalog_version()
+
+
+RELATION_CHANGES_ATTEMPTS = 3
+
+
+def apply_relation_changes(user, items):
+    """
+    Применяет пачку изменений связей пользователя с книгами в одной транзакции: bulk_create/bulk_update
+    вместо save() на каждую строку и один UPDATE счётчиков на книгу. items - провалидированные словари
+    с ключом book и любыми из like/in_bookmarks/rating. Возвращает статус по каждому элементу;
+    книга, встретившаяся в пачке повторно, считается уже созданной.
+    """
+    # параллельный запрос того же пользователя мог создать связь между select_for_update и bulk_create
+    # (уникальность user+book): транзакция откатывается и пачка применяется заново - теперь связь
+    # прочитается под блокировкой, и счётчики посчитаются от её состояния, а не от "связи не было"
+    for attempt in range(RELATION_CHANGES_ATTEMPTS):
+        try:
+            return _apply_relation_changes(user, items)
+        except IntegrityError:
+            if attempt == RELATION_CHANGES_ATTEMPTS - 1:
+                raise
+
+
+def _apply_relation_changes(user, items):
+    book_ids = {item['book'] for item in items}
+    with transaction.atomic():
+        existing_books = set(models.Book.objects.filter(id__in=book_ids).values_list('id', flat=True))
+        relations = {}
+        for relation in models.UserBookRelation.objects.select_for_update().filter(
+                user=user, book_id__in=existing_books).order_by('id'):
+            relations.setdefault(relation.book_id, relation)
+        old_states = {book_id: relation.counted_state() for book_id, relation in relations.items()}
+
+        results = []
+        changed_fields, created = set(), set()
+        for item in items:
+            book_id = item['book']
+            if book_id not in existing_books:
+                results.append({'book': book_id, 'errors': {'book': ['Книга не найдена']}})
+                continue
+
+            relation = relations.get(book_id)
+            if relation is None:
+                relation = relations[book_id] = models.UserBookRelation(user=user, book_id=book_id)
+            changes = {name: value for name, value in item.items()
+                       if name != 'book' and getattr(relation, name) != value}
+            for name, value in changes.items():
+                setattr(relation, name, value)
+            changed_fields.update(changes)
+
+            if book_id not in old_states and book_id not in created:
+                item_status = 'created'
+                created.add(book_id)
+            else:
+                item_status = 'updated' if changes else 'unchanged'
+            results.append({'book': book_id, 'status': item_status})
+
+        models.UserBookRelation.objects.bulk_create(
+            [relation for book_id, relation in relations.items() if book_id not in old_states])
+        to_update = [relation for book_id, relation in relations.items()
+                     if book_id in old_states and relation.counted_state() != old_states[book_id]]
+        if to_update and changed_fields:
+            models.UserBookRelation.objects.bulk_update(to_update, sorted(changed_fields))
+
+        book_updates = {}
+        for book_id, relation in relations.items():
+            updates = counter_updates(counter_deltas(old_states.get(book_id), relation.counted_state()))
+            if updates:
+                book_updates[book_id] = updates
+            relation.old_state = relation.counted_state()
+        if book_updates:
+            mark_dirty(book_updates)
+            if not write_behind_enabled():
+                for book_id, updates in book_updates.items():
+                    models.Book.objects.filter(pk=book_id).update(**updates, updated_at=Now())
+                bump_catalog_version()
+            bump_user_version(user.pk)
+    return results
+
+
+def actual_counter_fields():
+    relations = models.UserBookRelation.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    return {
+        'likes_count': Coalesce(
+            Subquery(relations.annotate(value=Count('id', filter=Q(like=True))).values('value')), 0),
+        'bookmarks_count': Coalesce(
+            Subquery(relations.annotate(value=Count('id', filter=Q(in_bookmarks=True))).values('value')), 0),
+        'readers_count': Coalesce(Subquery(relations.annotate(value=Count('id')).values('value')), 0),
+    }
+
+
+def recalculate_ratings(queryset):
+    # трогаем только разошедшиеся книги, чтобы не сдвигать updated_at (и ETag) у остальных
+    updated = models.Book.objects.filter(pk__in=rating_drift(queryset).values('pk')).update(
+        **actual_rating_fields(), updated_at=Now())
+    bump_catalog_version()
+    return updated
+
+
+def recalculate_counters(queryset):
+    updated = models.Book.objects.filter(pk__in=counters_drift(queryset).values('pk')).update(
+        **actual_counter_fields(), updated_at=Now())
+    bump_catalog_version()
+    return updated
+
+
+def rating_drift(queryset):
+    actual = {f'actual_{name}': expression for name, expression in actual_rating_fields().items()}
+    return queryset.annotate(**actual).filter(
+        ~Q(rating_sum=F('actual_rating_sum')) |
+        ~Q(rating_count=F('actual_rating_count')) |
+        Q(rating__isnull=True, actual_rating__isnull=False) |
+        Q(rating__isnull=False, actual_rating__isnull=True) |
+        Q(rating__lt=F('actual_rating')) |
+        Q(rating__gt=F('actual_rating'))
+    )
+
+
+def counters_drift(queryset):
+    actual = {f'actual_{name}': expression for name, expression in actual_counter_fields().items()}
+    return queryset.annotate(**actual).filter(
+        ~Q(likes_count=F('actual_likes_count')) |
+        ~Q(bookmarks_count=F('actual_bookmarks_count')) |
+        ~Q(readers_count=F('actual_readers_count'))
+    )
+
+
+# правила apply_pricing: скидка в рублях или в процентах от цены, новая цена, изменение цены в процентах
+PRICING_RULES = ('discount', 'discount_percent', 'price', 'price_percent')
+
+
+def _money(expression):
+    field = models.Book._meta.get_field('price')
+    output_field = DecimalField(max_digits=field.max_digits, decimal_places=field.decimal_places)
+    return ExpressionWrapper(Round(expression, field.decimal_places), output_field=output_field)
+
+
+def pricing_updates(rule, value):
+    # в SET все выражения видят цену и скидку до изменения
+    value = Decimal(value)
+    if rule == 'discount':
+        return {'discount': Least(Value(value), F('price'))}
+    if rule == 'discount_percent':
+        return {'discount': _money(F('price') * value / 100)}
+    if rule == 'price':
+        price = Value(value)
+    elif rule == 'price_percent':
+        price = _money(F('price') * (1 + value / 100))
+    else:
+        raise ValueError(f'Неизвестное правило: {rule}')
+    # скидка не больше новой цены
+    return {'price': price, 'discount': Least(F('discount'), price)}
+
+
+def apply_pricing(queryset, rule, value):
+    """
+    Применяет правило цены (PRICING_RULES) ко всем книгам queryset одним UPDATE и один раз сбрасывает кеш.
+    Результат проверяет сама БД: если у какой-то книги значение не помещается в numeric(7, 2),
+    UPDATE откатывается целиком и выбрасывается ValidationError. Возвращает количество изменённых книг.
+    """
+    try:
+        with transaction.atomic():
+            updated = queryset.update(**pricing_updates(rule, value), updated_at=Now())
+    except DataError:
+        field = models.Book._meta.get_field('price')
+        raise ValidationError(f'Цена или скидка выходит за пределы {field.max_digits} знаков '
+                              f'({field.decimal_places} после запятой)')
+    if updated:
+        bump_catalog_version()
+    return updated
+
+
+# поля книги, которые выводятся из связей и пересчитываются recompute_books
+RECOMPUTED_FIELDS = ('likes_count', 'bookmarks_count', 'readers_count', 'rating_sum', 'rating_count', 'rating')
+
+
+def _actual_values_sql(ids):
+    # агрегаты по связям для книг диапазона; книги без связей - с нулями через LEFT JOIN
+    return f"""
+        SELECT book.id AS book_id,
+               COUNT(relation.id) FILTER (WHERE relation."like") AS likes_count,
+               COUNT(relation.id) FILTER (WHERE relation.in_bookmarks) AS bookmarks_count,
+               COUNT(relation.id) AS readers_count,
+               COALESCE(SUM(relation.rating), 0) AS rating_sum,
+               COUNT(relation.rating) AS rating_count,
+               (SUM(relation.rating)::numeric / NULLIF(COUNT(relation.rating), 0))::numeric(3, 2) AS rating
+        FROM {models.Book._meta.db_table} book
+        LEFT JOIN {models.UserBookRelation._meta.db_table} relation ON relation.book_id = book.id
+        WHERE book.id >= %(start)s AND book.id < %(stop)s {'AND book.id = ANY(%(ids)s)' if ids else ''}
+        GROUP BY book.id
+    """
+
+
+def recompute_books(start, stop, ids=None, dry_run=False):
+    """
+    Пересчитывает счётчики и рейтинг книг с id из [start, stop) (и из ids, если они заданы) одним
+    UPDATE ... FROM по агрегатам связей, меняя только разошедшиеся книги. Строки книг блокируются заранее:
+    реакции, начатые до пересчёта, успевают зафиксироваться, а начатые после ждут его и прибавляют к нему.
+    Возвращает (просмотрено книг, изменения): при dry_run - список старых и новых значений без записи в БД,
+    иначе - id изменённых книг.
+    """
+    table = models.Book._meta.db_table
+    params = {'start': start, 'stop': stop, 'ids': list(ids or [])}
+    fields = ', '.join(RECOMPUTED_FIELDS)
+    changed = (f'({", ".join(f"book.{name}" for name in RECOMPUTED_FIELDS)}) IS DISTINCT FROM '
+               f'({", ".join(f"actual.{name}" for name in RECOMPUTED_FIELDS)})')
+    if dry_run:
+        columns = ', '.join(f"'{name}', json_build_array(book.{name}::text, actual.{name}::text)"
+                            for name in RECOMPUTED_FIELDS)
+        sql = f"""
+            WITH actual AS ({_actual_values_sql(ids)})
+            SELECT (SELECT COUNT(*) FROM actual), COALESCE(json_agg(json_build_object('id', book.id, {columns})
+                                                                     ORDER BY book.id), '[]')
+            FROM {table} book JOIN actual ON actual.book_id = book.id
+            WHERE {changed}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    sql = f"""
+        WITH actual AS ({_actual_values_sql(ids)}),
+        changed AS (
+            UPDATE {table} book SET ({fields}, updated_at) =
+                ({', '.join(f'actual.{name}' for name in RECOMPUTED_FIELDS)}, STATEMENT_TIMESTAMP())
+            FROM actual
+            WHERE book.id = actual.book_id AND {changed}
+            RETURNING book.id
+        )
+        SELECT (SELECT COUNT(*) FROM actual), ARRAY(SELECT id FROM changed ORDER BY id)
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT id FROM {table} WHERE id >= %(start)s AND id < %(stop)s '
+                       f'{"AND id = ANY(%(ids)s)" if ids else ""} ORDER BY id FOR UPDATE', params)
+        cursor.execute(sql, params)
+        scanned, book_ids = cursor.fetchone()
+        if book_ids:
+            bump_catalog_version()
+    return scanned, book_ids
 
 
 def set_rating(book):
-    rating = models.UserBookRelation.objects.filter(book=book).aggregate(rating=Avg('rating')).get('rating')
-    book.rating = rating
-    book.save()
+    recalculate_ratings(models.Book.objects.filter(pk=book.pk))
+    book.refresh_from_db(fields=['rating', 'rating_sum', 'rating_count'])
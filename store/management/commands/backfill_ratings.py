@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import logic
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает rating_sum/rating_count/rating книг по оценкам пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только сверить счётчики с Avg по связям, ничего не изменяя')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            drift = logic.rating_drift(Book.objects.all())
+            drifted = drift.count()
+            for book in drift.order_by('id')[:20]:
+                self.stdout.write(
+                    f'{book}: sum {book.rating_sum} != {book.actual_rating_sum}, '
+                    f'count {book.rating_count} != {book.actual_rating_count}, '
+                    f'rating {book.rating} != {book.actual_rating}'
+                )
+            if drifted:
+                raise CommandError(f'Расхождений: {drifted}')
+            self.stdout.write(self.style.SUCCESS('Счётчики рейтинга совпадают с оценками'))
+            return
+
+        updated = logic.recalculate_ratings(Book.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Исправлено книг: {updated}'))
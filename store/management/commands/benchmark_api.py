@@ -0,0 +1,180 @@
+import json
+import subprocess
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store.management.commands.generate_dataset import benchmark_username
+from store.metrics import QueryRecorder
+from store.models import Book
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет сценарии BookViewSet (список, поиск, фильтр, сортировка, страницы, карточка) и обновление '
+        'UserBookRelation через тестовый клиент Django на текущей БД. Печатает req/s, p50/p95/p99 и запросов '
+        'к БД на запрос; --json/--output для сравнения между коммитами, --baseline - сравнить с прошлым прогоном. '
+        'Запросы идут от отдельного синтетического пользователя <префикс>-benchmark, сценарий relation меняет '
+        'его лайки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--scenarios', help='Через запятую, по умолчанию все')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--username-prefix', default='bench', help='Префикс generate_dataset')
+        parser.add_argument('--debug', action='store_true',
+                            help='Оставить DEBUG из настроек (по умолчанию DEBUG=False, без debug_toolbar)')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Не отключать кеш ответов (по умолчанию замеряется путь до БД)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+        parser.add_argument('--output', help='Сохранить результат в JSON-файл')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        book = Book.objects.order_by('-readers_count', 'id').first()
+        if book is None:
+            raise CommandError('В БД нет книг, сначала запустите generate_dataset')
+        # не настоящий пользователь: generate_dataset --clear удалит его вместе с остальными синтетическими
+        user, _ = get_user_model().objects.get_or_create(
+            username=benchmark_username(options['username_prefix']), defaults={'password': make_password(None)})
+
+        scenarios = self.get_scenarios(book)
+        if options['scenarios']:
+            names = options['scenarios'].split(',')
+            unknown = set(names) - set(scenarios)
+            if unknown:
+                raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+            scenarios = {name: scenarios[name] for name in names}
+
+        with ExitStack() as stack:
+            if not options['debug']:
+                stack.enter_context(override_settings(DEBUG=False, ALLOWED_HOSTS=[options['host']]))
+            if not options['with_cache']:
+                stack.enter_context(override_settings(
+                    BOOK_API_CACHE='benchmark',
+                    CACHES={**settings.CACHES, 'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                ))
+            client = Client(SERVER_NAME=options['host'])
+            client.force_login(user)
+            results = {name: self.run(client, scenario, options) for name, scenario in scenarios.items()}
+
+        report = {
+            'commit': self.get_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'books': Book.objects.count(),
+            'requests': options['requests'],
+            'cache': options['with_cache'],
+            'debug': settings.DEBUG if options['debug'] else False,
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report, self.load_baseline(options['baseline']))
+
+    def get_scenarios(self, book):
+        url = reverse('book-list')
+        author = book.author_name or ''
+        word = book.name.split()[0]
+        scenarios = {
+            'list': ('get', url),
+            'list_page_size_100': ('get', f'{url}?page_size=100'),
+            'list_with_count': ('get', f'{url}?count=true'),
+            'ordering_price': ('get', f'{url}?ordering=price'),
+            'ordering_price_desc': ('get', f'{url}?ordering=-price'),
+            'filter_price': ('get', f'{url}?price={book.price}'),
+            'search': ('get', f'{url}?search={word}'),
+            'search_author': ('get', f'{url}?search={author.split()[0] if author else word}'),
+            'fields': ('get', f'{url}?fields=id,name,price'),
+            'readers_preview': ('get', f'{url}?readers_preview=3'),
+            'detail': ('get', reverse('book-detail', args=(book.id, ))),
+        }
+        popular = Book.objects.annotate(relations=Count('userbookrelation')).order_by('-relations', 'id').values_list(
+            'id', flat=True)[:50]
+        if popular:
+            scenarios['relation'] = ('patch', [reverse('userbookrelation-detail', args=(book_id, ))
+                                               for book_id in popular])
+        return scenarios
+
+    def run(self, client, scenario, options):
+        method, urls = scenario
+        urls = urls if isinstance(urls, list) else [urls]
+
+        def request(index):
+            url = urls[index % len(urls)]
+            if method == 'patch':
+                return client.patch(url, data=json.dumps({'like': bool(index // len(urls) % 2)}),
+                                    content_type='application/json')
+            return client.get(url)
+
+        for index in range(options['warmup']):
+            request(index)
+
+        latencies, query_counts = [], []
+        started = time.perf_counter()
+        for index in range(options['requests']):
+            recorder = QueryRecorder()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                request_started = time.perf_counter()
+                response = request(index)
+                latencies.append(time.perf_counter() - request_started)
+            if response.status_code != 200:
+                raise CommandError(f'{method.upper()} {urls[index % len(urls)]}: {response.status_code}')
+            query_counts.append(recorder.count)
+        elapsed = time.perf_counter() - started
+
+        return {
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'queries': round(sum(query_counts) / len(query_counts), 2),
+        }
+
+    def get_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def load_baseline(self, path):
+        if not path:
+            return {}
+        with open(path) as baseline:
+            return json.load(baseline).get('scenarios', {})
+
+    def print_report(self, report, baseline):
+        self.stdout.write(f'Коммит {report["commit"]}, книг {report["books"]}, запросов на сценарий '
+                          f'{report["requests"]}, кеш {"включён" if report["cache"] else "выключен"}, '
+                          f'DEBUG={report["debug"]}')
+        self.stdout.write(f'{"сценарий":<22}{"req/s":>9}{"p50 мс":>9}{"p95 мс":>9}{"p99 мс":>9}{"запросов":>10}')
+        for name, result in report['scenarios'].items():
+            line = (f'{name:<22}{result["rps"]:>9}{result["p50_ms"]:>9}{result["p95_ms"]:>9}{result["p99_ms"]:>9}'
+                    f'{result["queries"]:>10}')
+            previous = baseline.get(name)
+            if previous:
+                change = (result['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+                line += f'   p50 {change:+.0f}%, запросов {previous["queries"]} -> {result["queries"]}'
+            self.stdout.write(line)
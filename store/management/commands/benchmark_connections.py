@@ -0,0 +1,97 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.utils import load_backend
+
+from store.pooled_postgresql.base import close_pools, get_pools
+
+
+MODES = {
+    'new_connection': {'CONN_MAX_AGE': 0},
+    'persistent': {'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True},
+    'pool': {'ENGINE': 'store.pooled_postgresql', 'CONN_MAX_AGE': 0},
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку запроса при новом соединении на каждый запрос, постоянных соединениях '
+        '(CONN_MAX_AGE) и пуле store.pooled_postgresql. Запрос моделируется как в обработчике Django: '
+        'close_if_unusable_or_obsolete() в начале и в конце и один SELECT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--pool-size', type=int, default=4)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode, overrides in MODES.items():
+            settings_dict = {**deepcopy(connections[options['database']].settings_dict), **overrides}
+            if mode == 'pool':
+                settings_dict['OPTIONS'] = {**settings_dict['OPTIONS'], 'pool': {'max_size': options['pool_size']}}
+            results[mode] = self.run(mode, settings_dict, options)
+        pool_stats = [pool.get_stats() for (alias, _), pool in get_pools().items() if alias == options['database']]
+        close_pools()
+
+        baseline = results['new_connection']['p50_ms']
+        for result in results.values():
+            result['saved_p50_ms'] = round(baseline - result['p50_ms'], 2)
+        if pool_stats:
+            results['pool']['pool'] = pool_stats[0]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for mode, result in results.items():
+            self.stdout.write(
+                f'{mode}: {result["rps"]:.0f} req/s, p50 {result["p50_ms"]} мс, p99 {result["p99_ms"]} мс, '
+                f'экономия p50 {result["saved_p50_ms"]} мс'
+            )
+        if pool_stats:
+            self.stdout.write(f'Пул: открыто {pool_stats[0]["created"]}, ожиданий {pool_stats[0]["waits"]}, '
+                              f'ждали {pool_stats[0]["wait_seconds"]:.3f} с')
+
+    def run(self, mode, settings_dict, options):
+        backend = load_backend(settings_dict['ENGINE'])
+        per_thread = max(options['requests'] // options['threads'], 1)
+
+        def worker(_):
+            # DatabaseWrapper привязан к потоку, поэтому у каждого потока свой, как у connections;
+            # alias настоящий - по нему django.contrib.postgres ищет соединение при connection_created
+            connection = backend.DatabaseWrapper(settings_dict, options['database'])
+            latencies = []
+            try:
+                for _ in range(per_thread):
+                    started = time.perf_counter()
+                    connection.close_if_unusable_or_obsolete()
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT id FROM store_book ORDER BY id LIMIT 1')
+                        cursor.fetchall()
+                    connection.close_if_unusable_or_obsolete()
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            return latencies
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['threads']) as executor:
+            latencies = [latency for chunk in executor.map(worker, range(options['threads'])) for latency in chunk]
+        elapsed = time.perf_counter() - started
+        return {
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        }
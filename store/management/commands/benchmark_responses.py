@@ -0,0 +1,111 @@
+import json
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from store import compression
+from store.management.commands.benchmark_api import percentile
+from store.models import Book
+from store.renderers import FastJSONRenderer
+from store.views import BookViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает JSONRenderer и FastJSONRenderer и сжатие ответов на списках книг из текущей БД: время '
+        'кодирования одного ответа, байт в ответе без сжатия, gzip и brotli, p50 ответа через тестовый клиент '
+        '(весь стек Django вместе с рендерингом и сжатием) и оценку полного времени с передачей по сети --bandwidth'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Запросов на сценарий и вариант')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов кодирования, берётся лучший')
+        parser.add_argument('--bandwidth', type=float, default=10, help='Мбит/с для оценки времени передачи')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        if not Book.objects.exists():
+            raise CommandError('В БД нет книг, сначала запустите generate_dataset')
+        user = get_user_model().objects.order_by('id').first()
+        url = reverse('book-list')
+        scenarios = {
+            'list': url,
+            'list_page_size_100': f'{url}?page_size=100',
+            'readers_preview': f'{url}?page_size=100&readers_preview=5',
+        }
+        variants = {'json': (JSONRenderer, ''), 'orjson': (FastJSONRenderer, '')}
+        for encoding in compression.get_encodings():
+            variants[f'orjson+{encoding}'] = (FastJSONRenderer, encoding)
+
+        with ExitStack() as stack:
+            # как benchmark_api: без DEBUG и кеша ответов, каждый запрос доходит до БД и рендеринга
+            stack.enter_context(override_settings(
+                DEBUG=False, ALLOWED_HOSTS=[options['host']], BOOK_API_CACHE='benchmark',
+                CACHES={**settings.CACHES, 'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            ))
+            client = Client(SERVER_NAME=options['host'])
+            if user is not None:
+                client.force_login(user)
+            results = {name: self.run(client, url, variants, options) for name, url in scenarios.items()}
+
+        if options['json']:
+            self.stdout.write(json.dumps({'books': Book.objects.count(), 'scenarios': results}, indent=2))
+        else:
+            self.print_report(results, options)
+
+    def run(self, client, url, variants, options):
+        data = client.get(url).data
+        result = {'encode_ms': {}, 'bytes': {}, 'p50_ms': {}, 'total_ms': {}}
+
+        rendered = {}
+        for renderer_class in (JSONRenderer, FastJSONRenderer):
+            renderer = renderer_class()
+            rendered[renderer_class] = renderer.render(data)
+            result['encode_ms'][renderer_class.__name__] = self.best_of(lambda: renderer.render(data), options)
+        if rendered[JSONRenderer] != rendered[FastJSONRenderer]:
+            raise CommandError(f'{url}: вывод FastJSONRenderer отличается от JSONRenderer')
+
+        for name, (renderer_class, encoding) in variants.items():
+            latencies, size = [], None
+            with mock.patch.object(BookViewSet, 'renderer_classes', [renderer_class]):
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    response = client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise CommandError(f'{name} {url}: {response.status_code}')
+                    size = len(response.content)
+            p50 = percentile(latencies, 0.5) * 1000
+            result['bytes'][name] = size
+            result['p50_ms'][name] = round(p50, 2)
+            result['total_ms'][name] = round(p50 + size * 8 / (options['bandwidth'] * 1000), 2)
+        return result
+
+    def best_of(self, func, options):
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return round(min(timings) * 1000, 3)
+
+    def print_report(self, results, options):
+        for name, result in results.items():
+            encode = result['encode_ms']
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f'  кодирование: JSONRenderer {encode["JSONRenderer"]} мс, FastJSONRenderer '
+                              f'{encode["FastJSONRenderer"]} мс '
+                              f'(x{encode["JSONRenderer"] / encode["FastJSONRenderer"]:.1f})')
+            self.stdout.write(f'  {"вариант":<14}{"байт":>10}{"p50 мс":>10}{"всего мс":>10}'
+                              f'  (при {options["bandwidth"]:g} Мбит/с)')
+            for variant, size in result['bytes'].items():
+                self.stdout.write(f'  {variant:<14}{size:>10}{result["p50_ms"][variant]:>10}'
+                                  f'{result["total_ms"][variant]:>10}')
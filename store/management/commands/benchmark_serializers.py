@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+
+from store.models import Book
+from store.serializers import BookSerializer, BookValuesSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает BookSerializer и BookValuesSerializer на книгах из текущей БД: выборка, сериализация, JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Сколько книг сериализовать')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        queryset = Book.objects.annotate(price_with_discount=F('price') - F('discount')).order_by('id')[
+            :options['limit']]
+        if not queryset.exists():
+            raise CommandError('В БД нет книг, сначала загрузите каталог')
+
+        def serializer_path():
+            return BookSerializer(queryset.select_related('owner'), many=True).data
+
+        values_serializer = BookValuesSerializer()
+
+        def values_path():
+            return values_serializer.many(queryset.values(*values_serializer.columns))
+
+        renderer = JSONRenderer()
+        if renderer.render(serializer_path()) != renderer.render(values_path()):
+            raise CommandError('Вывод BookValuesSerializer отличается от BookSerializer')
+
+        results = {}
+        for name, path in (('BookSerializer', serializer_path), ('BookValuesSerializer', values_path)):
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                renderer.render(path())
+                timings.append(time.perf_counter() - started)
+            results[name] = min(timings)
+            self.stdout.write(f'{name}: {results[name] * 1000:.1f} мс на {queryset.count()} книг (лучший из '
+                              f'{options["repeat"]})')
+
+        speedup = results['BookSerializer'] / results['BookValuesSerializer']
+        self.stdout.write(self.style.SUCCESS(f'Ускорение: x{speedup:.1f}'))
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+
+HOST = 'localhost'
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочное сравнение синхронных (WSGI) и асинхронных (ASGI) read-эндпоинтов внутри процесса, '
+        'без сети: WSGI - пул из N потоков, ASGI - N одновременных корутин в одном event loop'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8, help='Потоков WSGI и одновременных запросов ASGI')
+        parser.add_argument('--wsgi-path', default='/book/')
+        parser.add_argument('--asgi-path', default='/async/book/')
+        parser.add_argument('--query', default='', help='Строка запроса, например "ordering=price&page_size=50"')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        # как в продакшене и в project/asgi.py: без DEBUG и синхронного debug_toolbar,
+        # иначе ASGI замеряет переходы между потоками вокруг каждого async view
+        middleware = [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar')]
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[HOST], MIDDLEWARE=middleware):
+            wsgi = self.run_wsgi(options['wsgi_path'], options)
+            asgi = asyncio.run(self.run_asgi(options['asgi_path'], options))
+
+        if options['json']:
+            self.stdout.write(json.dumps({'wsgi': wsgi, 'asgi': asgi}, indent=2))
+            return
+        for name, result in (('WSGI', wsgi), ('ASGI', asgi)):
+            self.stdout.write(
+                f'{name}: {result["requests"]} запросов, {result["rps"]:.0f} req/s, '
+                f'p50 {result["p50_ms"]:.1f} мс, p99 {result["p99_ms"]:.1f} мс'
+            )
+
+    def run_wsgi(self, path, options):
+        handler = WSGIHandler()
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': options['query'], 'SCRIPT_NAME': '',
+            'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(), 'wsgi.multithread': True,
+            'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+
+        def request(_):
+            statuses = []
+            started = time.perf_counter()
+            response = handler({**environ, 'wsgi.input': BytesIO()}, lambda status, headers: statuses.append(status))
+            body = b''.join(response)
+            if not statuses[0].startswith('200'):
+                raise CommandError(f'WSGI {path}: {statuses[0]} {body[:200]!r}')
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            latencies = list(executor.map(request, range(options['requests'])))
+        return summarize(latencies, time.perf_counter() - started)
+
+    async def run_asgi(self, path, options):
+        handler = ASGIHandler()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': options['query'].encode(),
+            'headers': [(b'host', HOST.encode())], 'server': (HOST, 80), 'client': ('127.0.0.1', 50000),
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def request():
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            if messages[0]['status'] != 200:
+                raise CommandError(f'ASGI {path}: {messages[0]["status"]}')
+            return time.perf_counter() - started
+
+        latencies = []
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def limited():
+            async with semaphore:
+                latencies.append(await request())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited() for _ in range(options['requests'])))
+        return summarize(latencies, time.perf_counter() - started)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import exchange
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает каталог книг со счётчиками и рейтингом в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=exchange.FORMATS, default='ndjson')
+        parser.add_argument('--output', default='-', help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        rows = counted(exchange.export_rows(Book.objects.all(), options['chunk_size']))
+        chunks = exchange.iter_ndjson(rows) if options['format'] == 'ndjson' else exchange.iter_csv(rows)
+
+        started = time.monotonic()
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        elapsed = time.monotonic() - started
+
+        rate = exported / max(elapsed, 1e-6)
+        self.stderr.write(f'Выгружено книг: {exported} за {elapsed:.2f} с ({rate:.0f} строк/с)')
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import logic
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрабатывает книги из очереди DirtyBook: пересчитывает счётчики и рейтинг (при '
+        'BOOK_COUNTERS_WRITE_BEHIND), активность и места в лидербордах. С --loop работает как демон'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Не завершаться, опрашивать очередь')
+        parser.add_argument('--interval', type=float, default=1, help='Пауза между опросами в секундах')
+        parser.add_argument('--delay', type=float,
+                            help='Тишина перед пересчётом, по умолчанию BOOK_COUNTERS_FLUSH_DELAY')
+        parser.add_argument('--max-staleness', type=float,
+                            help='Предел устаревания, по умолчанию BOOK_COUNTERS_MAX_STALENESS')
+        parser.add_argument('--limit', type=int, default=500, help='Книг за одну транзакцию')
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = self.flush(options)
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Пересчитано книг: {flushed}'))
+                return
+            if flushed:
+                self.stdout.write(f'Пересчитано книг: {flushed}')
+            else:
+                time.sleep(options['interval'])
+
+    def flush(self, options):
+        flushed = 0
+        while True:
+            count = logic.flush_dirty_books(options['delay'], options['max_staleness'], options['limit'])
+            flushed += count
+            if count < options['limit']:
+                return flushed
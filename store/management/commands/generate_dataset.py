@@ -0,0 +1,140 @@
+import random
+import re
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from store import leaderboards
+from store import logic
+from store.models import Book, UserBookRelation
+
+
+WORDS = ('тайна', 'сад', 'война', 'мир', 'море', 'город', 'ночь', 'дорога', 'дом', 'зима', 'время', 'история',
+         'остров', 'звезда', 'сердце', 'река', 'тень', 'лес', 'письмо', 'память', 'небо', 'песня', 'ветер', 'огонь')
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Елена', 'Сергей', 'Ольга', 'Дмитрий', 'Наталья', 'Алексей')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков', 'Морозов')
+RATING_WEIGHTS = (5, 8, 17, 35, 35)
+
+
+def benchmark_username(prefix):
+    # от его имени benchmark_api меняет связи; тоже синтетический, его удаляет --clear
+    return f'{prefix}-benchmark'
+
+
+def synthetic_users(User, prefix):
+    # только сгенерированные имена: префикс и число или пользователь benchmark_api, настоящий "benchley" не попадает
+    return User.objects.filter(
+        username__regex=rf'^({re.escape(prefix)}\d+|{re.escape(benchmark_username(prefix))})$')
+
+
+def zipf_cum_weights(size, skew):
+    # вес i-го элемента 1 / (i + 1) ** skew: немного популярных и длинный хвост
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет БД синтетическим каталогом через bulk_create: пользователи, книги и связи с '
+        'неравномерной (по Ципфу) популярностью книг и активностью пользователей. Счётчики книг пересчитываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--relations', type=int, default=100000)
+        parser.add_argument('--skew', type=float, default=1.1, help='Показатель Ципфа, 0 - равномерно')
+        parser.add_argument('--seed', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--username-prefix', default='bench')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить сгенерированных пользователей (префикс и число), их связи и их книги '
+                                 'перед генерацией')
+
+    def handle(self, *args, **options):
+        if options['relations'] > options['users'] * options['books']:
+            raise CommandError('Связей больше, чем пар пользователь-книга')
+        rnd = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        User = get_user_model()
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear(User, options['username_prefix'])
+
+            password = make_password(None)
+            first_user = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            users = User.objects.bulk_create([
+                User(username=f'{options["username_prefix"]}{first_user + i}', password=password,
+                     first_name=rnd.choice(FIRST_NAMES), last_name=rnd.choice(LAST_NAMES))
+                for i in range(options['users'])
+            ], batch_size=batch_size)
+            user_ids = [user.id for user in users]
+
+            authors = [f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {i}'
+                       for i in range(max(options['books'] // 20, 1))]
+            author_weights = zipf_cum_weights(len(authors), options['skew'])
+            books = Book.objects.bulk_create([
+                Book(
+                    name=' '.join(rnd.sample(WORDS, rnd.randint(1, 4))).capitalize(),
+                    price=round(rnd.uniform(100, 3000), 2),
+                    discount=round(rnd.uniform(0, 100), 2) if rnd.random() < 0.2 else 0,
+                    author_name=rnd.choices(authors, cum_weights=author_weights)[0],
+                    owner_id=rnd.choice(user_ids) if rnd.random() < 0.5 else None,
+                )
+                for _ in range(options['books'])
+            ], batch_size=batch_size)
+            # популярность не совпадает с порядком id
+            book_ids = [book.id for book in books]
+            rnd.shuffle(book_ids)
+
+            relations = self.generate_relations(rnd, user_ids, book_ids, options)
+            UserBookRelation.objects.bulk_create(relations, batch_size=batch_size)
+
+            # bulk_create не вызывает save(), счётчики книг считаются агрегатами
+            logic.recalculate_counters(Book.objects.filter(id__in=book_ids))
+            logic.recalculate_ratings(Book.objects.filter(id__in=book_ids))
+            leaderboards.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: пользователей {len(users)}, книг {len(books)}, связей {len(relations)}'))
+
+    def clear(self, User, prefix):
+        # только синтетические данные: книги синтетических пользователей и книги без владельца, у которых все
+        # читатели синтетические. Остальной каталог не трогаем, у его книг счётчики поправит удаление связей.
+        # Сгенерированные книги без владельца и без связей отличить от настоящих нельзя, они остаются
+        synthetic = synthetic_users(User, prefix)
+        real = User.objects.exclude(pk__in=synthetic.values('pk'))
+        books = Book.objects.filter(
+            Q(owner__in=synthetic) | Q(owner__isnull=True, readers__in=synthetic) & ~Q(readers__in=real))
+        Book.objects.filter(pk__in=books.values('pk')).delete()
+        UserBookRelation.objects.filter(user__in=synthetic).delete()
+        synthetic.delete()
+
+    def generate_relations(self, rnd, user_ids, book_ids, options):
+        user_weights = zipf_cum_weights(len(user_ids), options['skew'])
+        book_weights = zipf_cum_weights(len(book_ids), options['skew'])
+        target = options['relations']
+        pairs = set()
+        attempts = 0
+        # при сильной неравномерности популярные пары быстро заканчиваются - ограничиваем число попыток
+        while len(pairs) < target and attempts < target * 20:
+            size = target - len(pairs)
+            attempts += size
+            pairs.update(zip(rnd.choices(user_ids, cum_weights=user_weights, k=size),
+                             rnd.choices(book_ids, cum_weights=book_weights, k=size)))
+        if len(pairs) < target:
+            self.stderr.write(f'Удалось подобрать только {len(pairs)} уникальных связей, уменьшите --skew')
+
+        return [
+            UserBookRelation(
+                user_id=user_id, book_id=book_id,
+                like=rnd.random() < 0.3,
+                in_bookmarks=rnd.random() < 0.1,
+                rating=rnd.choices(range(1, 6), weights=RATING_WEIGHTS)[0] if rnd.random() < 0.4 else None,
+            )
+            for user_id, book_id in sorted(pairs)
+        ]
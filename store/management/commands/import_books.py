@@ -0,0 +1,50 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import exchange
+
+
+class Command(BaseCommand):
+    help = 'Загружает книги из NDJSON или CSV пачками через bulk_create/bulk_update, не читая файл целиком'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для загрузки, "-" для stdin')
+        parser.add_argument('--format', choices=exchange.FORMATS,
+                            help='По умолчанию определяется по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-errors', type=int, default=20, help='Сколько ошибок показать')
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        if options['path'] == '-':
+            self.load(sys.stdin, import_format, options)
+            return
+        try:
+            stream = open(options['path'], encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+        with stream:
+            self.load(stream, import_format, options)
+
+    def load(self, stream, import_format, options):
+        created = updated = failed = processed = 0
+        started = time.monotonic()
+
+        for batch in exchange.iter_batches(exchange.read_rows(stream, import_format), options['batch_size']):
+            batch_created, batch_updated, errors = exchange.import_batch(batch)
+            for line, error in errors[:max(options['max_errors'] - failed, 0)]:
+                self.stderr.write(f'Строка {line}: {error}')
+            created += batch_created
+            updated += batch_updated
+            failed += len(errors)
+            processed += len(batch)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Обработано строк: {processed} ({processed / max(elapsed, 1e-6):.0f} строк/с)')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {created}, обновлено: {updated}, с ошибками: {failed} '
+            f'за {elapsed:.2f} с ({processed / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store import leaderboards
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает лидерборды книг заново по счётчикам и BookActivity и удаляет активность старше самого '
+        'длинного окна. Запускать периодически (например, раз в час): между пересборками доски обновляются '
+        'только по изменившимся книгам'
+    )
+
+    def handle(self, *args, **options):
+        created = leaderboards.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Мест в лидербордах: {created}'))
@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+
+from store import leaderboards
+from store import logic
+from store.cache import bump_catalog_version
+from store.models import Book
+
+
+def recompute_chunk(start, stop, ids, dry_run):
+    # в процессе пула: соединение открывается первым запросом и закрывается после чанка,
+    # процессы пула завершаются без закрытия соединений
+    try:
+        return logic.recompute_books(start, stop, ids, dry_run)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики и рейтинг книг (logic.RECOMPUTED_FIELDS) по связям: каталог делится на '
+        'диапазоны id, каждый пересчитывается одним UPDATE ... FROM по агрегатам, диапазоны - параллельно '
+        'в --workers процессах со своими соединениями. --dry-run показывает расхождения без изменений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-id', type=int)
+        parser.add_argument('--max-id', type=int)
+        parser.add_argument('--ids', help='Только эти книги, id через запятую')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Ширина диапазона id на один UPDATE')
+        parser.add_argument('--workers', type=int, default=1, help='Процессов; 1 - в текущем процессе')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+        parser.add_argument('--show', type=int, default=20, help='Сколько расхождений вывести при --dry-run')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size и --workers должны быть больше нуля')
+        chunks = self.get_chunks(options)
+        dry_run = options['dry_run']
+
+        started = time.perf_counter()
+        scanned, changes = 0, []
+        for done, (chunk, (chunk_scanned, chunk_changes)) in enumerate(self.run(chunks, options), start=1):
+            scanned += chunk_scanned
+            changes += chunk_changes
+            elapsed = time.perf_counter() - started
+            if options['verbosity'] > 1 or (options['verbosity'] == 1 and len(chunks) > 1):
+                self.stdout.write(
+                    f'[{done}/{len(chunks)}] id {chunk[0]}-{chunk[1] - 1}: книг {chunk_scanned}, '
+                    f'расхождений {len(chunk_changes)}; всего {scanned}, {scanned / elapsed:.0f} книг/с'
+                )
+        elapsed = time.perf_counter() - started
+
+        if dry_run:
+            for change in sorted(changes, key=lambda change: change['id'])[:options['show']]:
+                self.stdout.write(self.format_change(change))
+        elif changes:
+            # процессы пула сбрасывали кеш у себя; доски за всё время собираются по счётчикам книг
+            bump_catalog_version()
+            leaderboards.rebuild()
+
+        summary = (f'Книг: {scanned}, {"расхождений" if dry_run else "исправлено"}: {len(changes)}, '
+                   f'{elapsed:.2f} с, {scanned / elapsed if elapsed else 0:.0f} книг/с')
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def format_change(self, change):
+        values = [(name, *change[name]) for name in logic.RECOMPUTED_FIELDS]
+        return f'ID {change["id"]}: ' + ', '.join(f'{name} {old} -> {new}' for name, old, new in values if old != new)
+
+    def get_chunks(self, options):
+        size = options['chunk_size']
+        if options['ids']:
+            try:
+                ids = sorted({int(book_id) for book_id in options['ids'].split(',') if book_id.strip()})
+            except ValueError:
+                raise CommandError('--ids: ожидаются id через запятую')
+            groups = [ids[index:index + size] for index in range(0, len(ids), size)]
+            return [(group[0], group[-1] + 1, group) for group in groups]
+
+        bounds = Book.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        start = max(options['min_id'] or 0, bounds['min_id'] or 0)
+        stop = bounds['max_id'] or 0
+        if options['max_id'] is not None:
+            stop = min(stop, options['max_id'])
+        stop += 1
+        return [(chunk_start, min(chunk_start + size, stop), None) for chunk_start in range(start, stop, size)]
+
+    def run(self, chunks, options):
+        if options['workers'] == 1:
+            for chunk in chunks:
+                yield chunk, logic.recompute_books(*chunk, dry_run=options['dry_run'])
+            return
+
+        # дочерние процессы не должны унаследовать открытое соединение родителя
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            futures = {pool.submit(recompute_chunk, *chunk, options['dry_run']): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
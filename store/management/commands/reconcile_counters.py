@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from store import logic
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает likes_count/bookmarks_count/readers_count книг одним UPDATE и сообщает о расхождениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        drift = logic.counters_drift(Book.objects.all()).order_by('id')
+        drifted = 0
+        for book in drift.values('id', 'likes_count', 'actual_likes_count', 'bookmarks_count',
+                                 'actual_bookmarks_count', 'readers_count', 'actual_readers_count').iterator():
+            drifted += 1
+            self.stdout.write(
+                f'ID {book["id"]}: likes {book["likes_count"]} -> {book["actual_likes_count"]}, '
+                f'bookmarks {book["bookmarks_count"]} -> {book["actual_bookmarks_count"]}, '
+                f'readers {book["readers_count"]} -> {book["actual_readers_count"]}'
+            )
+
+        if options['dry_run']:
+            self.stdout.write(f'Расхождений: {drifted}')
+            return
+
+        updated = logic.recalculate_counters(Book.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Исправлено книг: {updated}'))
@@ -0,0 +1,41 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from store import logic
+from store.serializers import BookPricingSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Меняет цены или скидки книг одним UPDATE: правило (--rule) и значение (--value) применяются ко всем '
+        'книгам фильтра, кеш сбрасывается один раз. То же, что POST /book/pricing/'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rule', required=True, choices=logic.PRICING_RULES)
+        parser.add_argument('--value', required=True)
+        parser.add_argument('--ids', help='id книг через запятую')
+        parser.add_argument('--author-name')
+        parser.add_argument('--min-price')
+        parser.add_argument('--max-price')
+        parser.add_argument('--all', action='store_true', help='Все книги каталога')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать книги под фильтр')
+
+    def handle(self, *args, **options):
+        data = {name: options[name] for name in ('rule', 'value', 'author_name', 'min_price', 'max_price', 'all')
+                if options[name] is not None}
+        if options['ids']:
+            data['ids'] = [book_id.strip() for book_id in options['ids'].split(',') if book_id.strip()]
+        serializer = BookPricingSerializer(data=data)
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+
+        queryset = serializer.get_queryset()
+        if options['dry_run']:
+            self.stdout.write(f'Книг под фильтр: {queryset.count()}')
+            return
+        try:
+            updated = logic.apply_pricing(queryset, options['rule'], serializer.validated_data['value'])
+        except ValidationError as exc:
+            raise CommandError(exc.messages[0])
+        self.stdout.write(self.style.SUCCESS(f'Изменено книг: {updated}'))
@@ -0,0 +1,205 @@
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('store.metrics')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# сколько запросов к БД держать для журнала медленных запросов
+SLOW_LOG_QUERIES = 50
+
+HISTOGRAMS = {
+    'request_duration_seconds': ('Время обработки запроса', DURATION_BUCKETS),
+    'db_duration_seconds': ('Суммарное время запросов к БД', DURATION_BUCKETS),
+    'render_duration_seconds': ('Время рендеринга ответа (сериализация в JSON)', DURATION_BUCKETS),
+    'db_queries': ('Количество запросов к БД', QUERIES_BUCKETS),
+    'response_size_bytes': ('Размер тела ответа', SIZE_BUCKETS),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Гистограммы в памяти процесса, как статистика кеша в store.cache: у каждого воркера свои,
+    Prometheus собирает их с каждого процесса отдельно.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+        # функции (prefix) -> строки метрик, например статистика пула соединений
+        self.collectors = []
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def observe(self, labels, status_code, values):
+        with self.lock:
+            key = (*labels, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values.items():
+                key = (name, labels)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+
+    def render(self, prefix='book_store_'):
+        lines = [f'# HELP {prefix}requests_total Обработано запросов', f'# TYPE {prefix}requests_total counter']
+        with self.lock:
+            for (view, method, status_code), value in sorted(self.requests.items()):
+                labels = f'view="{view}",method="{method}",status="{status_code}"'
+                lines.append(f'{prefix}requests_total{{{labels}}} {value}')
+            for name, (description, buckets) in HISTOGRAMS.items():
+                lines += [f'# HELP {prefix}{name} {description}', f'# TYPE {prefix}{name} histogram']
+                for (histogram_name, (view, method)), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    labels = f'view="{view}",method="{method}"'
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{prefix}{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{prefix}{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{prefix}{name}_count{{{labels}}} {histogram.count}')
+        for collector in self.collectors:
+            lines += collector(prefix)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    # execute_wrapper: количество и время запросов, SQL - только первые SLOW_LOG_QUERIES для журнала
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if len(self.queries) < SLOW_LOG_QUERIES:
+                self.queries.append((duration, sql))
+
+
+class MetricsMiddleware:
+    """
+    Количество и время запросов к БД, время рендеринга и размер ответа по каждому view.
+    Замеряется доля BOOK_METRICS_SAMPLE_RATE запросов; запросы дольше BOOK_METRICS_SLOW_REQUEST_MS
+    пишутся в лог store.metrics вместе с SQL.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.BOOK_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._metrics_render = 0
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.record_queries(stack, recorder)
+            response = self.get_response(request)
+        return self.observe(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.BOOK_METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._metrics_render = 0
+        started = time.perf_counter()
+        # соединения привязаны к потоку, а ORM async view работает в потоке sync_to_async (один на запрос):
+        # обёртки ставятся и снимаются там же
+        stack = ExitStack()
+        await sync_to_async(self.record_queries)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.observe(request, response, recorder, time.perf_counter() - started)
+
+    @staticmethod
+    def record_queries(stack, recorder):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    def observe(self, request, response, recorder, duration):
+        match = request.resolver_match
+        labels = (match.view_name if match else 'unmatched', request.method)
+        values = {
+            'request_duration_seconds': duration,
+            'db_duration_seconds': recorder.duration,
+            'render_duration_seconds': request._metrics_render,
+            'db_queries': recorder.count,
+        }
+        if not response.streaming:
+            values['response_size_bytes'] = len(response.content)
+        registry.observe(labels, response.status_code, values)
+
+        if duration * 1000 >= settings.BOOK_METRICS_SLOW_REQUEST_MS:
+            self.log_slow_request(request, duration, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF Response рендерится после middleware: засекаем начало здесь, конец - в post_render callback
+        if hasattr(request, '_metrics_render'):
+            started = time.perf_counter()
+
+            def rendered(response):
+                request._metrics_render = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, duration, recorder):
+        queries = sorted(recorder.queries, key=lambda query: query[0], reverse=True)
+        logger.warning(
+            'Медленный запрос %s %s: %.0f мс, запросов к БД %s (%.0f мс)\n%s',
+            request.method, request.get_full_path(), duration * 1000, recorder.count, recorder.duration * 1000,
+            '\n'.join(f'{query_duration * 1000:.1f} мс: {sql}' for query_duration, sql in queries),
+        )
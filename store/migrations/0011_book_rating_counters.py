@@ -0,0 +1,66 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import (
+    Case, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, When,
+)
+from django.db.models.functions import Cast, Coalesce
+
+
+def backfill_rating_counters(apps, schema_editor):
+    Book = apps.get_model("store", "Book")
+    UserBookRelation = apps.get_model("store", "UserBookRelation")
+
+    relations = (
+        UserBookRelation.objects.filter(book=OuterRef("pk"), rating__isnull=False)
+        .order_by()
+        .values("book")
+    )
+    Book.objects.update(
+        rating_sum=Coalesce(
+            Subquery(relations.annotate(value=Sum("rating")).values("value")), 0
+        ),
+        rating_count=Coalesce(
+            Subquery(relations.annotate(value=Count("rating")).values("value")), 0
+        ),
+    )
+    # старый set_rating мог не учесть изменённую оценку - rating приводим к тем же счётчикам;
+    # делим в numeric, иначе PostgreSQL выполнит целочисленное деление
+    Book.objects.update(
+        rating=Case(
+            When(
+                rating_count__gt=0,
+                then=ExpressionWrapper(
+                    Cast("rating_sum", DecimalField(max_digits=12, decimal_places=2))
+                    / F("rating_count"),
+                    output_field=DecimalField(max_digits=3, decimal_places=2),
+                ),
+            ),
+            default=None,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0010_book_rating"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="rating_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество оценок"
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="rating_sum",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Сумма оценок"
+            ),
+        ),
+        migrations.RunPython(backfill_rating_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:01
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_reaction_counters(apps, schema_editor):
+    Book = apps.get_model("store", "Book")
+    UserBookRelation = apps.get_model("store", "UserBookRelation")
+
+    relations = (
+        UserBookRelation.objects.filter(book=OuterRef("pk")).order_by().values("book")
+    )
+    Book.objects.update(
+        likes_count=Coalesce(
+            Subquery(
+                relations.annotate(value=Count("id", filter=Q(like=True))).values(
+                    "value"
+                )
+            ),
+            0,
+        ),
+        bookmarks_count=Coalesce(
+            Subquery(
+                relations.annotate(
+                    value=Count("id", filter=Q(in_bookmarks=True))
+                ).values("value")
+            ),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0011_book_rating_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="bookmarks_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="В закладках"
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="likes_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Лайки"
+            ),
+        ),
+        migrations.RunPython(backfill_reaction_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_readers_count(apps, schema_editor):
+    Book = apps.get_model("store", "Book")
+    UserBookRelation = apps.get_model("store", "UserBookRelation")
+
+    relations = (
+        UserBookRelation.objects.filter(book=OuterRef("pk")).order_by().values("book")
+    )
+    Book.objects.update(
+        readers_count=Coalesce(
+            Subquery(relations.annotate(value=Count("id")).values("value")), 0
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0012_book_reaction_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="readers_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Читатели"
+            ),
+        ),
+        migrations.RunPython(backfill_readers_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:03
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE FUNCTION store_book_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.author_name, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER store_book_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, author_name, search_vector ON store_book
+    FOR EACH ROW EXECUTE FUNCTION store_book_search_vector_update();
+
+UPDATE store_book SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS store_book_search_vector_trigger ON store_book;
+DROP FUNCTION IF EXISTS store_book_search_vector_update();
+"""
+
+
+def create_author_trigram_index(apps, schema_editor):
+    # pg_trgm ставится вместе с contrib, которого может не быть; без него поиск работает только по tsvector
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS store_book_author_name_trgm "
+            "ON store_book USING gin (author_name gin_trgm_ops)"
+        )
+
+
+def drop_author_trigram_index(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS store_book_author_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0013_book_readers_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="store_book_search_vector_gin"
+            ),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+        migrations.RunPython(create_author_trigram_index, drop_author_trigram_index),
+    ]
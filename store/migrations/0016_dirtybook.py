@@ -0,0 +1,40 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0015_book_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DirtyBook",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="store.book",
+                    ),
+                ),
+                ("marked_at", models.DateTimeField(verbose_name="Впервые отмечена")),
+                (
+                    "touched_at",
+                    models.DateTimeField(
+                        db_index=True, verbose_name="Последнее изменение"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Книга к пересчёту",
+                "verbose_name_plural": "Книги к пересчёту",
+            },
+        ),
+    ]
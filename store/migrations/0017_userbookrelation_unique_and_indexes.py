@@ -0,0 +1,121 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:16
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, DecimalField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+
+
+def merge_duplicate_relations(apps, schema_editor):
+    # до уникального ограничения: дубли (user, book) сливаются в самую раннюю связь,
+    # лайк/закладка - если стояли хоть в одной, оценка - последняя поставленная
+    Book = apps.get_model("store", "Book")
+    UserBookRelation = apps.get_model("store", "UserBookRelation")
+
+    duplicates = (
+        UserBookRelation.objects.values("user", "book")
+        .annotate(total=Count("id"))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    book_ids = set()
+    for duplicate in duplicates.iterator():
+        relations = list(
+            UserBookRelation.objects.filter(
+                user=duplicate["user"], book=duplicate["book"]
+            ).order_by("id")
+        )
+        kept, extra = relations[0], relations[1:]
+        kept.like = any(relation.like for relation in relations)
+        kept.in_bookmarks = any(relation.in_bookmarks for relation in relations)
+        ratings = [
+            relation.rating for relation in relations if relation.rating is not None
+        ]
+        kept.rating = ratings[-1] if ratings else None
+        kept.save(update_fields=["like", "in_bookmarks", "rating"])
+        UserBookRelation.objects.filter(
+            id__in=[relation.id for relation in extra]
+        ).delete()
+        book_ids.add(duplicate["book"])
+
+    if not book_ids:
+        return
+    relations = (
+        UserBookRelation.objects.filter(book=OuterRef("pk")).order_by().values("book")
+    )
+    rated = relations.filter(rating__isnull=False)
+    Book.objects.filter(pk__in=book_ids).update(
+        rating_sum=Coalesce(
+            Subquery(rated.annotate(value=Sum("rating")).values("value")), 0
+        ),
+        rating_count=Coalesce(
+            Subquery(rated.annotate(value=Count("rating")).values("value")), 0
+        ),
+        rating=Cast(
+            Subquery(rated.annotate(value=Avg("rating")).values("value")),
+            DecimalField(max_digits=3, decimal_places=2),
+        ),
+        likes_count=Coalesce(
+            Subquery(
+                relations.annotate(value=Count("id", filter=Q(like=True))).values(
+                    "value"
+                )
+            ),
+            0,
+        ),
+        bookmarks_count=Coalesce(
+            Subquery(
+                relations.annotate(
+                    value=Count("id", filter=Q(in_bookmarks=True))
+                ).values("value")
+            ),
+            0,
+        ),
+        readers_count=Coalesce(
+            Subquery(relations.annotate(value=Count("id")).values("value")), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0016_dirtybook"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["price", "id"], name="store_book_price_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="userbookrelation",
+            index=models.Index(
+                condition=models.Q(("like", True)),
+                fields=["book"],
+                name="store_ubr_book_like_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userbookrelation",
+            index=models.Index(
+                condition=models.Q(("in_bookmarks", True)),
+                fields=["book"],
+                name="store_ubr_book_bookmarks_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userbookrelation",
+            index=models.Index(
+                condition=models.Q(("rating__isnull", False)),
+                fields=["book", "rating"],
+                name="store_ubr_book_rating_idx",
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_relations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="userbookrelation",
+            constraint=models.UniqueConstraint(
+                fields=("user", "book"), name="store_userbookrelation_user_book_uniq"
+            ),
+        ),
+    ]
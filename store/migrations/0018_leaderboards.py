@@ -0,0 +1,124 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0017_userbookrelation_unique_and_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "board",
+                    models.CharField(
+                        choices=[
+                            ("rating", "По рейтингу"),
+                            ("likes", "По лайкам"),
+                            ("bookmarks", "По закладкам"),
+                        ],
+                        max_length=16,
+                        verbose_name="Доска",
+                    ),
+                ),
+                (
+                    "window_days",
+                    models.PositiveSmallIntegerField(
+                        default=0, verbose_name="Окно, дней"
+                    ),
+                ),
+                (
+                    "score",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="Очки"
+                    ),
+                ),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="store.book",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Место в лидерборде",
+                "verbose_name_plural": "Лидерборды",
+            },
+        ),
+        migrations.CreateModel(
+            name="BookActivity",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(db_index=True, verbose_name="День")),
+                ("likes", models.IntegerField(default=0, verbose_name="Лайки")),
+                (
+                    "bookmarks",
+                    models.IntegerField(default=0, verbose_name="В закладках"),
+                ),
+                (
+                    "rating_sum",
+                    models.IntegerField(default=0, verbose_name="Сумма оценок"),
+                ),
+                (
+                    "rating_count",
+                    models.IntegerField(default=0, verbose_name="Количество оценок"),
+                ),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="store.book",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Активность по книге",
+                "verbose_name_plural": "Активность по книгам",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="leaderboardentry",
+            index=models.Index(
+                fields=["board", "window_days", "-score", "book"],
+                name="store_leaderboard_rank_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="leaderboardentry",
+            constraint=models.UniqueConstraint(
+                fields=("board", "window_days", "book"),
+                name="store_leaderboard_book_uniq",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="bookactivity",
+            constraint=models.UniqueConstraint(
+                fields=("book", "day"), name="store_bookactivity_book_day_uniq"
+            ),
+        ),
+    ]
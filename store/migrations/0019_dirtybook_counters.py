@@ -0,0 +1,33 @@
+# Generated by Django 4.1.2 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0018_leaderboards"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dirtybook",
+            name="bookmarks_count",
+            field=models.IntegerField(null=True, verbose_name="В закладках"),
+        ),
+        migrations.AddField(
+            model_name="dirtybook",
+            name="likes_count",
+            field=models.IntegerField(null=True, verbose_name="Лайки"),
+        ),
+        migrations.AddField(
+            model_name="dirtybook",
+            name="rating_count",
+            field=models.IntegerField(null=True, verbose_name="Количество оценок"),
+        ),
+        migrations.AddField(
+            model_name="dirtybook",
+            name="rating_sum",
+            field=models.IntegerField(null=True, verbose_name="Сумма оценок"),
+        ),
+    ]
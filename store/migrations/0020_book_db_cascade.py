@@ -0,0 +1,81 @@
+# Generated by Django 4.1.2 on 2026-10-18 11:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+CASCADE_MODELS = ("bookactivity", "dirtybook", "leaderboardentry", "userbookrelation")
+
+
+def set_book_on_delete(action, model_names=CASCADE_MODELS):
+    # Django не задаёт ON DELETE у внешних ключей: пересоздаём ограничение на book_id с тем же именем
+    def operation(apps, schema_editor):
+        quote = schema_editor.quote_name
+        book_table = apps.get_model("store", "Book")._meta.db_table
+        # ограничения таблиц, созданных в той же миграции, Django добавляет в её конце - создаём их сейчас
+        while schema_editor.deferred_sql:
+            schema_editor.execute(schema_editor.deferred_sql.pop(0))
+        for model_name in model_names:
+            model = apps.get_model("store", model_name)
+            table = model._meta.db_table
+            column = model._meta.get_field("book").column
+            with schema_editor.connection.cursor() as cursor:
+                constraints = schema_editor.connection.introspection.get_constraints(cursor, table)
+            for name, info in constraints.items():
+                if info["foreign_key"] != (book_table, "id") or info["columns"] != [column]:
+                    continue
+                schema_editor.execute(f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}")
+                schema_editor.execute(
+                    f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} FOREIGN KEY ({quote(column)}) "
+                    f"REFERENCES {quote(book_table)} (id) {action} DEFERRABLE INITIALLY DEFERRED"
+                )
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0019_dirtybook_counters"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bookactivity",
+            name="book",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="store.book",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="dirtybook",
+            name="book",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                primary_key=True,
+                related_name="+",
+                serialize=False,
+                to="store.book",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="leaderboardentry",
+            name="book",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="store.book",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="userbookrelation",
+            name="book",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                to="store.book",
+            ),
+        ),
+        migrations.RunPython(set_book_on_delete("ON DELETE CASCADE"), set_book_on_delete("")),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 4.1.2 on 2026-10-18 14:20
+
+import importlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+set_book_on_delete = importlib.import_module("store.migrations.0020_book_db_cascade").set_book_on_delete
+
+COUNTERS = ("likes_count", "bookmarks_count", "rating_sum", "rating_count")
+
+
+def move_to_marks(apps, schema_editor):
+    # учтённые счётчики - снимок из очереди, если он есть, иначе текущие; каждая книга в очереди - одна отметка
+    Book = apps.get_model("store", "Book")
+    OldDirtyBook = apps.get_model("store", "DirtyBookOld")
+    DirtyBook = apps.get_model("store", "DirtyBook")
+    LeaderboardBaseline = apps.get_model("store", "LeaderboardBaseline")
+    snapshots = {row["book_id"]: row for row in OldDirtyBook.objects.filter(
+        likes_count__isnull=False).values("book_id", *COUNTERS)}
+    for books in _chunks(Book.objects.order_by("pk").values("pk", *COUNTERS).iterator(), 1000):
+        LeaderboardBaseline.objects.bulk_create([
+            LeaderboardBaseline(book_id=book["pk"], **{name: counters[name] for name in COUNTERS})
+            for book in books for counters in [snapshots.get(book["pk"], book)]
+        ])
+    DirtyBook.objects.bulk_create([
+        DirtyBook(book_id=row["book_id"], marked_at=row["marked_at"])
+        for row in OldDirtyBook.objects.values("book_id", "marked_at")
+    ])
+
+
+def move_from_marks(apps, schema_editor):
+    OldDirtyBook = apps.get_model("store", "DirtyBookOld")
+    DirtyBook = apps.get_model("store", "DirtyBook")
+    LeaderboardBaseline = apps.get_model("store", "LeaderboardBaseline")
+    marks = DirtyBook.objects.values("book_id").annotate(
+        first=models.Min("marked_at"), last=models.Max("marked_at"))
+    baselines = {row["book_id"]: row for row in LeaderboardBaseline.objects.filter(
+        book_id__in=marks.values("book_id")).values("book_id", *COUNTERS)}
+    OldDirtyBook.objects.bulk_create([
+        OldDirtyBook(book_id=row["book_id"], marked_at=row["first"], touched_at=row["last"],
+                     **{name: baselines.get(row["book_id"], {}).get(name, 0) for name in COUNTERS})
+        for row in marks
+    ])
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0020_book_db_cascade"),
+    ]
+
+    operations = [
+        migrations.RenameModel("DirtyBook", "DirtyBookOld"),
+        # имя первичного ключа не меняется вместе с таблицей и заняло бы имя ключа новой очереди
+        migrations.RunSQL(
+            "ALTER INDEX store_dirtybook_pkey RENAME TO store_dirtybookold_pkey",
+            "ALTER INDEX store_dirtybookold_pkey RENAME TO store_dirtybook_pkey",
+        ),
+        migrations.CreateModel(
+            name="DirtyBook",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("marked_at", models.DateTimeField(db_index=True, verbose_name="Отмечена")),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="store.book",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Книга к пересчёту",
+                "verbose_name_plural": "Книги к пересчёту",
+            },
+        ),
+        migrations.CreateModel(
+            name="LeaderboardBaseline",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="store.book",
+                    ),
+                ),
+                ("likes_count", models.IntegerField(default=0, verbose_name="Лайки")),
+                ("bookmarks_count", models.IntegerField(default=0, verbose_name="В закладках")),
+                ("rating_sum", models.IntegerField(default=0, verbose_name="Сумма оценок")),
+                ("rating_count", models.IntegerField(default=0, verbose_name="Количество оценок")),
+            ],
+            options={
+                "verbose_name": "Учтённые счётчики книги",
+                "verbose_name_plural": "Учтённые счётчики книг",
+            },
+        ),
+        migrations.RunPython(move_to_marks, move_from_marks),
+        # при откате восстановленная старая очередь получает каскад обратно
+        migrations.RunPython(migrations.RunPython.noop, set_book_on_delete("ON DELETE CASCADE", ["dirtybookold"])),
+        migrations.DeleteModel("DirtyBookOld"),
+        migrations.RunPython(
+            set_book_on_delete("ON DELETE CASCADE", ["dirtybook", "leaderboardbaseline"]),
+            set_book_on_delete("", ["dirtybook", "leaderboardbaseline"]),
+        ),
+    ]
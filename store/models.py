@@ -1,5 +1,11 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from store.cache import bump_catalog_version, bump_user_version
 
 
 User = get_user_model()
@@ -14,10 +20,25 @@ class Book(models.Model):
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='owned_books')
     readers = models.ManyToManyField(User, through='UserBookRelation', related_name='books')
     rating = models.DecimalField(verbose_name='Рейтинг', max_digits=3, decimal_places=2, null=True)
+    # счётчики для инкрементального пересчёта рейтинга, rating = rating_sum / rating_count
+    rating_sum = models.PositiveIntegerField(verbose_name='Сумма оценок', default=0, editable=False)
+    rating_count = models.PositiveIntegerField(verbose_name='Количество оценок', default=0, editable=False)
+    likes_count = models.PositiveIntegerField(verbose_name='Лайки', default=0, editable=False)
+    bookmarks_count = models.PositiveIntegerField(verbose_name='В закладках', default=0, editable=False)
+    readers_count = models.PositiveIntegerField(verbose_name='Читатели', default=0, editable=False)
+    # двигается и при изменении счётчиков/рейтинга, по нему считаются ETag и Last-Modified
+    updated_at = models.DateTimeField(verbose_name='Изменена', auto_now=True, db_index=True)
+    # заполняется триггером в БД из name и author_name, см. миграцию 0014
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = "Книга"
         verbose_name_plural = "Список Книг"
+        indexes = [
+            GinIndex(fields=['search_vector'], name='store_book_search_vector_gin'),
+            # фильтр ?price= и сортировка по цене с id в качестве курсора пагинации
+            models.Index(fields=['price', 'id'], name='store_book_price_id_idx'),
+        ]
 
     def __str__(self):
         return f'ID {self.id}: {self.name}'
@@ -33,21 +54,149 @@ class UserBookRelation(models.Model):
     )
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
-    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True)
+    # ON DELETE CASCADE на уровне БД (миграция 0020): удаление книги - один DELETE без обхода связей в Python
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, null=True)
     like = models.BooleanField(default=False)
     in_bookmarks = models.BooleanField(default=False)
     rating = models.PositiveSmallIntegerField(choices=RATE_CHOICES, blank=True, null=True)
 
+    # поля, от которых зависят счётчики книги
+    COUNTED_FIELDS = ('like', 'in_bookmarks', 'rating')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='store_userbookrelation_user_book_uniq'),
+        ]
+        # частичные индексы под пересчёт счётчиков книги: читаются только нужные строки
+        indexes = [
+            models.Index(fields=['book'], condition=models.Q(like=True), name='store_ubr_book_like_idx'),
+            models.Index(fields=['book'], condition=models.Q(in_bookmarks=True), name='store_ubr_book_bookmarks_idx'),
+            models.Index(fields=['book', 'rating'], condition=models.Q(rating__isnull=False),
+                         name='store_ubr_book_rating_idx'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.old_state = self.counted_state()
+
     def __str__(self):
         return f'{self.user.username}: {self.book}, {self.rating}'
 
+    def counted_state(self):
+        # через __dict__, чтобы отложенные (only/defer) поля не подгружались запросом
+        return {name: self.__dict__.get(name) for name in self.COUNTED_FIELDS}
+
     def save(self, *args, **kwargs):
-        from store.logic import set_rating
+        from store.logic import update_counters
+
+        with transaction.atomic():
+            old_state = None
+            if not self._state.adding:
+                # состояние на момент загрузки могло устареть: параллельный запрос того же пользователя
+                # уже изменил связь, и дельты от снимка посчитали бы реакцию дважды. Перечитываем под блокировкой
+                old_state = type(self)._base_manager.select_for_update().filter(pk=self.pk).values(
+                    *self.COUNTED_FIELDS).first()
+            super().save(*args, **kwargs)
+            update_counters(self.book_id, old_state, self.counted_state())
+            if old_state != self.counted_state():
+                bump_user_version(self.user_id)
+        self.old_state = self.counted_state()
+
+
+class DirtyBook(models.Model):
+    # очередь отложенного пересчёта счётчиков (BOOK_COUNTERS_WRITE_BEHIND) и лидербордов: каждая реакция
+    # добавляет свою строку и ничего не обновляет, поэтому параллельные реакции не ждут блокировок друг друга
+    # ON DELETE CASCADE в БД, как у UserBookRelation.book
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, related_name='+')
+    marked_at = models.DateTimeField(verbose_name='Отмечена', db_index=True)
+
+    class Meta:
+        verbose_name = "Книга к пересчёту"
+        verbose_name_plural = "Книги к пересчёту"
+
+    def __str__(self):
+        return f'{self.book_id}: {self.marked_at}'
+
+
+class LeaderboardBaseline(models.Model):
+    # счётчики книги, уже учтённые в BookActivity: разница с ними при пересчёте - новая активность.
+    # Пишут только flush_dirty_books и сборка лидербордов заново; нет строки - счётчики считаются нулями
+    # ON DELETE CASCADE в БД, как у UserBookRelation.book
+    book = models.OneToOneField(Book, on_delete=models.DO_NOTHING, primary_key=True, related_name='+')
+    likes_count = models.IntegerField(verbose_name='Лайки', default=0)
+    bookmarks_count = models.IntegerField(verbose_name='В закладках', default=0)
+    rating_sum = models.IntegerField(verbose_name='Сумма оценок', default=0)
+    rating_count = models.IntegerField(verbose_name='Количество оценок', default=0)
+
+    class Meta:
+        verbose_name = "Учтённые счётчики книги"
+        verbose_name_plural = "Учтённые счётчики книг"
+
+    def __str__(self):
+        return f'{self.book_id}'
+
+
+class BookActivity(models.Model):
+    # изменения счётчиков книги за день - для лидербордов за последние N дней (BOOK_LEADERBOARD_WINDOWS);
+    # могут быть отрицательными: снятый лайк вычитается в день снятия
+    # ON DELETE CASCADE в БД, как у UserBookRelation.book
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, related_name='+')
+    day = models.DateField(verbose_name='День', db_index=True)
+    likes = models.IntegerField(verbose_name='Лайки', default=0)
+    bookmarks = models.IntegerField(verbose_name='В закладках', default=0)
+    rating_sum = models.IntegerField(verbose_name='Сумма оценок', default=0)
+    rating_count = models.IntegerField(verbose_name='Количество оценок', default=0)
+
+    class Meta:
+        verbose_name = "Активность по книге"
+        verbose_name_plural = "Активность по книгам"
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='store_bookactivity_book_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id}: {self.day}'
+
+
+class LeaderboardEntry(models.Model):
+    BOARD_CHOICES = (
+        ('rating', 'По рейтингу'),
+        ('likes', 'По лайкам'),
+        ('bookmarks', 'По закладкам'),
+    )
+
+    board = models.CharField(verbose_name='Доска', max_length=16, choices=BOARD_CHOICES)
+    # 0 - за всё время, иначе за последние window_days дней
+    window_days = models.PositiveSmallIntegerField(verbose_name='Окно, дней', default=0)
+    # ON DELETE CASCADE в БД, как у UserBookRelation.book
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, related_name='+')
+    score = models.DecimalField(verbose_name='Очки', max_digits=12, decimal_places=2)
+
+    class Meta:
+        verbose_name = "Место в лидерборде"
+        verbose_name_plural = "Лидерборды"
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'window_days', 'book'], name='store_leaderboard_book_uniq'),
+        ]
+        # /book/top/ читает первые строки доски прямо из индекса
+        indexes = [
+            models.Index(fields=['board', 'window_days', '-score', 'book'], name='store_leaderboard_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.board}/{self.window_days}: {self.book_id}, {self.score}'
+
+
+@receiver(post_delete, sender=UserBookRelation)
+def relation_deleted(sender, instance, **kwargs):
+    from store.logic import update_counters
+
+    # связи удалённой книги удаляет каскад в БД, сюда они не попадают
+    update_counters(instance.book_id, instance.old_state, None)
+    bump_user_version(instance.user_id)
 
-        is_new_object = not self.pk
-        old_rating = self.rating
-        super().save(*args, **kwargs)
-        new_rating = self.rating
 
-        if old_rating != new_rating or is_new_object:
-            set_rating(self.book)
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, instance, **kwargs):
+    bump_catalog_version()
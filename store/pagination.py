@@ -0,0 +1,176 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация по ключу сортировки: `WHERE (price, id) > (:price, :id) ORDER BY price, id LIMIT n`.
+    Сортировку берёт из queryset (в т.ч. после OrderingFilter) и дополняет её id, чтобы ключ был уникальным,
+    поэтому глубокие страницы стоят столько же, сколько первая. Поля сортировки не должны быть NULL.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset, count_queryset = self.get_page_queryset(queryset, request)
+        self.count = count_queryset.count() if count_queryset is not None else None
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_queryset, count_queryset = self.get_page_queryset(queryset, request)
+        self.count = await count_queryset.acount() if count_queryset is not None else None
+        # aiterator() не умеет prefetch_related, тогда async for выберет страницу целиком
+        rows = page_queryset if page_queryset._prefetch_related_lookups else page_queryset.aiterator()
+        return self.set_page([item async for item in rows])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        # COUNT(*) по аннотированному queryset дорогой, считаем только по явному запросу клиента
+        count_queryset = queryset.order_by() if self.count_requested(request) else None
+
+        ordering = [self.invert(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(self.keyset_filter(ordering, self.position))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.page_size + 1], count_queryset
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def get_ordering(self, queryset):
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)] or [self.tiebreaker]
+        names = [field.lstrip('-') for field in ordering]
+        if self.tiebreaker not in names and 'pk' not in names:
+            ordering.append(('-' if ordering[-1].startswith('-') else '') + self.tiebreaker)
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def keyset_filter(ordering, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, instance):
+        # instance может быть и строкой values()
+        if isinstance(instance, dict):
+            return [str(instance[field.lstrip('-')]) for field in self.ordering]
+        return [str(getattr(instance, field.lstrip('-'))) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse=False):
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для админки: на большой таблице без фильтров количество строк берётся из pg_class.reltuples
+    (оценка на момент последнего ANALYZE/VACUUM) вместо COUNT(*), который читает таблицу целиком.
+    С фильтрами и поиском, а также на таблицах меньше exact_count_limit строк считает точно.
+    """
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = self.get_estimated_count()
+            if estimate is not None and estimate >= self.exact_count_limit:
+                return estimate
+        return super().count
+
+    def get_estimated_count(self):
+        with connections[self.object_list.db].cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                           [self.object_list.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 - таблица ещё ни разу не анализировалась
+        return int(row[0]) if row and row[0] >= 0 else None
@@ -3,7 +3,9 @@ from rest_framework.permissions import SAFE_METHODS, IsAuthenticatedOrReadOnly
 
 class IsOwnerOrStaffOrReadOnly(IsAuthenticatedOrReadOnly):
     def has_object_permission(self, request, view, obj):
+        # по owner_id, без загрузки владельца
         return bool(
             request.method in SAFE_METHODS or
-            request.user and request.user.is_authenticated and (obj.owner == request.user or request.user.is_staff)
+            request.user and request.user.is_authenticated and
+            (obj.owner_id == request.user.pk or request.user.is_staff)
         )
@@ -0,0 +1,224 @@
+"""
+PostgreSQL-бэкенд с пулом соединений в памяти процесса: ENGINE = 'store.pooled_postgresql'.
+
+close() возвращает соединение в пул вместо закрытия, connect() берёт свободное или открывает новое,
+пока их меньше max_size, иначе ждёт не дольше timeout. Пул общий для всех потоков процесса
+(потоки WSGI-сервера и sync_to_async под ASGI), каждое соединение в один момент выдано одному потоку.
+Настройки - OPTIONS['pool'] = {'max_size': 10, 'timeout': 5, 'check_after': 30}; CONN_MAX_AGE должен быть 0,
+иначе соединения будут жить в потоках, а не в пуле.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+from django.utils.asyncio import async_unsafe
+
+from store.metrics import registry
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# пулы родителя в процессе после fork, см. _forget_pools_after_fork
+_inherited_pools = []
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=10, timeout=5, check_after=30):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        # соединение, простоявшее дольше check_after секунд, перед выдачей проверяется SELECT 1
+        self.check_after = check_after
+        self.idle = []
+        self.size = 0
+        self.condition = threading.Condition()
+        self.stats = Counter()
+
+    def get(self):
+        started = time.monotonic()
+        while True:
+            connection, returned_at = self.reserve(started)
+            if connection is None:
+                return self.open()
+            if self.is_usable(connection, returned_at):
+                return connection
+            self.discard(connection)
+
+    def reserve(self, started):
+        # свободное соединение или право открыть новое; без свободных мест - ждём
+        with self.condition:
+            waited = False
+            while not self.idle and self.size >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise psycopg2.OperationalError(
+                        f'Нет свободных соединений в пуле (max_size={self.max_size}) за {self.timeout} с')
+                waited = True
+                self.condition.wait(remaining)
+            if waited:
+                self.stats['waits'] += 1
+                self.stats['wait_seconds'] += time.monotonic() - started
+            if self.idle:
+                return self.idle.pop()
+            self.size += 1
+            return None, None
+
+    def open(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.stats['created'] += 1
+        return connection
+
+    def is_usable(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except psycopg2.Error:
+            return False
+        return True
+
+    def put(self, connection):
+        usable = not connection.closed
+        if usable and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                usable = False
+        if not usable:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.stats['discarded'] += 1
+            self.condition.notify()
+
+    def close_idle(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.discard(connection)
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'max_size': self.max_size,
+                **{name: self.stats[name] for name in ('created', 'discarded', 'waits', 'wait_seconds', 'timeouts')},
+            }
+
+
+def connect(conn_params, isolation_level):
+    # то же, что DatabaseWrapper.get_new_connection в Django, но без привязки к конкретному DatabaseWrapper
+    connection = psycopg2.connect(**conn_params)
+    if isolation_level is not None and isolation_level != connection.isolation_level:
+        connection.set_session(isolation_level=isolation_level)
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+def get_pool(alias, conn_params, options, isolation_level):
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(lambda: connect(conn_params, isolation_level), **options)
+        return pool
+
+
+def get_pools():
+    with _pools_lock:
+        return dict(_pools)
+
+
+def close_pools():
+    for pool in get_pools().values():
+        pool.close_idle()
+
+
+def _forget_pools_after_fork():
+    # соединения пулов после fork общие с родителем: выдавать их нельзя, закрывать тоже - закрытие
+    # завершит сессию родителя. Ссылки остаются в _inherited_pools, а дочерний процесс открывает свои
+    global _pools, _pools_lock
+    _inherited_pools.append(_pools)
+    _pools, _pools_lock = {}, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pools_after_fork)
+
+
+def render_metrics(prefix):
+    gauges = ('size', 'idle', 'in_use', 'max_size')
+    counters = ('created', 'discarded', 'waits', 'wait_seconds', 'timeouts')
+    stats = [((alias, dict(params).get('database', '')), pool.get_stats())
+             for (alias, params), pool in get_pools().items()]
+    lines = []
+    for name in gauges + counters:
+        metric = f'{prefix}db_pool_{name}' if name in gauges else f'{prefix}db_pool_{name}_total'
+        lines += [f'# TYPE {metric} {"gauge" if name in gauges else "counter"}']
+        for (alias, database), values in stats:
+            lines.append(f'{metric}{{alias="{alias}",database="{database}"}} {values[name]}')
+    return lines
+
+
+registry.add_collector(render_metrics)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # свободные соединения пула держат тестовую БД открытой и не дают её удалить
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pool = None
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        self.pool = get_pool(self.alias, conn_params, options.get('pool', {}), options.get('isolation_level'))
+        connection = self.pool.get()
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            # Django оставит ссылку на соединение до конца atomic-блока - отдавать его другому потоку нельзя
+            self.pool.discard(self.connection)
+        else:
+            self.pool.put(self.connection)
@@ -0,0 +1,60 @@
+"""
+JSON-рендерер и парсер DRF на orjson. Вывод совпадает с JSONRenderer байт в байт: Decimal, даты, UUID, ленивые
+строки и прочее, чего orjson не знает (или кодирует иначе, как datetime), отдаются JSONEncoder.default из DRF.
+То, что orjson закодировать не может (int больше 64 бит, глубокая вложенность), а также отступы (?indent=),
+ensure_ascii и не-UTF-8 запросы уходят в обычный json. Без orjson классы работают как JSONRenderer/JSONParser.
+Отличия только у float (в API их нет, DecimalField отдаются строками): NaN/Infinity кодируются как null, а не
+ошибкой, экспонента пишется как 1e16, а не 1e+16.
+"""
+import io
+import re
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# datetime и dataclass orjson кодирует по-своему, отдаём их в default
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+# числа длиннее int64 orjson читает как float, json - как int
+LONG_NUMBER = re.compile(rb'\d{19}')
+
+
+class FastJSONRenderer(JSONRenderer):
+    default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # как JSONRenderer: U+2028 и U+2029 экранируются, чтобы ответ был подмножеством JavaScript
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        if LONG_NUMBER.search(body):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # текст ошибки и разбор того, что orjson не принимает (1e400, одиночные суррогаты), - как у JSONParser
+            return super().parse(io.BytesIO(body), media_type, parser_context)
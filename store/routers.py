@@ -0,0 +1,155 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+PRIMARY_UNTIL_KEY = 'store:primary_until:{}'
+
+
+class RoutingState:
+    def __init__(self, use_primary, request=None):
+        self.use_primary = use_primary
+        self.wrote = False
+        # пользователя проверяем при первом чтении каталога: AuthenticationMiddleware стоит после нашего
+        self.request = request
+        self.user_checked = request is None
+
+    def primary_required(self):
+        if not self.use_primary and not self.user_checked:
+            self.user_checked = True
+            self.use_primary = get_primary_until(self.request) > time.time()
+        return self.use_primary or self.wrote
+
+
+# состояние текущего запроса; вне запросов (команды, shell) None - всё идёт в primary
+_state = ContextVar('store_routing_state', default=None)
+
+
+class ReplicaRouter:
+    """
+    Чтения моделей каталога в безопасных (GET/HEAD/OPTIONS) запросах - в одну из DATABASE_REPLICAS,
+    всё остальное - в primary. Чтения внутри транзакции и в течение BOOK_READ_YOUR_WRITES_SECONDS после
+    изменения каталога этим же клиентом тоже идут в primary, чтобы он сразу видел свой лайк или оценку:
+    клиент отмечается cookie, а вошедший пользователь ещё и в общем кеше версий - это работает и для клиентов
+    без cookie и на других устройствах. Сессии, пользователи и прочие приложения всегда читаются из primary.
+    """
+    route_app_labels = {'store'}
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.DATABASE_REPLICAS
+        if (state is None or not replicas or model._meta.app_label not in self.route_app_labels
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block or state.primary_required()):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label in self.route_app_labels:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики - копии primary, объекты из них можно связывать между собой
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return None if db == DEFAULT_DB_ALIAS else False
+
+
+class ReplicaRoutingMiddleware:
+    cookie_name = 'primary_until'
+    # без async_capable Django гонял бы каждый async view через переходы между потоками
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        now = time.time()
+        state = self.get_state(request, now)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.set_cookie(request, response, state, now)
+
+    async def __acall__(self, request):
+        # sync_to_async копирует контекст, поэтому ORM в потоке видит тот же RoutingState
+        now = time.time()
+        state = self.get_state(request, now)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote:
+            # отметка пользователя читает request.user и пишет в кеш - только в потоке
+            return await sync_to_async(self.set_cookie)(request, response, state, now)
+        return self.set_cookie(request, response, state, now)
+
+    def get_state(self, request, now):
+        try:
+            primary_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            primary_until = 0
+        use_primary = request.method not in SAFE_METHODS or primary_until > now
+        return RoutingState(use_primary=use_primary, request=None if use_primary else request)
+
+    def set_cookie(self, request, response, state, now):
+        window = settings.BOOK_READ_YOUR_WRITES_SECONDS
+        if state.wrote and window > 0:
+            response.set_cookie(self.cookie_name, str(now + window), max_age=window, httponly=True, samesite='Lax')
+            set_primary_until(request, now + window)
+        return response
+
+
+def _sticky_cache():
+    # общий для воркеров кеш версий (BOOK_API_VERSION_CACHE): в нём же отметки пользователей, писавших в каталог
+    return caches[settings.BOOK_API_VERSION_CACHE]
+
+
+def _user_id(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def get_primary_until(request):
+    user_id = _user_id(request)
+    if user_id is None:
+        return 0
+    return _sticky_cache().get(PRIMARY_UNTIL_KEY.format(user_id), 0)
+
+
+def set_primary_until(request, primary_until):
+    user_id = _user_id(request)
+    if user_id is not None:
+        _sticky_cache().set(PRIMARY_UNTIL_KEY.format(user_id), primary_until,
+                                timeout=settings.BOOK_READ_YOUR_WRITES_SECONDS)
+
+
+@contextmanager
+def primary_reads():
+    # чтения каталога внутри блока идут в primary, см. store.cache.cache_fill_reads
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    use_primary, state.use_primary = state.use_primary, True
+    try:
+        yield
+    finally:
+        state.use_primary = use_primary
@@ -1,5 +1,11 @@
+from decimal import Decimal
+
 from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
 
+from . import leaderboards
+from . import logic
 from . import models
 
 
@@ -10,24 +16,170 @@ class BookReaderSerializer(serializers.ModelSerializer):
 
 
 class BookSerializer(serializers.ModelSerializer):
-    likes_count = serializers.SerializerMethodField()
-    bookmarks_count = serializers.IntegerField(read_only=True)    # используем аннотацию
+    likes_count = serializers.IntegerField(read_only=True)
+    bookmarks_count = serializers.IntegerField(read_only=True)
     rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
     price_with_discount = serializers.DecimalField(max_digits=7, decimal_places=2, read_only=True)
     owner_name = serializers.CharField(source='owner.username', default='', read_only=True)
-    readers = BookReaderSerializer(many=True, read_only=True)
+    readers_count = serializers.IntegerField(read_only=True)
+    readers_preview = serializers.SerializerMethodField()    # только по ?readers_preview=N, см. BookViewSet
+    # связь текущего пользователя с книгой, только для авторизованных (аннотации BookViewSet)
+    my_like = serializers.BooleanField(read_only=True)
+    my_bookmark = serializers.BooleanField(read_only=True)
+    my_rating = serializers.IntegerField(read_only=True)
+
+    USER_STATE_FIELDS = ('my_like', 'my_bookmark', 'my_rating')
 
     class Meta:
         model = models.Book
         fields = ('id', 'name', 'price', 'author_name', 'likes_count', 'bookmarks_count', 'rating',
-                  'price_with_discount', 'owner_name', 'readers')
+                  'price_with_discount', 'owner_name', 'readers_count', 'readers_preview',
+                  'my_like', 'my_bookmark', 'my_rating')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('readers_preview'):
+            fields.pop('readers_preview')
+        if not self.context.get('user_state'):
+            for name in self.USER_STATE_FIELDS:
+                fields.pop(name)
+        # ?fields=/?exclude=, BookViewSet передаёт уже итоговый набор полей
+        if self.context.get('fields') is not None:
+            fields = {name: field for name, field in fields.items() if name in self.context['fields']}
+        return fields
+
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        # UPDATE только изменённых колонок: счётчики той же строки параллельно меняют реакции,
+        # а save() без update_fields записал бы прочитанные до них значения
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+    def get_readers_preview(self, instance):
+        return BookReaderSerializer([relation.user for relation in instance.readers_preview], many=True).data
+
+
+class BookValuesSerializer:
+    """
+    Быстрый read-only аналог BookSerializer для строк из values(): конвертеры полей собираются один раз
+    по полям BookSerializer, а строка превращается в dict без экземпляров модели и машинерии DRF.
+    Вывод совпадает с BookSerializer байт в байт; readers_preview не поддерживается.
+    """
+    def __init__(self, fields=None):
+        self.converters = []
+        context = {
+            'fields': fields,
+            'readers_preview': fields is not None and 'readers_preview' in fields,
+            'user_state': fields is not None and not set(fields).isdisjoint(BookSerializer.USER_STATE_FIELDS),
+        }
+        for name, field in BookSerializer(context=context).fields.items():
+            if isinstance(field, serializers.SerializerMethodField):
+                raise ValueError(f'{name}: SerializerMethodField не поддерживается')
+            self.converters.append((name, field.source.replace('.', '__'), self.get_converter(field)))
+        self.columns = [column for _, column, _ in self.converters]
+
+    @staticmethod
+    def get_converter(field):
+        # для значений без атрибута (owner=None) DRF подставляет default
+        default = field.default if '.' in field.source and field.default is not empty else None
+        if isinstance(field, serializers.DecimalField):
+            exponent = -field.decimal_places
+            coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+
+            def convert(value):
+                if value is None:
+                    return default
+                # из numeric(n, decimal_places) приходит уже нужный масштаб, тогда quantize DRF ничего не меняет
+                if coerce_to_string and value.as_tuple().exponent == exponent:
+                    return str(value)
+                return field.to_representation(Decimal(value))
+        elif isinstance(field, (serializers.IntegerField, serializers.CharField)):
+            def convert(value):
+                return default if value is None else value
+        else:
+            def convert(value):
+                return default if value is None else field.to_representation(value)
+        return convert
+
+    def to_representation(self, row):
+        return {name: convert(row[column]) for name, column, convert in self.converters}
+
+    def many(self, rows):
+        converters = self.converters
+        return [{name: convert(row[column]) for name, column, convert in converters} for row in rows]
+
+
+class LeaderboardBookSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Book
+        fields = leaderboards.TOP_BOOK_FIELDS
 
-    def get_likes_count(self, instance):
-        likes_count = models.UserBookRelation.objects.filter(book=instance, like=True).count()
-        return likes_count
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    book = LeaderboardBookSerializer()
+    score = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.LeaderboardEntry
+        fields = ('score', 'book')
+
+    def get_score(self, instance):
+        # рейтинг - как у книги, с двумя знаками; лайки и закладки - целые
+        if self.context['board'] == 'rating':
+            return str(instance.score)
+        return int(instance.score)
+
+
+class BookPricingSerializer(serializers.Serializer):
+    """Фильтр книг и правило для logic.apply_pricing; без фильтра - только с all=true."""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False, max_length=10000)
+    author_name = serializers.CharField(required=False)
+    min_price = serializers.DecimalField(max_digits=7, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=7, decimal_places=2, required=False)
+    all = serializers.BooleanField(default=False)
+    rule = serializers.ChoiceField(choices=logic.PRICING_RULES)
+    value = serializers.DecimalField(max_digits=7, decimal_places=2)
+
+    # допустимые значения value для правил
+    value_limits = {
+        'discount': (0, None),
+        'discount_percent': (0, 100),
+        'price': (0, None),
+        'price_percent': (-100, None),
+    }
+    filter_lookups = {
+        'ids': 'pk__in',
+        'author_name': 'author_name',
+        'min_price': 'price__gte',
+        'max_price': 'price__lte',
+    }
+
+    def validate(self, attrs):
+        if not attrs['all'] and not any(name in attrs for name in self.filter_lookups):
+            raise serializers.ValidationError('Укажите ids, author_name, min_price/max_price или all=true')
+        low, high = self.value_limits[attrs['rule']]
+        if attrs['value'] < low or (high is not None and attrs['value'] > high):
+            limits = f'от {low} до {high}' if high is not None else f'не меньше {low}'
+            raise serializers.ValidationError({'value': [f'Для {attrs["rule"]}: {limits}']})
+        return attrs
+
+    def get_queryset(self):
+        return models.Book.objects.filter(**{lookup: self.validated_data[name]
+                                            for name, lookup in self.filter_lookups.items()
+                                            if name in self.validated_data})
 
 
 class UserBookRelationSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.UserBookRelation
         fields = ('book', 'like', 'in_bookmarks', 'rating')
+
+
+class UserBookRelationBulkItemSerializer(serializers.ModelSerializer):
+    # без PrimaryKeyRelatedField, чтобы не проверять каждую книгу отдельным запросом
+    book = serializers.IntegerField()
+
+    class Meta:
+        model = models.UserBookRelation
+        fields = ('book', 'like', 'in_bookmarks', 'rating')
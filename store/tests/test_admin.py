@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.models import Book, UserBookRelation
+from store.pagination import EstimatedCountPaginator
+
+
+User = get_user_model()
+
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(self.admin)
+        self.book1 = Book.objects.create(name='Book', price=100, author_name='Author')
+        self.book2 = Book.objects.create(name='Test Book', price='99999.00')
+
+    def test_relation_changelist_queries(self):
+        url = reverse('admin:store_userbookrelation_changelist')
+        users = [User.objects.create(username=f'user{index}') for index in range(20)]
+        UserBookRelation.objects.create(user=users[0], book=self.book1, like=True)
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(200, self.client.get(url).status_code)
+        for user in users[1:]:
+            UserBookRelation.objects.create(user=user, book=self.book2)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(one), len(many))
+        self.assertContains(response, 'user19')
+
+        response = self.client.get(url, data={'q': str(self.book1.id)})
+        self.assertEqual(1, response.context['cl'].result_count)
+        response = self.client.get(url, data={'q': 'user5'})
+        self.assertEqual(1, response.context['cl'].result_count)
+
+    def test_book_search(self):
+        response = self.client.get(reverse('admin:store_book_changelist'), data={'q': 'test'})
+        self.assertEqual([self.book2], list(response.context['cl'].result_list))
+
+    def test_reprice(self):
+        url = reverse('admin:store_book_changelist')
+        data = {'action': 'reprice', '_selected_action': [self.book1.id], 'rule': 'price_percent', 'value': '10'}
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, data=data)
+        self.assertEqual(1, sum(query['sql'].startswith('UPDATE "store_book"') for query in queries))
+        self.book1.refresh_from_db()
+        self.assertEqual(Decimal('110.00'), self.book1.price)
+
+        # 99999.00 + 10% не помещается в numeric(7, 2) - UPDATE откатывается целиком
+        response = self.client.post(url, data={**data, '_selected_action': [self.book1.id, self.book2.id]},
+                                    follow=True)
+        self.assertContains(response, 'выходит за пределы')
+        self.book1.refresh_from_db()
+        self.assertEqual(Decimal('110.00'), self.book1.price)
+
+        response = self.client.post(url, data={**data, 'value': ''}, follow=True)
+        self.assertContains(response, 'Выберите правило и укажите значение')
+        response = self.client.post(url, data={**data, 'rule': 'discount_percent', 'value': '120'}, follow=True)
+        self.assertContains(response, 'discount_percent: от 0 до 100')
+
+    def test_recalculate_counters(self):
+        UserBookRelation.objects.create(user=self.admin, book=self.book1, like=True, rating=4)
+        Book.objects.filter(pk=self.book1.pk).update(likes_count=7, rating=1)
+        self.client.post(reverse('admin:store_book_changelist'),
+                         data={'action': 'recalculate_counters', '_selected_action': [self.book1.id]})
+        self.book1.refresh_from_db()
+        self.assertEqual((1, Decimal('4.00')), (self.book1.likes_count, self.book1.rating))
+
+
+class EstimatedCountPaginatorTestCase(TestCase):
+    def setUp(self):
+        Book.objects.bulk_create([Book(name=f'Book {index}', price=index) for index in range(30)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE store_book')
+
+    def test_estimate_without_filters(self):
+        paginator = EstimatedCountPaginator(Book.objects.order_by('id'), 10)
+        paginator.exact_count_limit = 0
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(30, paginator.count)
+        self.assertIn('reltuples', queries[0]['sql'])
+
+    def test_exact_count(self):
+        self.assertEqual(30, EstimatedCountPaginator(Book.objects.order_by('id'), 10).count)
+        paginator = EstimatedCountPaginator(Book.objects.filter(price__lt=5).order_by('id'), 10)
+        paginator.exact_count_limit = 0
+        self.assertEqual(5, paginator.count)
@@ -1,16 +1,28 @@
 import json
+import tempfile
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from django.db.models import Q, Count, Case, When, Avg, F
+from django.utils import timezone
+from django.db.models import Q, F
 
-from store.models import Book, UserBookRelation
+from store.cache import CATALOG_VERSION_KEY, get_version_cache
+from store.models import Book, BookActivity, DirtyBook, LeaderboardBaseline, LeaderboardEntry, UserBookRelation
 from store.serializers import BookSerializer
 
 
 User = get_user_model()
+# ETag списка и ответов с полями пользователя ставится только с общим для воркеров кешем версий, в тестах - LocMem
+shared_versions = mock.patch('store.conditional.versions_shared', new=lambda: True)
 
 
 class BookApiTestCase(APITestCase):
@@ -24,58 +36,126 @@ class BookApiTestCase(APITestCase):
         url = reverse('book-list')
         response = self.client.get(url)
         qs = Book.objects.all().annotate(
-            bookmarks_count=Count(Case(When(userbookrelation__in_bookmarks=True, then=1))),
             price_with_discount=F("price") - F("discount"),
         ).order_by('id')
         serializer_data = BookSerializer(qs, many=True).data
 
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, response.data['results'])
+
+    def test_get_num_queries(self):
+        UserBookRelation.objects.create(user=self.user, book=self.book1, like=True, in_bookmarks=True)
+        url = reverse('book-list')
+        # только сама страница: ETag списка считается по версии каталога, без запроса к БД
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, response.data['results'][0]['likes_count'])
+        self.assertEqual(1, response.data['results'][0]['bookmarks_count'])
+        self.assertEqual(1, response.data['results'][0]['readers_count'])
+        self.assertNotIn('readers_preview', response.data['results'][0])
+
+    def test_get_readers_preview(self):
+        for i in range(4):
+            reader = User.objects.create(username=f'reader{i}', first_name=f'First {i}', last_name=f'Last {i}')
+            UserBookRelation.objects.create(user=reader, book=self.book1)
+        UserBookRelation.objects.create(user=self.user, book=self.book2)
+
+        url = reverse('book-list')
+        # страница и превью читателей
+        with self.assertNumQueries(2):
+            response = self.client.get(url, data={'readers_preview': 2})
+
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        books = {book['id']: book for book in response.data['results']}
+        self.assertEqual(4, books[self.book1.id]['readers_count'])
+        self.assertEqual([{'first_name': 'First 0', 'last_name': 'Last 0'},
+                          {'first_name': 'First 1', 'last_name': 'Last 1'}], books[self.book1.id]['readers_preview'])
+        self.assertEqual(1, len(books[self.book2.id]['readers_preview']))
+        self.assertEqual([], books[self.book3.id]['readers_preview'])
+
+    def test_get_readers(self):
+        for i in range(5):
+            reader = User.objects.create(username=f'reader{i}', first_name=f'First {i}')
+            UserBookRelation.objects.create(user=reader, book=self.book1)
+
+        url = reverse('book-readers', args=(self.book1.id, ))
+        response = self.client.get(url, data={'page_size': 3})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['First 0', 'First 1', 'First 2'], [user['first_name'] for user in response.data['results']])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(['First 3', 'First 4'], [user['first_name'] for user in response.data['results']])
+        self.assertIsNone(response.data['next'])
 
     def test_get_filter(self):
         url = reverse('book-list')
         response = self.client.get(url, data={'price': 100.50})
         qs = Book.objects.filter(price=100.50).annotate(
-            bookmarks_count=Count(Case(When(userbookrelation__in_bookmarks=True, then=1))),
             price_with_discount=F("price") - F("discount"),
         ).order_by('id')
         serializer_data = BookSerializer(qs, many=True).data
 
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(response.data, serializer_data)
+        self.assertEqual(response.data['results'], serializer_data)
 
     def test_get_search(self):
         url = reverse('book-list')
         response = self.client.get(url, data={'search': 'test'})
         qs = Book.objects.filter(Q(name__icontains='test') | Q(author_name__icontains='test')).annotate(
-            bookmarks_count=Count(Case(When(userbookrelation__in_bookmarks=True, then=1))),
             price_with_discount=F("price") - F("discount"),
-        ).order_by('id')
-        serializer_data = BookSerializer(qs, many=True).data
+        )
+        # совпадение в названии весит больше, чем в имени автора
+        serializer_data = BookSerializer(sorted(qs, key=lambda book: book != self.book2), many=True).data
 
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(response.data, serializer_data)
+        self.assertEqual(response.data['results'], serializer_data)
+
+    def test_get_search_prefix_and_words(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'auth'})
+        self.assertEqual({self.book2.id, self.book3.id}, {book['id'] for book in response.data['results']})
+
+        response = self.client.get(url, data={'search': 'book test'})
+        self.assertEqual([self.book2.id, self.book3.id], [book['id'] for book in response.data['results']])
+
+        response = self.client.get(url, data={'search': 'book 2'})
+        self.assertEqual([self.book3.id], [book['id'] for book in response.data['results']])
+
+        response = self.client.get(url, data={'search': 'missing'})
+        self.assertEqual([], response.data['results'])
+
+    def test_get_search_vector_maintained(self):
+        self.book1.author_name = 'Tolstoy'
+        self.book1.save()
+        Book.objects.filter(pk=self.book3.pk).update(name='Anna Karenina')
+
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'tolst'})
+        self.assertEqual([self.book1.id], [book['id'] for book in response.data['results']])
+
+        response = self.client.get(url, data={'search': 'karenina'})
+        self.assertEqual([self.book3.id], [book['id'] for book in response.data['results']])
 
     def test_get_ordering(self):
         url = reverse('book-list')
         response = self.client.get(url, data={'ordering': 'price'})
         qs = Book.objects.all().annotate(
-            bookmarks_count=Count(Case(When(userbookrelation__in_bookmarks=True, then=1))),
             price_with_discount=F("price") - F("discount"),
-        ).order_by('price')
+        ).order_by('price', 'id')
         serializer_data = BookSerializer(qs, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(response.data, serializer_data)
+        self.assertEqual(response.data['results'], serializer_data)
 
         response = self.client.get(url, data={'ordering': '-price'})
         qs = Book.objects.all().annotate(
-            bookmarks_count=Count(Case(When(userbookrelation__in_bookmarks=True, then=1))),
             price_with_discount=F("price") - F("discount"),
-        ).order_by('-price')
+        ).order_by('-price', '-id')
         serializer_data = BookSerializer(qs, many=True).data
 
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(response.data, serializer_data)
+        self.assertEqual(response.data['results'], serializer_data)
 
     def test_create_unauthorized(self):
         url = reverse('book-list')
@@ -149,6 +229,150 @@ class BookApiTestCase(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
 
 
+class BookWriteTestCase(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.other = User.objects.create(username="other")
+        self.book = Book.objects.create(name='Book', price=100, discount=10, owner=self.owner)
+
+    def test_patch_num_queries(self):
+        url = reverse('book-detail', args=(self.book.id, ))
+        self.client.force_login(self.owner)
+        # сессия, пользователь, книга с владельцем, UPDATE
+        with self.assertNumQueries(4), CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(url, data=json.dumps({'price': 150}), content_type="application/json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('140.00', response.data['price_with_discount'])
+        self.assertEqual('owner', response.data['owner_name'])
+
+        update = queries[-1]['sql']
+        self.assertTrue(update.startswith('UPDATE'))
+        self.assertNotIn('likes_count', update)
+        self.assertNotIn('discount', update)
+        self.book.refresh_from_db()
+        self.assertEqual(150, self.book.price)
+
+    def test_put_keeps_concurrent_counters(self):
+        url = reverse('book-detail', args=(self.book.id, ))
+        self.client.force_login(self.owner)
+        liked = []
+
+        def like_during_update(execute, sql, params, many, context):
+            # лайк другого пользователя между чтением книги и её UPDATE
+            if sql.startswith('UPDATE "store_book"') and not liked:
+                liked.append(True)
+                Book.objects.filter(pk=self.book.pk).update(likes_count=F('likes_count') + 1)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(like_during_update):
+            response = self.client.put(url, data=json.dumps({'name': 'New', 'price': 100}),
+                                       content_type="application/json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.book.refresh_from_db()
+        self.assertEqual(('New', 1), (self.book.name, self.book.likes_count))
+
+    def test_forbidden_num_queries(self):
+        url = reverse('book-detail', args=(self.book.id, ))
+        self.client.force_login(self.other)
+        with self.assertNumQueries(3):
+            response = self.client.patch(url, data=json.dumps({'price': 1}), content_type="application/json")
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        with self.assertNumQueries(3):
+            response = self.client.delete(url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_delete_num_queries(self):
+        readers = [User.objects.create(username=f'reader{index}') for index in range(10)]
+        books = [self.book, Book.objects.create(name='Book 2', price=100, owner=self.owner)]
+        for count, book in zip((1, 10), books):
+            for reader in readers[:count]:
+                UserBookRelation.objects.create(user=reader, book=book, like=True, rating=5)
+
+        for book in books:
+            BookActivity.objects.create(book=book, day=timezone.localdate(), likes=1)
+            LeaderboardEntry.objects.create(board='likes', book=book, score=1)
+            LeaderboardBaseline.objects.create(book=book)
+        self.assertTrue(DirtyBook.objects.exists())
+
+        self.client.force_login(self.owner)
+        for book in books:
+            # сессия, пользователь, книга для проверки прав и один DELETE: связи, очередь, активность,
+            # учтённые счётчики и места в досках удаляет ON DELETE CASCADE в БД
+            with self.assertNumQueries(4):
+                response = self.client.delete(reverse('book-detail', args=(book.id, )))
+            self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        for model in (UserBookRelation, DirtyBook, BookActivity, LeaderboardBaseline, LeaderboardEntry):
+            self.assertFalse(model.objects.exists())
+
+
+class BookPricingTestCase(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.book1 = Book.objects.create(name='Book', price=100, discount=5, author_name='Author')
+        self.book2 = Book.objects.create(name='Book 2', price=300, author_name='Author')
+        self.book3 = Book.objects.create(name='Book 3', price=200, author_name='Other')
+        self.url = reverse('book-pricing')
+
+    def post(self, data):
+        return self.client.post(self.url, data=json.dumps(data), content_type='application/json')
+
+    def prices(self):
+        return [(str(price), str(discount)) for price, discount in
+                Book.objects.order_by('id').values_list('price', 'discount')]
+
+    def test_staff_only(self):
+        data = {'all': True, 'rule': 'discount', 'value': 1}
+        self.assertEqual(status.HTTP_403_FORBIDDEN, self.post(data).status_code)
+        self.client.force_login(User.objects.create(username='user'))
+        self.assertEqual(status.HTTP_403_FORBIDDEN, self.post(data).status_code)
+
+    def test_rules(self):
+        self.client.force_login(self.staff)
+        cache.clear()
+        self.client.get(reverse('book-list'))
+        # сессия, пользователь, savepoint, один UPDATE, release savepoint
+        with self.assertNumQueries(5):
+            response = self.post({'author_name': 'Author', 'rule': 'discount_percent', 'value': '10'})
+        self.assertEqual({'updated': 2}, response.data)
+        self.assertEqual([('100.00', '10.00'), ('300.00', '30.00'), ('200.00', '0.00')], self.prices())
+        self.assertEqual('MISS', self.client.get(reverse('book-list'))['X-Cache'])
+
+        self.post({'ids': [self.book1.id, self.book3.id], 'rule': 'discount', 'value': '150'})
+        self.assertEqual([('100.00', '100.00'), ('300.00', '30.00'), ('200.00', '150.00')], self.prices())
+
+        self.post({'min_price': '150', 'max_price': '250', 'rule': 'price', 'value': '120'})
+        self.assertEqual([('100.00', '100.00'), ('300.00', '30.00'), ('120.00', '120.00')], self.prices())
+
+        response = self.post({'all': True, 'rule': 'price_percent', 'value': '-50'})
+        self.assertEqual({'updated': 3}, response.data)
+        self.assertEqual([('50.00', '50.00'), ('150.00', '30.00'), ('60.00', '60.00')], self.prices())
+
+    def test_invalid(self):
+        self.client.force_login(self.staff)
+        before = self.prices()
+        for data in ({'rule': 'discount', 'value': 1},
+                     {'all': True, 'rule': 'markup', 'value': 1},
+                     {'all': True, 'rule': 'discount_percent', 'value': 101},
+                     {'all': True, 'rule': 'price', 'value': -1},
+                     {'all': True, 'rule': 'price', 'value': '100000'},
+                     {'all': True, 'rule': 'price_percent', 'value': '99999'}):
+            response = self.post(data)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, data)
+        self.assertEqual(before, self.prices())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('reprice_books', '--author-name', 'Author', '--rule', 'price', '--value', '99', '--dry-run',
+                     stdout=out)
+        self.assertIn('Книг под фильтр: 2', out.getvalue())
+        call_command('reprice_books', '--ids', f'{self.book3.id}', '--rule', 'price_percent', '--value', '1',
+                     stdout=out)
+        self.assertIn('Изменено книг: 1', out.getvalue())
+        self.assertEqual(('202.00', '0.00'), self.prices()[2])
+        with self.assertRaises(CommandError):
+            call_command('reprice_books', '--all', '--rule', 'price_percent', '--value', '99999', stdout=out)
+
+
 class BookRelationTestCase(APITestCase):
     def setUp(self):
         self.user1 = User.objects.create(username="test_username")
@@ -171,3 +395,420 @@ class BookRelationTestCase(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertTrue(relation.like)
         self.assertFalse(relation.in_bookmarks)
+
+    def test_reaction_num_queries(self):
+        url = reverse('userbookrelation-detail', args=(self.book1.id, ))
+        self.client.force_login(self.user2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(url, data=json.dumps({'like': True}), content_type="application/json")
+        # сессия, пользователь, связь, savepoint, чтение связи под блокировкой, UPDATE связи,
+        # отметка в DirtyBook, UPDATE счётчиков, release
+        with self.assertNumQueries(9), CaptureQueriesContext(connection) as more_queries:
+            self.client.patch(url, data=json.dumps({'like': False}), content_type="application/json")
+        # активность и доски пишет только flush_book_counters
+        for query in [*queries, *more_queries]:
+            self.assertNotIn('store_leaderboardentry', query['sql'])
+            self.assertNotIn('store_bookactivity', query['sql'])
+
+    def test_bulk(self):
+        UserBookRelation.objects.create(user=self.user2, book=self.book1, like=True)
+        url = reverse('userbookrelation-bulk')
+        data = [
+            {'book': self.book1.id, 'in_bookmarks': True, 'rating': 1},
+            {'book': self.book2.id, 'like': True},
+            {'book': self.book2.id + 100, 'like': True},
+            {'book': self.book1.id, 'rating': 7},
+            {'like': True},
+        ]
+
+        self.client.force_login(self.user2)
+        response = self.client.post(url, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        results = response.data['results']
+        self.assertEqual({'book': self.book1.id, 'status': 'updated'}, results[0])
+        self.assertEqual({'book': self.book2.id, 'status': 'created'}, results[1])
+        self.assertIn('book', results[2]['errors'])
+        self.assertIn('rating', results[3]['errors'])
+        self.assertIn('book', results[4]['errors'])
+
+        relation = UserBookRelation.objects.get(user=self.user2, book=self.book1)
+        self.assertTrue(relation.like)
+        self.assertTrue(relation.in_bookmarks)
+        self.assertEqual(1, relation.rating)
+        self.assertTrue(UserBookRelation.objects.get(user=self.user2, book=self.book2).like)
+
+        self.book1.refresh_from_db()
+        self.book2.refresh_from_db()
+        self.assertEqual((1, 1, 1, 1), (self.book1.likes_count, self.book1.bookmarks_count,
+                                        self.book1.rating_count, self.book1.readers_count))
+        self.assertEqual((1, 0, 1), (self.book2.likes_count, self.book2.bookmarks_count, self.book2.readers_count))
+
+        response = self.client.post(url, data=json.dumps(data[:2]), content_type="application/json")
+        self.assertEqual(['unchanged', 'unchanged'], [result['status'] for result in response.data['results']])
+
+    def test_bulk_num_queries(self):
+        books = [Book.objects.create(name=f'Book {i}', price=10) for i in range(10)]
+        url = reverse('userbookrelation-bulk')
+        data = [{'book': book.id, 'like': True} for book in books]
+
+        self.client.force_login(self.user2)
+        # сессия, пользователь, savepoint, книги, select_for_update, bulk_create, отметка в DirtyBook,
+        # 10 UPDATE счётчиков, release; лидерборды обновит flush_book_counters
+        with self.assertNumQueries(18):
+            response = self.client.post(url, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(10, UserBookRelation.objects.filter(user=self.user2, like=True).count())
+
+    def test_bulk_duplicate_books(self):
+        url = reverse('userbookrelation-bulk')
+        data = [{'book': self.book2.id, 'like': True}, {'book': self.book2.id, 'in_bookmarks': True},
+                {'book': self.book2.id, 'like': True}]
+        self.client.force_login(self.user2)
+        response = self.client.post(url, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(['created', 'updated', 'unchanged'],
+                         [result['status'] for result in response.data['results']])
+        self.book2.refresh_from_db()
+        self.assertEqual((1, 1, 1), (self.book2.readers_count, self.book2.likes_count, self.book2.bookmarks_count))
+
+    def test_bulk_concurrent_create(self):
+        # связь успел создать параллельный запрос: первая попытка упирается в уникальность (user, book),
+        # пачка применяется заново
+        bulk_create = UserBookRelation.objects.bulk_create
+        calls = []
+
+        def racing_bulk_create(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('duplicate key value violates unique constraint')
+            return bulk_create(*args, **kwargs)
+
+        self.client.force_login(self.user2)
+        with mock.patch.object(UserBookRelation.objects, 'bulk_create', racing_bulk_create):
+            response = self.client.post(reverse('userbookrelation-bulk'),
+                                        data=json.dumps([{'book': self.book2.id, 'like': True}]),
+                                        content_type="application/json")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, len(calls))
+        self.book2.refresh_from_db()
+        self.assertEqual(1, self.book2.likes_count)
+
+    def test_bulk_invalid(self):
+        url = reverse('userbookrelation-bulk')
+        self.client.force_login(self.user2)
+        response = self.client.post(url, data=json.dumps({'book': self.book1.id}), content_type="application/json")
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class BookPaginationTestCase(APITestCase):
+    def setUp(self):
+        prices = [300, 100, 200, 100, 100, 250, 50]
+        self.books = [Book.objects.create(name=f'Book {i}', price=price) for i, price in enumerate(prices)]
+
+    def collect_pages(self, data):
+        url = reverse('book-list')
+        response = self.client.get(url, data=data)
+        ids = []
+        while True:
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            ids += [book['id'] for book in response.data['results']]
+            if not response.data['next']:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_pages_by_id(self):
+        ids, _ = self.collect_pages({'page_size': 3})
+        self.assertEqual(sorted(book.id for book in self.books), ids)
+
+    def test_pages_by_price(self):
+        ids, _ = self.collect_pages({'page_size': 2, 'ordering': 'price'})
+        expected = list(Book.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(expected, ids)
+
+        ids, _ = self.collect_pages({'page_size': 2, 'ordering': '-price'})
+        self.assertEqual(expected[::-1], ids)
+
+    def test_previous(self):
+        url = reverse('book-list')
+        first = self.client.get(url, data={'page_size': 3, 'ordering': 'price'})
+        second = self.client.get(first.data['next'])
+        self.assertIsNone(first.data['previous'])
+
+        previous = self.client.get(second.data['previous'])
+        self.assertEqual(first.data['results'], previous.data['results'])
+        self.assertIsNone(previous.data['previous'])
+
+    def test_count_and_page_size(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertNotIn('count', response.data)
+
+        response = self.client.get(url, data={'count': 'true', 'page_size': 1000})
+        self.assertEqual(7, response.data['count'])
+        self.assertEqual(7, len(response.data['results']))
+
+        response = self.client.get(url, data={'page_size': 2})
+        self.assertEqual(2, len(response.data['results']))
+
+    def test_invalid_cursor(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'cursor': 'garbage'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class BookCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="test_username")
+        self.book = Book.objects.create(name='Book', price=100.50, owner=self.user)
+
+    def test_hit_and_invalidation(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'ordering': 'price', 'page_size': 10})
+        self.assertEqual('MISS', response['X-Cache'])
+
+        # ни одного запроса: и ответ, и ETag - по версии каталога
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, data={'page_size': 10, 'ordering': 'price', 'search': ''})
+        self.assertEqual('HIT', cached['X-Cache'])
+        self.assertEqual(response.data, cached.data)
+
+        UserBookRelation.objects.create(user=self.user, book=self.book, like=True)
+        response = self.client.get(url, data={'ordering': 'price', 'page_size': 10})
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(1, response.data['results'][0]['likes_count'])
+
+    def test_detail_invalidation(self):
+        url = reverse('book-detail', args=(self.book.id, ))
+        self.client.get(url)
+        self.assertEqual('HIT', self.client.get(url)['X-Cache'])
+
+        self.book.name = 'New name'
+        self.book.save()
+        response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual('New name', response.data['name'])
+
+    def test_version_evicted(self):
+        url = reverse('book-list')
+        self.client.get(url)
+        self.assertEqual('HIT', self.client.get(url)['X-Cache'])
+
+        # версия пропала из кеша (вытеснение, перезапуск): новая случайная, старые ответы не подхватываются
+        get_version_cache().delete(CATALOG_VERSION_KEY)
+        self.assertEqual('MISS', self.client.get(url)['X-Cache'])
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            caches = {name: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                             'LOCATION': f'{location}/{name}'} for name in ('default', 'versions')}
+            with override_settings(CACHES=caches):
+                url = reverse('book-list')
+                self.assertEqual('MISS', self.client.get(url)['X-Cache'])
+                self.assertEqual('HIT', self.client.get(url)['X-Cache'])
+
+    def test_stats(self):
+        url = reverse('book-cache-stats')
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+        staff_user = User.objects.create(username="staff", is_staff=True)
+        self.client.force_login(staff_user)
+        before = self.client.get(url).data
+        self.client.get(reverse('book-list'))
+        self.client.get(reverse('book-list'))
+        after = self.client.get(url).data
+
+        self.assertEqual(before['hits'] + 1, after['hits'])
+        self.assertEqual(before['misses'] + 1, after['misses'])
+
+
+@shared_versions
+class BookConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book1 = Book.objects.create(name='Book', price=100.50, owner=self.user)
+        self.book2 = Book.objects.create(name='Test Book', price=200)
+
+    def test_detail(self):
+        url = reverse('book-detail', args=(self.book1.id, ))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        UserBookRelation.objects.create(user=self.user, book=self.book1, rating=5)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_detail_not_found(self):
+        response = self.client.get(reverse('book-detail', args=(self.book2.id + 100, )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_list(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        # 304 для списка не читает таблицу книг
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        self.book1.price = 300
+        self.book1.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        etag = response['ETag']
+
+        response = self.client.get(url, data={'ordering': 'price'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        self.book2.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, len(response.data['results']))
+
+    def test_local_versions(self):
+        # версии в LocMemCache у каждого воркера свои: ETag по ним мог бы дать ложный 304
+        with mock.patch('store.conditional.versions_shared', new=lambda: False):
+            self.assertNotIn('ETag', self.client.get(reverse('book-list')))
+            url = reverse('book-detail', args=(self.book1.id, ))
+            self.assertIn('ETag', self.client.get(url))
+            self.client.force_login(self.user)
+            self.assertNotIn('ETag', self.client.get(url, data={'fields': 'id,my_like'}))
+
+
+class BookSparseFieldsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book = Book.objects.create(name='Book', price=100.50, discount=10, owner=self.user)
+        UserBookRelation.objects.create(user=self.user, book=self.book, like=True)
+
+    def get_with_queries(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('book-list'), data=data)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response, context.captured_queries[-1]['sql']
+
+    def test_fields(self):
+        response, sql = self.get_with_queries({'fields': 'id,name,price_with_discount'})
+        self.assertEqual([{'id': self.book.id, 'name': 'Book', 'price_with_discount': '90.50'}],
+                         [dict(book) for book in response.data['results']])
+        self.assertNotIn('auth_user', sql)
+        self.assertNotIn('author_name', sql)
+        self.assertNotIn('search_vector', sql)
+
+    def test_exclude(self):
+        response, sql = self.get_with_queries({'exclude': 'owner_name,price_with_discount'})
+        book = response.data['results'][0]
+        self.assertNotIn('owner_name', book)
+        self.assertNotIn('price_with_discount', book)
+        self.assertEqual(1, book['likes_count'])
+        self.assertNotIn('auth_user', sql)
+        self.assertNotIn('discount', sql)
+
+    def test_owner_name(self):
+        response, sql = self.get_with_queries({'fields': 'owner_name'})
+        self.assertEqual([{'owner_name': 'test_username'}], [dict(book) for book in response.data['results']])
+        self.assertIn('auth_user', sql)
+
+    def test_readers_preview(self):
+        response, _ = self.get_with_queries({'fields': 'id', 'readers_preview': 2})
+        self.assertNotIn('readers_preview', response.data['results'][0])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('book-list'),
+                                       data={'fields': 'id,readers_preview', 'readers_preview': 2})
+        self.assertEqual(1, len(response.data['results'][0]['readers_preview']))
+
+    def test_detail_and_ordering(self):
+        Book.objects.create(name='Cheap', price=1)
+        response, _ = self.get_with_queries({'fields': 'name', 'ordering': 'price', 'page_size': 1})
+        self.assertEqual([{'name': 'Cheap'}], [dict(book) for book in response.data['results']])
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual([{'name': 'Book'}], [dict(book) for book in response.data['results']])
+
+        response = self.client.get(reverse('book-detail', args=(self.book.id, )), data={'fields': 'rating'})
+        self.assertEqual({'rating': None}, response.data)
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('book-list'), data={'fields': 'id,password'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+@shared_versions
+class BookUserStateTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.other_user = User.objects.create(username='other_reader')
+        self.book1 = Book.objects.create(name='Book', price=100)
+        self.book2 = Book.objects.create(name='Book 2', price=200)
+        self.book3 = Book.objects.create(name='Book 3', price=300)
+        UserBookRelation.objects.create(user=self.user, book=self.book1, like=True)
+        UserBookRelation.objects.create(user=self.user, book=self.book2, in_bookmarks=True, rating=4)
+        UserBookRelation.objects.create(user=self.other_user, book=self.book3, like=True)
+
+    def user_state(self, response):
+        return [(book['id'], book['my_like'], book['my_bookmark'], book['my_rating'])
+                for book in response.data['results']]
+
+    def test_anonymous(self):
+        response = self.client.get(reverse('book-list'))
+        self.assertNotIn('my_like', response.data['results'][0])
+
+        response = self.client.get(reverse('book-list'), data={'fields': 'id,my_like'})
+        self.assertEqual({'id'}, set(response.data['results'][0]))
+
+    def test_list(self):
+        self.client.force_login(self.user)
+        # те же запросы, что и без аннотаций: сессия, пользователь и одна выборка страницы
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('book-list'))
+        self.assertEqual([(self.book1.id, True, False, None),
+                          (self.book2.id, False, True, 4),
+                          (self.book3.id, False, False, None)], self.user_state(response))
+
+        response = self.client.get(reverse('book-list'), data={'fields': 'id,my_rating'})
+        self.assertEqual({'id': self.book2.id, 'my_rating': 4}, dict(response.data['results'][1]))
+
+    def test_detail(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book-detail', args=(self.book2.id, )))
+        self.assertEqual((False, True, 4), (response.data['my_like'], response.data['my_bookmark'],
+                                            response.data['my_rating']))
+
+    def test_cache_and_etag_vary_by_user(self):
+        self.client.force_login(self.user)
+        first = self.client.get(reverse('book-list'))
+        self.client.force_login(self.other_user)
+        response = self.client.get(reverse('book-list'), HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertNotEqual(first['ETag'], response['ETag'])
+        self.assertEqual([(self.book1.id, False, False, None),
+                          (self.book2.id, False, False, None),
+                          (self.book3.id, True, False, None)], self.user_state(response))
+
+    @override_settings(BOOK_COUNTERS_WRITE_BEHIND=True)
+    def test_own_change_visible_before_counters(self):
+        self.client.force_login(self.user)
+        first = self.client.get(reverse('book-list'))
+        self.client.patch(reverse('userbookrelation-detail', args=(self.book3.id, )),
+                          data=json.dumps({'like': True}), content_type='application/json')
+
+        response = self.client.get(reverse('book-list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.data['results'][2]['my_like'])
+        # сам счётчик обновится только после flush_book_counters
+        self.assertEqual(1, response.data['results'][2]['likes_count'])
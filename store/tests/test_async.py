@@ -0,0 +1,118 @@
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from store.metrics import registry
+from store.models import Book, UserBookRelation
+
+
+User = get_user_model()
+
+
+class AsyncBookApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="test_username")
+        self.book1 = Book.objects.create(name='Book', price=100.50, owner=self.user)
+        self.book2 = Book.objects.create(name='Book 2', price=325, author_name='testing Author')
+        self.book3 = Book.objects.create(name='Test Book', price=100.50, author_name='Author')
+        UserBookRelation.objects.create(user=self.user, book=self.book3, like=True, rating=1)
+
+    async def assertSameAsSync(self, name, args=(), data=None):
+        sync_response = await sync_to_async(self.client.get)(reverse(name, args=args), data=data)
+        async_response = await self.async_client.get(reverse(f'async-{name}', args=args), data=data)
+        self.assertEqual(sync_response.status_code, async_response.status_code)
+        self.assertEqual(sync_response.content, async_response.content.replace(b'/async', b''))
+
+    async def test_list(self):
+        await self.assertSameAsSync('book-list')
+        await self.assertSameAsSync('book-list', data={'price': 100.50})
+        await self.assertSameAsSync('book-list', data={'search': 'test'})
+        await self.assertSameAsSync('book-list', data={'ordering': '-price', 'page_size': 2, 'count': 'true'})
+        await self.assertSameAsSync('book-list', data={'fields': 'id,owner_name', 'readers_preview': 2})
+
+    async def test_list_next_page(self):
+        response = await self.async_client.get(reverse('async-book-list'), data={'page_size': 2})
+        response = await self.async_client.get(json.loads(response.content)['next'])
+        self.assertEqual([self.book3.id], [book['id'] for book in json.loads(response.content)['results']])
+
+    async def test_detail(self):
+        await self.assertSameAsSync('book-detail', args=(self.book3.id, ))
+        await self.assertSameAsSync('book-detail', args=(self.book3.id, ), data={'readers_preview': 1})
+        await self.assertSameAsSync('book-detail', args=(self.book3.id + 100, ))
+
+    async def test_errors(self):
+        response = await self.async_client.get(reverse('async-book-list'), data={'cursor': 'garbage'})
+        self.assertEqual(404, response.status_code)
+        response = await self.async_client.get(reverse('async-book-list'), data={'fields': 'password'})
+        self.assertEqual(400, response.status_code)
+        response = await self.async_client.post(reverse('async-book-list'))
+        self.assertEqual(405, response.status_code)
+
+    async def test_relation(self):
+        url = reverse('async-userbookrelation-detail', args=(self.book1.id, ))
+        data = json.dumps({'like': True, 'in_bookmarks': True})
+        response = await self.async_client.patch(url, data=data, content_type='application/json')
+        self.assertEqual(403, response.status_code)
+
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.patch(url, data=data, content_type='application/json')
+        self.assertEqual(200, response.status_code)
+
+        relation = await UserBookRelation.objects.aget(user=self.user, book=self.book1)
+        self.assertTrue(relation.like)
+        self.assertTrue(relation.in_bookmarks)
+        book = await Book.objects.aget(pk=self.book1.pk)
+        self.assertEqual(1, book.likes_count)
+
+        response = await self.async_client.patch(url, data=json.dumps({'rating': 9}), content_type='application/json')
+        self.assertEqual(400, response.status_code)
+
+        url = reverse('async-userbookrelation-detail', args=(self.book3.id + 100, ))
+        response = await self.async_client.patch(url, data=data, content_type='application/json')
+        self.assertEqual(404, response.status_code)
+
+    async def test_user_state(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('async-book-list'), data={'fields': 'id,my_like,my_rating'})
+        self.assertEqual({'id': self.book3.id, 'my_like': True, 'my_rating': 1},
+                         json.loads(response.content)['results'][2])
+
+    def get_if_none_match(self, url, etag):
+        # AsyncClient в Django 4.1 кладёт extra в ASGI-заголовки как есть, без перевода из формата META
+        return self.async_client.get(url, **{'If-None-Match': etag})
+
+    @mock.patch('store.conditional.versions_shared', new=lambda: True)
+    async def test_cache_and_etag(self):
+        url = reverse('async-book-detail', args=(self.book3.id, ))
+        response = await self.async_client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertIn('Last-Modified', response)
+        response = await self.async_client.get(url)
+        self.assertEqual('HIT', response['X-Cache'])
+        response = await self.get_if_none_match(url, response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+        url = reverse('async-book-list')
+        response = await self.async_client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        etag = response['ETag']
+        self.assertEqual('HIT', (await self.async_client.get(url))['X-Cache'])
+        self.assertEqual(304, (await self.get_if_none_match(url, etag)).status_code)
+
+        self.book3.price = 200
+        await sync_to_async(self.book3.save)()
+        response = await self.get_if_none_match(url, etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('MISS', response['X-Cache'])
+
+    async def test_metrics(self):
+        # MetricsMiddleware работает в async-режиме и видит запросы ORM из потока sync_to_async
+        registry.clear()
+        await self.async_client.get(reverse('async-book-list'))
+        self.assertGreater(registry.histograms[('db_queries', ('async-book-list', 'GET'))].sum, 0)
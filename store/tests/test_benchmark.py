@@ -0,0 +1,84 @@
+import json
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command, CommandError
+from django.db.models import Q, Sum
+from django.test import TestCase
+
+from store.logic import counters_drift, rating_drift
+from store.models import Book, UserBookRelation
+
+
+User = get_user_model()
+
+
+class GenerateDatasetTestCase(TestCase):
+    def test_generate(self):
+        call_command('generate_dataset', '--users', '20', '--books', '50', '--relations', '300', stdout=StringIO())
+
+        self.assertEqual(20, User.objects.filter(username__startswith='bench').count())
+        self.assertEqual(50, Book.objects.count())
+        self.assertEqual(300, UserBookRelation.objects.count())
+        self.assertEqual(300, Book.objects.aggregate(total=Sum('readers_count'))['total'])
+        self.assertFalse(counters_drift(Book.objects.all()).exists())
+        self.assertFalse(rating_drift(Book.objects.all()).exists())
+
+        # популярность неравномерная: у самой популярной книги заметно больше читателей, чем в среднем
+        top = Book.objects.order_by('-readers_count').values_list('readers_count', flat=True).first()
+        self.assertGreater(top, 3 * 300 / 50)
+
+    def test_clear_and_too_many_relations(self):
+        call_command('generate_dataset', '--users', '5', '--books', '10', '--relations', '20', stdout=StringIO())
+        # настоящие пользователи и книга, которых --clear трогать не должен, в том числе с тем же началом имени
+        user = User.objects.create(username='reader')
+        benchley = User.objects.create(username='benchley')
+        book = Book.objects.create(name='Настоящая книга', price=100, owner=user)
+        benchley_book = Book.objects.create(name='Книга Бенчли', price=100, owner=benchley)
+        UserBookRelation.objects.create(user=user, book=book, like=True)
+        UserBookRelation.objects.create(user=benchley, book=book, rating=5)
+        bench_user = User.objects.filter(username__regex=r'^bench\d+$').first()
+        UserBookRelation.objects.create(user=bench_user, book=book, like=True)
+        synthetic_books = set(Book.objects.exclude(pk__in=[book.pk, benchley_book.pk]).filter(
+            Q(owner__username__regex=r'^bench\d+$') | Q(readers__username__regex=r'^bench\d+$'),
+        ).values_list('pk', flat=True))
+        self.assertTrue(synthetic_books)
+
+        call_command('generate_dataset', '--users', '5', '--books', '10', '--relations', '20', '--clear',
+                     stdout=StringIO())
+        self.assertEqual(5, User.objects.filter(username__regex=r'^bench\d+$').count())
+        self.assertEqual(2, User.objects.filter(pk__in=[user.pk, benchley.pk]).count())
+        self.assertTrue(Book.objects.filter(pk=benchley_book.pk).exists())
+        self.assertFalse(Book.objects.filter(pk__in=synthetic_books).exists())
+        book.refresh_from_db()
+        self.assertEqual((1, 1), (book.likes_count, book.rating_count))
+        self.assertEqual({user.pk, benchley.pk},
+                         set(UserBookRelation.objects.filter(book=book).values_list('user', flat=True)))
+
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', '--users', '2', '--books', '2', '--relations', '5')
+
+
+class BenchmarkApiTestCase(TestCase):
+    def test_json_report(self):
+        call_command('generate_dataset', '--users', '10', '--books', '30', '--relations', '100', stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark_api', '--requests', '3', '--warmup', '0', '--json', stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(30, report['books'])
+        self.assertIn('relation', report['scenarios'])
+        # лайки меняет только отдельный синтетический пользователь, его удаляет --clear
+        self.assertEqual(100, UserBookRelation.objects.exclude(user__username='bench-benchmark').count())
+        self.assertTrue(UserBookRelation.objects.filter(user__username='bench-benchmark').exists())
+        call_command('generate_dataset', '--users', '1', '--books', '1', '--relations', '1', '--clear',
+                     stdout=StringIO())
+        self.assertFalse(User.objects.filter(username='bench-benchmark').exists())
+        for result in report['scenarios'].values():
+            self.assertEqual({'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries'}, set(result))
+            self.assertGreater(result['queries'], 0)
+
+    def test_unknown_scenario(self):
+        Book.objects.create(name='Book', price=100)
+        with self.assertRaises(CommandError):
+            call_command('benchmark_api', '--scenarios', 'list,unknown')
@@ -0,0 +1,136 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.models import Book, UserBookRelation
+
+
+User = get_user_model()
+
+
+class ExportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.staff = User.objects.create(username="staff", is_staff=True)
+        self.book1 = Book.objects.create(name='Book', price=100.50, owner=self.user)
+        self.book2 = Book.objects.create(name='Книга, "с кавычками"', price=325, author_name='Author')
+        UserBookRelation.objects.create(user=self.user, book=self.book1, like=True, rating=5)
+
+    def test_export_ndjson(self):
+        url = reverse('book-export')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, self.client.get(url).status_code)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.streaming)
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([self.book1.id, self.book2.id], [row['id'] for row in rows])
+        self.assertEqual('100.50', rows[0]['price'])
+        self.assertEqual('5.00', rows[0]['rating'])
+        self.assertEqual(1, rows[0]['likes_count'])
+        self.assertEqual(self.user.id, rows[0]['owner_id'])
+        self.assertIsNone(rows[1]['rating'])
+
+    def test_export_csv_filtered(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('book-export'), data={'type': 'csv', 'price': 325})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+        self.assertEqual(1, len(rows))
+        self.assertEqual('Книга, "с кавычками"', rows[0]['name'])
+        self.assertEqual('', rows[0]['rating'])
+
+    def test_export_invalid_type(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('book-export'), data={'type': 'xml'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class ImportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book = Book.objects.create(name='Book', price=100.50)
+
+    def run_import(self, content, suffix):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8') as file:
+            file.write(content)
+        out, err = io.StringIO(), io.StringIO()
+        try:
+            call_command('import_books', file.name, '--batch-size', '2', stdout=out, stderr=err)
+        finally:
+            os.unlink(file.name)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_ndjson(self):
+        lines = [
+            {'id': self.book.id, 'name': 'Renamed', 'price': '120.00'},
+            {'name': 'New book', 'price': '10', 'author_name': 'Author', 'owner_id': self.user.id},
+            {'name': 'Too expensive', 'price': '123456789'},
+            {'name': 'Unknown owner', 'price': '1', 'owner_id': self.user.id + 100},
+            {'id': self.book.id + 50, 'name': 'With id', 'price': '5'},
+        ]
+        content = '\n'.join(json.dumps(line) for line in lines) + '\nnot json\n'
+        out, err = self.run_import(content, '.ndjson')
+
+        self.assertIn('Создано: 2, обновлено: 1, с ошибками: 3', out)
+        self.assertIn('Строка 3', err)
+        self.book.refresh_from_db()
+        self.assertEqual('Renamed', self.book.name)
+        self.assertEqual(Decimal('120.00'), self.book.price)
+        self.assertEqual(self.user, Book.objects.get(name='New book').owner)
+        self.assertTrue(Book.objects.filter(id=self.book.id + 50, name='With id').exists())
+
+        # последовательность подтянута за явно заданный id
+        self.assertGreater(Book.objects.create(name='After import', price=1).id, self.book.id + 50)
+
+    def test_import_duplicate_ids(self):
+        lines = [
+            {'id': self.book.id + 10, 'name': 'First', 'price': '5'},
+            {'id': self.book.id + 10, 'name': 'Duplicate', 'price': '6'},
+            {'id': self.book.id, 'name': 'Renamed', 'price': '7'},
+            {'id': self.book.id, 'name': 'Renamed twice', 'price': '8'},
+        ]
+        out, err = self.run_import('\n'.join(json.dumps(line) for line in lines), '.ndjson')
+
+        self.assertIn('Создано: 1, обновлено: 1, с ошибками: 2', out)
+        self.assertIn('Строка 2', err)
+        self.assertIn('Строка 4', err)
+        self.assertEqual('First', Book.objects.get(id=self.book.id + 10).name)
+        self.assertEqual('Renamed', Book.objects.get(id=self.book.id).name)
+
+    def test_import_mixed_ids(self):
+        # явные id впереди последовательности, книги без id - в той же и в следующей пачке (по 2 строки)
+        lines = [
+            {'name': 'Without id', 'price': '1'},
+            {'id': self.book.id + 1, 'name': 'With id', 'price': '2'},
+            {'id': self.book.id + 3, 'name': 'With id 2', 'price': '3'},
+            {'name': 'Without id 2', 'price': '4'},
+            {'name': 'Without id 3', 'price': '5'},
+        ]
+        out, err = self.run_import('\n'.join(json.dumps(line) for line in lines), '.ndjson')
+
+        self.assertIn('Создано: 5, обновлено: 0, с ошибками: 0', out)
+        self.assertEqual('', err)
+        self.assertEqual('With id', Book.objects.get(id=self.book.id + 1).name)
+        self.assertEqual('With id 2', Book.objects.get(id=self.book.id + 3).name)
+
+    def test_export_import_csv_roundtrip(self):
+        Book.objects.create(name='Second, book', price=20, author_name='Author')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'books.csv')
+            call_command('export_books', '--format', 'csv', '--output', path, stderr=io.StringIO())
+            Book.objects.update(name='changed')
+            call_command('import_books', path, stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(['Book', 'Second, book'], list(Book.objects.order_by('id').values_list('name', flat=True)))
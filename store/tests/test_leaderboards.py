@@ -0,0 +1,141 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from store import leaderboards
+from store.logic import apply_relation_changes, flush_dirty_books
+from store.models import Book, BookActivity, LeaderboardBaseline, LeaderboardEntry, UserBookRelation
+
+
+User = get_user_model()
+
+
+def board(name, window_days=0):
+    # доски обновляет flush_book_counters - сначала обрабатываем очередь
+    flush_dirty_books(delay=0)
+    return [(entry.book_id, entry.score) for entry in leaderboards.top(name, window_days, 100)]
+
+
+@override_settings(BOOK_LEADERBOARD_SIZE=2, BOOK_LEADERBOARD_MIN_RATINGS=2, BOOK_LEADERBOARD_WINDOWS=[7])
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user{index}') for index in range(3)]
+        self.books = [Book.objects.create(name=f'Book {index}', price=100) for index in range(3)]
+
+    def like(self, user, book, like=True):
+        relation, _ = UserBookRelation.objects.get_or_create(user=user, book=book)
+        relation.like = like
+        relation.save()
+
+    def test_incremental(self):
+        self.like(self.users[0], self.books[0])
+        self.like(self.users[0], self.books[1])
+        self.like(self.users[1], self.books[1])
+        self.assertEqual([(self.books[1].id, 2), (self.books[0].id, 1)], board('likes'))
+
+        # доска полна: книга с одним лайком не обходит последнее место с тем же счётом и меньшим id
+        self.like(self.users[0], self.books[2])
+        self.assertEqual([(self.books[1].id, 2), (self.books[0].id, 1)], board('likes'))
+        self.like(self.users[1], self.books[2])
+        self.assertEqual([(self.books[1].id, 2), (self.books[2].id, 2)], board('likes'))
+
+        self.like(self.users[0], self.books[1], like=False)
+        self.like(self.users[1], self.books[1], like=False)
+        self.assertEqual([(self.books[2].id, 2)], board('likes'))
+        self.assertEqual([(self.books[2].id, 2)], board('likes', 7))
+        self.assertEqual([], board('bookmarks'))
+
+    def test_rating_needs_min_ratings(self):
+        apply_relation_changes(self.users[0], [{'book': self.books[0].id, 'rating': 5},
+                                               {'book': self.books[1].id, 'rating': 3}])
+        self.assertEqual([], board('rating'))
+        apply_relation_changes(self.users[1], [{'book': self.books[0].id, 'rating': 4},
+                                               {'book': self.books[1].id, 'rating': 3}])
+        self.assertEqual([(self.books[0].id, 4.5), (self.books[1].id, 3)], board('rating'))
+        self.assertEqual([(self.books[0].id, 4.5), (self.books[1].id, 3)], board('rating', 7))
+
+    def test_window_and_rebuild(self):
+        self.like(self.users[0], self.books[0])
+        self.like(self.users[1], self.books[0])
+        self.like(self.users[0], self.books[1])
+        flush_dirty_books(delay=0)
+        BookActivity.objects.filter(book=self.books[0]).update(day=timezone.localdate() - timedelta(days=10))
+        self.assertEqual([(self.books[0].id, 2), (self.books[1].id, 1)], board('likes'))
+
+        LeaderboardEntry.objects.filter(board='likes', window_days=0).update(score=7)
+        out = StringIO()
+        call_command('rebuild_leaderboards', stdout=out)
+        self.assertIn('Мест в лидербордах: 3', out.getvalue())
+        self.assertEqual([(self.books[0].id, 2), (self.books[1].id, 1)], board('likes'))
+        self.assertEqual([(self.books[1].id, 1)], board('likes', 7))
+        self.assertFalse(BookActivity.objects.filter(book=self.books[0]).exists())
+
+    def test_reactions_deferred(self):
+        self.like(self.users[0], self.books[0])
+        self.like(self.users[1], self.books[0])
+        self.like(self.users[1], self.books[0], like=False)
+        self.assertFalse(LeaderboardEntry.objects.exists())
+        self.assertFalse(BookActivity.objects.exists())
+
+        # активность - разница счётчиков с прошлого пересчёта, а не каждая реакция
+        self.assertEqual(1, flush_dirty_books(delay=0))
+        self.assertEqual(1, BookActivity.objects.get(book=self.books[0]).likes)
+        self.like(self.users[2], self.books[0])
+        self.assertEqual([(self.books[0].id, 2)], board('likes', 7))
+        self.assertEqual(2, BookActivity.objects.get(book=self.books[0]).likes)
+
+    def test_rebuild_resets_baselines(self):
+        # счётчики, записанные в обход очереди, после сборки досок заново активностью не считаются
+        Book.objects.filter(pk=self.books[0].pk).update(likes_count=5)
+        leaderboards.rebuild()
+        self.assertEqual(5, LeaderboardBaseline.objects.get(book=self.books[0]).likes_count)
+        self.like(self.users[0], self.books[0])
+        self.assertEqual([(self.books[0].id, 1)], board('likes', 7))
+        self.assertEqual([(self.books[0].id, 6)], board('likes'))
+        self.assertEqual(6, LeaderboardBaseline.objects.get(book=self.books[0]).likes_count)
+
+    @override_settings(BOOK_COUNTERS_WRITE_BEHIND=True)
+    def test_write_behind(self):
+        self.like(self.users[0], self.books[0])
+        self.assertFalse(BookActivity.objects.exists())
+        self.assertEqual([(self.books[0].id, 1)], board('likes'))
+        self.assertEqual([(self.books[0].id, 1)], board('likes', 7))
+        self.assertEqual(1, BookActivity.objects.get(book=self.books[0]).likes)
+
+
+@override_settings(BOOK_LEADERBOARD_WINDOWS=[7], BOOK_LEADERBOARD_MIN_RATINGS=1)
+class LeaderboardApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.book1 = Book.objects.create(name='Book', price=100, author_name='Author')
+        self.book2 = Book.objects.create(name='Book 2', price=200)
+        UserBookRelation.objects.create(user=self.user, book=self.book1, like=True, rating=3)
+        UserBookRelation.objects.create(user=self.user, book=self.book2, rating=5)
+        flush_dirty_books(delay=0)
+
+    def test_top(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('book-top'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'board': 'rating', 'window': 0, 'results': [
+            {'position': 1, 'score': '5.00', 'book': {
+                'id': self.book2.id, 'name': 'Book 2', 'author_name': None, 'price': '200.00', 'rating': '5.00',
+                'likes_count': 0, 'bookmarks_count': 0}},
+            {'position': 2, 'score': '3.00', 'book': {
+                'id': self.book1.id, 'name': 'Book', 'author_name': 'Author', 'price': '100.00', 'rating': '3.00',
+                'likes_count': 1, 'bookmarks_count': 0}},
+        ]}, response.data)
+
+        response = self.client.get(reverse('book-top'), data={'board': 'likes', 'window': 7, 'limit': 1})
+        self.assertEqual([(1, 1, self.book1.id)], [(entry['position'], entry['score'], entry['book']['id'])
+                                                   for entry in response.data['results']])
+
+    def test_invalid_params(self):
+        for params in ({'board': 'price'}, {'window': 30}, {'window': 'week'}, {'limit': 0}, {'limit': 1000}):
+            response = self.client.get(reverse('book-top'), data=params)
+            self.assertEqual(400, response.status_code, params)
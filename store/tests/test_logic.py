@@ -0,0 +1,276 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command, CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from store.logic import (
+    apply_relation_changes, counters_drift, flush_dirty_books, rating_drift, recompute_books, set_rating,
+)
+from store.models import Book, DirtyBook, UserBookRelation
+
+
+User = get_user_model()
+
+
+class SetRatingTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+        self.user3 = User.objects.create(username="user3")
+        self.book = Book.objects.create(name='Book', price=100.50, owner=self.user1)
+
+    def test_create(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book, rating=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book, rating=4)
+        UserBookRelation.objects.create(user=self.user3, book=self.book)
+        self.book.refresh_from_db()
+
+        self.assertEqual(9, self.book.rating_sum)
+        self.assertEqual(2, self.book.rating_count)
+        self.assertEqual(Decimal('4.50'), self.book.rating)
+
+    def test_change_and_clear(self):
+        relation = UserBookRelation.objects.create(user=self.user1, book=self.book, rating=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book, rating=2)
+
+        relation.rating = 4
+        relation.save()
+        self.book.refresh_from_db()
+        self.assertEqual(Decimal('3.00'), self.book.rating)
+
+        relation.rating = None
+        relation.save()
+        self.book.refresh_from_db()
+        self.assertEqual(1, self.book.rating_count)
+        self.assertEqual(Decimal('2.00'), self.book.rating)
+
+    def test_relation_loaded_from_db(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book, rating=3)
+        relation = UserBookRelation.objects.get(user=self.user1, book=self.book)
+        relation.like = True
+        relation.save()
+        relation.rating = 5
+        relation.save()
+        self.book.refresh_from_db()
+
+        self.assertEqual(5, self.book.rating_sum)
+        self.assertEqual(1, self.book.rating_count)
+        self.assertEqual(Decimal('5.00'), self.book.rating)
+
+    def test_delete(self):
+        relation = UserBookRelation.objects.create(user=self.user1, book=self.book, rating=5)
+        relation.delete()
+        self.book.refresh_from_db()
+
+        self.assertEqual(0, self.book.rating_sum)
+        self.assertEqual(0, self.book.rating_count)
+        self.assertIsNone(self.book.rating)
+
+    def test_set_rating(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book, rating=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book, rating=4)
+        UserBookRelation.objects.create(user=self.user3, book=self.book, rating=4)
+        Book.objects.update(rating=None, rating_sum=0, rating_count=0)
+
+        set_rating(self.book)
+        self.assertEqual(13, self.book.rating_sum)
+        self.assertEqual(3, self.book.rating_count)
+        self.assertEqual(Decimal('4.33'), self.book.rating)
+
+
+class BackfillRatingsTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="user1")
+        self.book = Book.objects.create(name='Book', price=100.50)
+        UserBookRelation.objects.create(user=user, book=self.book, rating=5)
+
+    def test_verify_and_backfill(self):
+        call_command('backfill_ratings', '--verify', stdout=StringIO())
+
+        Book.objects.update(rating_sum=1, rating_count=7)
+        self.assertEqual([self.book.id], list(rating_drift(Book.objects.all()).values_list('id', flat=True)))
+        with self.assertRaises(CommandError):
+            call_command('backfill_ratings', '--verify', stdout=StringIO())
+
+        call_command('backfill_ratings', stdout=StringIO())
+        self.book.refresh_from_db()
+        self.assertEqual(5, self.book.rating_sum)
+        self.assertEqual(1, self.book.rating_count)
+        self.assertEqual(Decimal('5.00'), self.book.rating)
+
+
+class ReactionCountersTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+        self.book = Book.objects.create(name='Book', price=100.50)
+
+    def test_toggle(self):
+        relation = UserBookRelation.objects.create(user=self.user1, book=self.book, like=True)
+        UserBookRelation.objects.create(user=self.user2, book=self.book, like=True, in_bookmarks=True)
+        self.book.refresh_from_db()
+        self.assertEqual(2, self.book.likes_count)
+        self.assertEqual(1, self.book.bookmarks_count)
+        self.assertEqual(2, self.book.readers_count)
+
+        relation.like = False
+        relation.in_bookmarks = True
+        relation.save()
+        self.book.refresh_from_db()
+        self.assertEqual(1, self.book.likes_count)
+        self.assertEqual(2, self.book.bookmarks_count)
+
+    def test_stale_instance(self):
+        # два запроса загрузили связь до того, как любой из них её сохранил
+        UserBookRelation.objects.create(user=self.user1, book=self.book)
+        first = UserBookRelation.objects.get(user=self.user1, book=self.book)
+        second = UserBookRelation.objects.get(user=self.user1, book=self.book)
+        for relation in (first, second):
+            relation.like = True
+            relation.rating = 1
+            relation.save()
+        self.book.refresh_from_db()
+        self.assertEqual(1, self.book.likes_count)
+        self.assertEqual(1, self.book.rating_count)
+        self.assertFalse(counters_drift(Book.objects.all()).exists())
+
+    def test_delete(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book, like=True, in_bookmarks=True)
+        self.user1.delete()
+        self.book.refresh_from_db()
+
+        self.assertEqual(0, self.book.likes_count)
+        self.assertEqual(0, self.book.bookmarks_count)
+        self.assertEqual(0, self.book.readers_count)
+
+    def test_reconcile_counters(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book, like=True)
+        Book.objects.update(likes_count=5, bookmarks_count=3)
+
+        call_command('reconcile_counters', '--dry-run', stdout=StringIO())
+        self.assertEqual([self.book.id], list(counters_drift(Book.objects.all()).values_list('id', flat=True)))
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.book.refresh_from_db()
+        self.assertIn('ID %s: likes 5 -> 1, bookmarks 3 -> 0' % self.book.id, out.getvalue())
+        self.assertEqual(1, self.book.likes_count)
+        self.assertEqual(0, self.book.bookmarks_count)
+        self.assertFalse(counters_drift(Book.objects.all()).exists())
+
+
+@override_settings(BOOK_COUNTERS_WRITE_BEHIND=True)
+class WriteBehindTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+        self.book = Book.objects.create(name='Book', price=100.50)
+        self.other_book = Book.objects.create(name='Other', price=200)
+
+    def test_mark_and_flush(self):
+        relation = UserBookRelation.objects.create(user=self.user1, book=self.book, rating=5, like=True)
+        UserBookRelation.objects.create(user=self.user2, book=self.book, rating=4)
+        relation.rating = 3
+        relation.save()
+
+        self.book.refresh_from_db()
+        self.assertEqual((0, 0, None), (self.book.readers_count, self.book.likes_count, self.book.rating))
+        # отметка на каждую реакцию, книга в очереди одна
+        self.assertEqual(3, DirtyBook.objects.filter(book=self.book).count())
+        self.assertFalse(DirtyBook.objects.exclude(book=self.book).exists())
+
+        self.assertEqual(1, flush_dirty_books(delay=0))
+        self.book.refresh_from_db()
+        self.assertEqual(2, self.book.readers_count)
+        self.assertEqual(1, self.book.likes_count)
+        self.assertEqual(2, self.book.rating_count)
+        self.assertEqual(Decimal('3.50'), self.book.rating)
+        self.assertFalse(DirtyBook.objects.exists())
+        self.assertEqual(0, flush_dirty_books(delay=0))
+
+    def test_delay_and_max_staleness(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book, rating=5)
+
+        self.assertEqual(0, flush_dirty_books(delay=60, max_staleness=600))
+        self.assertEqual(1, flush_dirty_books(delay=60, max_staleness=0))
+        self.book.refresh_from_db()
+        self.assertEqual(Decimal('5.00'), self.book.rating)
+
+    def test_unchanged_save_does_not_mark(self):
+        relation = UserBookRelation.objects.create(user=self.user1, book=self.book)
+        flush_dirty_books(delay=0)
+        relation.save()
+        self.assertFalse(DirtyBook.objects.exists())
+
+    def test_bulk_changes_and_command(self):
+        apply_relation_changes(self.user1, [{'book': self.book.id, 'like': True},
+                                            {'book': self.other_book.id, 'rating': 4}])
+        self.assertEqual(2, DirtyBook.objects.count())
+
+        out = StringIO()
+        call_command('flush_book_counters', '--delay', '0', stdout=out)
+        self.assertIn('Пересчитано книг: 2', out.getvalue())
+        self.book.refresh_from_db()
+        self.other_book.refresh_from_db()
+        self.assertEqual(1, self.book.likes_count)
+        self.assertEqual(Decimal('4.00'), self.other_book.rating)
+
+
+class RecomputeBooksTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+        self.books = [Book.objects.create(name=f'Book {index}', price=100) for index in range(3)]
+        UserBookRelation.objects.create(user=self.user1, book=self.books[0], like=True, rating=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.books[0], in_bookmarks=True, rating=4)
+        UserBookRelation.objects.create(user=self.user1, book=self.books[1], rating=2)
+        Book.objects.filter(pk=self.books[0].pk).update(likes_count=3, rating=1, rating_sum=1, rating_count=1)
+        Book.objects.filter(pk=self.books[2].pk).update(readers_count=2)
+
+    def test_dry_run(self):
+        start, stop = self.books[0].id, self.books[2].id + 1
+        scanned, changes = recompute_books(start, stop, dry_run=True)
+        self.assertEqual(3, scanned)
+        self.assertEqual([self.books[0].id, self.books[2].id], [change['id'] for change in changes])
+        self.assertEqual(['3', '1'], changes[0]['likes_count'])
+        self.assertEqual(['1.00', '4.50'], changes[0]['rating'])
+        self.assertTrue(counters_drift(Book.objects.all()).exists())
+
+    def test_update(self):
+        start, stop = self.books[0].id, self.books[2].id + 1
+        self.assertEqual((3, [self.books[0].id, self.books[2].id]), recompute_books(start, stop))
+        self.assertFalse(counters_drift(Book.objects.all()).exists())
+        self.assertFalse(rating_drift(Book.objects.all()).exists())
+        self.assertEqual((1, []), recompute_books(start, stop, ids=[self.books[0].id]))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('recompute_books', '--dry-run', '--chunk-size', '2', stdout=out)
+        self.assertIn(f'ID {self.books[0].id}: likes_count 3 -> 1, rating_sum 1 -> 9, rating_count 1 -> 2, '
+                      f'rating 1.00 -> 4.50', out.getvalue())
+        self.assertIn('Книг: 3, расхождений: 2', out.getvalue())
+        self.assertTrue(counters_drift(Book.objects.all()).exists())
+
+        out = StringIO()
+        call_command('recompute_books', '--ids', f'{self.books[2].id}', stdout=out)
+        self.assertIn('Книг: 1, исправлено: 1', out.getvalue())
+        self.book = Book.objects.get(pk=self.books[2].pk)
+        self.assertEqual(0, self.book.readers_count)
+
+
+class RecomputeBooksParallelTestCase(TransactionTestCase):
+    def test_workers(self):
+        user = User.objects.create(username="user1")
+        books = [Book.objects.create(name=f'Book {index}', price=100) for index in range(10)]
+        for book in books[::3]:
+            UserBookRelation.objects.create(user=user, book=book, like=True, rating=3)
+        Book.objects.update(likes_count=5, rating=None)
+
+        out = StringIO()
+        call_command('recompute_books', '--workers', '2', '--chunk-size', '3', stdout=out)
+        self.assertIn('[4/4]', out.getvalue())
+        self.assertIn('Книг: 10, исправлено: 10', out.getvalue())
+        self.assertEqual([(1, Decimal('3.00')) if index % 3 == 0 else (0, None) for index in range(10)],
+                         list(Book.objects.order_by('id').values_list('likes_count', 'rating')))
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from store.metrics import registry
+from store.models import Book
+
+
+User = get_user_model()
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        registry.clear()
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        Book.objects.create(name='Book', price=100)
+        Book.objects.create(name='Book 2', price=200)
+
+    def histogram(self, name, view='book-list', method='GET'):
+        return registry.histograms[(name, (view, method))]
+
+    def test_request_recorded(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-list'))
+
+        self.assertEqual(1, self.histogram('request_duration_seconds').count)
+        self.assertEqual(len(queries), self.histogram('db_queries').sum)
+        self.assertEqual(len(response.content), self.histogram('response_size_bytes').sum)
+        self.assertEqual(1, self.histogram('render_duration_seconds').count)
+        self.assertGreater(self.histogram('render_duration_seconds').sum, 0)
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics/')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('book_store_requests_total{view="book-list",method="GET",status="200"} 1', body)
+        self.assertIn('# TYPE book_store_db_queries histogram', body)
+        self.assertIn('book_store_db_queries_bucket{view="book-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('book_store_db_queries_count{view="book-list",method="GET"} 1', body)
+
+    def test_access(self):
+        self.assertEqual(403, self.client.get('/metrics/').status_code)
+        with override_settings(BOOK_METRICS_TOKEN='secret'):
+            self.assertEqual(403, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code)
+            self.assertEqual(200, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code)
+
+    @override_settings(BOOK_METRICS_SAMPLE_RATE=0)
+    def test_sampling(self):
+        self.client.get(reverse('book-list'))
+        self.assertEqual({}, registry.histograms)
+
+    @override_settings(BOOK_METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('store.metrics', 'WARNING') as logs:
+            self.client.get(reverse('book-list'))
+        self.assertIn('Медленный запрос GET /book/', logs.output[0])
+        self.assertIn('FROM "store_book"', logs.output[0])
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from copy import deepcopy
+
+import psycopg2
+import psycopg2.extensions
+from django.db import connection
+from django.test import TestCase
+
+from store.metrics import registry
+from store.pooled_postgresql.base import ConnectionPool, DatabaseWrapper, close_pools, get_pools
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rolled_back = False
+        self.broken = False
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rolled_back = True
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+
+
+class ConnectionPoolTestCase(TestCase):
+    def test_reuse(self):
+        pool = ConnectionPool(FakeConnection, max_size=2)
+        first = pool.get()
+        pool.put(first)
+        self.assertIs(first, pool.get())
+        self.assertEqual(1, pool.get_stats()['created'])
+        self.assertEqual({'size': 1, 'idle': 0, 'in_use': 1}, {
+            name: value for name, value in pool.get_stats().items() if name in ('size', 'idle', 'in_use')})
+
+    def test_timeout(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.05)
+        pool.get()
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.get()
+        self.assertEqual(1, pool.get_stats()['timeouts'])
+
+    def test_wait_for_returned_connection(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=5)
+        held = pool.get()
+        timer = threading.Timer(0.05, pool.put, args=(held, ))
+        timer.start()
+        self.assertIs(held, pool.get())
+        timer.join()
+
+        stats = pool.get_stats()
+        self.assertEqual(1, stats['waits'])
+        self.assertGreater(stats['wait_seconds'], 0)
+
+    def test_put_rolls_back_and_discards_closed(self):
+        pool = ConnectionPool(FakeConnection, max_size=2)
+        in_transaction = pool.get()
+        in_transaction.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool.put(in_transaction)
+        self.assertTrue(in_transaction.rolled_back)
+        self.assertEqual(1, pool.get_stats()['idle'])
+
+        closed = pool.get()
+        closed.close()
+        pool.put(closed)
+        self.assertEqual(0, pool.get_stats()['size'])
+
+    def test_health_check(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, check_after=0)
+        broken = pool.get()
+        pool.put(broken)
+        broken.broken = True
+        time.sleep(0.001)
+
+        fresh = pool.get()
+        self.assertIsNot(broken, fresh)
+        self.assertTrue(broken.closed)
+        self.assertEqual(1, pool.get_stats()['discarded'])
+
+
+class PooledBackendTestCase(TestCase):
+    # пул общий на alias и параметры подключения: при DB_POOL=True в нём же и соединение тестов,
+    # поэтому проверяются изменения статистики, а не абсолютные значения
+    def setUp(self):
+        settings_dict = deepcopy(connection.settings_dict)
+        settings_dict.update(ENGINE='store.pooled_postgresql', CONN_MAX_AGE=0)
+        settings_dict['OPTIONS'] = {**settings_dict['OPTIONS'], 'pool': {'max_size': 2}}
+        self.wrapper = DatabaseWrapper(settings_dict, connection.alias)
+        self.addCleanup(close_pools)
+        self.addCleanup(self.wrapper.close)
+
+    def select_backend_pid(self):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_connection_returned_to_pool(self):
+        pid = self.select_backend_pid()
+        raw = self.wrapper.connection
+        before = self.wrapper.pool.get_stats()
+        self.wrapper.close()
+        self.assertFalse(raw.closed)
+        self.assertEqual(before['idle'] + 1, self.wrapper.pool.get_stats()['idle'])
+
+        self.assertEqual(pid, self.select_backend_pid())
+        self.assertIs(raw, self.wrapper.connection)
+        self.assertEqual(before['created'], self.wrapper.pool.get_stats()['created'])
+
+        body = registry.render()
+        self.assertIn('# TYPE book_store_db_pool_size gauge', body)
+        self.assertIn('book_store_db_pool_in_use{alias="default"', body)
+
+    def test_close_in_atomic_block_discards(self):
+        self.wrapper.ensure_connection()
+        raw = self.wrapper.connection
+        size = self.wrapper.pool.get_stats()['size']
+        self.wrapper.in_atomic_block = True
+        self.wrapper.close()
+        self.wrapper.in_atomic_block = False
+        self.assertTrue(raw.closed)
+        self.assertEqual(size - 1, self.wrapper.pool.get_stats()['size'])
+
+    def test_fork_starts_with_empty_pools(self):
+        backend_pid = self.select_backend_pid()
+        self.wrapper.close()
+        self.assertTrue(get_pools())
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # соединения родителя в дочернем процессе недоступны
+            os.write(write, str(len(get_pools())).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(b'0', os.read(read, 16))
+        # и не закрыты им: родитель получает из пула то же соединение
+        self.assertEqual(backend_pid, self.select_backend_pid())
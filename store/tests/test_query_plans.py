@@ -0,0 +1,119 @@
+import json
+import random
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from store import leaderboards
+from store.logic import counters_drift, rating_drift
+from store.models import Book, LeaderboardEntry, UserBookRelation
+
+
+User = get_user_model()
+
+
+class QueryPlanTestCase(APITestCase):
+    """
+    На заполненной базе ключевые запросы эндпоинтов должны идти по индексам, а не полным просмотром таблиц.
+    Берётся EXPLAIN каждого SQL, который реально выполнил запрос к эндпоинту.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(14)
+        cls.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(100)])
+        cls.books = Book.objects.bulk_create(
+            [Book(name=f'Book {i}', price=i % 500 + 0.5, author_name=f'Author {i % 50}') for i in range(3000)])
+        UserBookRelation.objects.bulk_create([
+            UserBookRelation(user=user, book=book, like=rnd.random() < 0.3, in_bookmarks=rnd.random() < 0.1,
+                             rating=rnd.choice([None, 1, 2, 3, 4, 5]))
+            for user in cls.users for book in rnd.sample(cls.books, 30)
+        ])
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(board=board, window_days=window_days, book=book, score=rnd.randint(1, 1000))
+            for board in leaderboards.BOARDS for window_days in (0, 7, 30, 90) for book in cls.books[:200]
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE store_book, store_userbookrelation, store_leaderboardentry, auth_user')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def captured_plans(self, queries, table):
+        selects = [query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']]
+        self.assertTrue(selects)
+        return [self.explain(sql) for sql in selects]
+
+    def assertIndexPlan(self, plan, index_name=None):
+        # маленькую auth_user планировщик вправе читать целиком, таблицы каталога - нет
+        self.assertNotIn('Seq Scan on store_', plan)
+        if index_name:
+            self.assertIn(index_name, plan)
+
+    def book_plans(self, url):
+        # все SELECT, которые читают store_book (в FROM или JOIN), а не только запрос страницы
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        selects = [query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT') and '"store_book"' in query['sql']]
+        self.assertTrue(selects)
+        plans = [self.explain(sql) for sql in selects]
+        for plan in plans:
+            self.assertNotIn('Seq Scan on store_book', plan)
+        return plans, response
+
+    def test_list_ordered_by_price(self):
+        plans, response = self.book_plans(reverse('book-list') + '?ordering=price')
+        self.assertIndexPlan(plans[0], 'store_book_price_id_idx')
+
+        plans, _ = self.book_plans(response.data['next'])
+        self.assertIndexPlan(plans[0], 'store_book_price_id_idx')
+
+    def test_list_filtered_by_price(self):
+        plans, response = self.book_plans(reverse('book-list') + '?price=100.50')
+        self.assertEqual(6, len(response.data['results']))
+        for plan in plans:
+            self.assertIndexPlan(plan, 'store_book_price_id_idx')
+
+    def test_detail(self):
+        plans, _ = self.book_plans(reverse('book-detail', args=(self.books[10].id, )))
+        for plan in plans:
+            self.assertIndexPlan(plan, 'store_book_pkey')
+
+    def test_relation_lookup(self):
+        book = self.books[20]
+        self.client.force_login(self.users[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(reverse('userbookrelation-detail', args=(book.id, )),
+                                         data=json.dumps({'like': True}), content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        plans = self.captured_plans(queries, 'store_userbookrelation')
+        # поиск связи - по (user, book), повторное чтение под блокировкой перед сохранением - по первичному ключу
+        self.assertIndexPlan(plans[0], 'store_userbookrelation_user_book_uniq')
+        for plan in plans[1:]:
+            self.assertIndexPlan(plan, 'store_userbookrelation_pkey')
+
+    def test_counter_recalculation(self):
+        book = Book.objects.filter(pk=self.books[30].id)
+        self.assertIndexPlan(rating_drift(book).explain(), 'store_ubr_book_rating_idx')
+        self.assertIndexPlan(counters_drift(book).explain())
+        self.assertIndexPlan(
+            UserBookRelation.objects.filter(book=self.books[30], like=True).explain(), 'store_ubr_book_like_idx')
+        self.assertIndexPlan(
+            UserBookRelation.objects.filter(book=self.books[30], in_bookmarks=True).explain(),
+            'store_ubr_book_bookmarks_idx')
+
+    def test_top(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-top'), data={'board': 'likes'})
+        self.assertEqual(20, len(response.data['results']))
+        for plan in self.captured_plans(queries, 'store_leaderboardentry'):
+            self.assertIndexPlan(plan, 'store_leaderboard_rank_idx')
+            self.assertNotIn('Sort', plan)
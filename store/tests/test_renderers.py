@@ -0,0 +1,147 @@
+import gzip
+import io
+import json
+import uuid
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from store import compression, renderers
+from store.models import Book, UserBookRelation
+from store.renderers import FastJSONParser, FastJSONRenderer
+
+
+User = get_user_model()
+
+
+class FastJSONRendererTestCase(SimpleTestCase):
+    def assertSameRender(self, data, accepted_media_type=None):
+        self.assertEqual(JSONRenderer().render(data, accepted_media_type),
+                         FastJSONRenderer().render(data, accepted_media_type))
+
+    def test_same_output(self):
+        self.assertSameRender({
+            'decimal': Decimal('10.50'),
+            'datetime': datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+            'naive': datetime(2024, 1, 2, 3, 4, 5),
+            'date': date(2024, 1, 2),
+            'time': time(3, 4, 5, 6),
+            'uuid': uuid.UUID(int=1),
+            'lazy': gettext_lazy('Книга'),
+            'text': 'Книга "в кавычках"\n\t\x00  /',
+            'nested': [{'id': 1, 'readers': [{'first_name': 'Имя', 'last_name': None}]}, (True, False)],
+            'big': 2 ** 70,
+            'float': 1.5,
+        })
+        self.assertSameRender(None)
+        self.assertSameRender({'id': 1, 'readers': []}, 'application/json; indent=4')
+
+    def test_without_orjson(self):
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertSameRender({'price': Decimal('1.00'), 'name': 'Книга'})
+
+
+class FastJSONParserTestCase(SimpleTestCase):
+    def parse(self, parser, body, encoding='utf-8'):
+        try:
+            return parser.parse(io.BytesIO(body), 'application/json', {'encoding': encoding})
+        except ParseError as exc:
+            return str(exc)
+
+    def test_same_result(self):
+        bodies = ('{"name": "Книга", "price": "1.50", "readers": [1, 2.5, null, true]}', '[12345678901234567890]',
+                  '{"a": 1, "a": 2}', '"\\ud800"', '[1e400]', '[NaN]', '{"broken": ', '')
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assertEqual(self.parse(JSONParser(), body.encode()), self.parse(FastJSONParser(), body.encode()))
+        body = '{"name": "Книга"}'.encode('utf-16')
+        self.assertEqual({'name': 'Книга'}, self.parse(FastJSONParser(), body, 'utf-16'))
+
+
+class CompressionTestCase(SimpleTestCase):
+    def test_choose_encoding(self):
+        cases = (('', None), ('gzip, deflate', 'gzip'), ('br;q=0.5, gzip', 'gzip'), ('gzip;q=0', None), ('*', 'br'),
+                 ('identity', None), ('br, gzip', 'br'), ('GZIP; q=0.1', 'gzip'), ('gzip;q=x', None))
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(expected, compression.choose_encoding(header, ('br', 'gzip')))
+        self.assertEqual('gzip', compression.choose_encoding('br, gzip', ('gzip', )))
+
+
+@override_settings(BOOK_COMPRESSION_MIN_SIZE=500)
+class CompressionApiTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', first_name='Читатель', is_staff=True)
+        for index in range(10):
+            book = Book.objects.create(name=f'Книга {index}', price=Decimal('100.50') + index, author_name='Автор')
+            UserBookRelation.objects.create(user=self.user, book=book, like=True, rating=4)
+
+    @mock.patch('store.conditional.versions_shared', new=lambda: True)
+    def test_list(self):
+        url = reverse('book-list')
+        plain = self.client.get(url, data={'readers_preview': 3})
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(JSONRenderer().render(plain.data), plain.content)
+
+        response = self.client.get(url, data={'readers_preview': 3}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(str(len(response.content)), response['Content-Length'])
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(plain.content, gzip.decompress(response.content))
+
+        # ETag сжатого ответа подходит и для If-None-Match
+        response = self.client.get(url, data={'readers_preview': 3}, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_small_response(self):
+        response = self.client.get(reverse('book-list'), data={'fields': 'id', 'page_size': 1},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    @skipUnless(compression.brotli, 'brotli не установлен')
+    def test_brotli(self):
+        response = self.client.get(reverse('book-list'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual('br', response['Content-Encoding'])
+        self.assertEqual(JSONRenderer().render(response.data), compression.brotli.decompress(response.content))
+
+    def test_streaming_export(self):
+        self.client.force_login(self.user)
+        plain = b''.join(self.client.get(reverse('book-export')).streaming_content)
+        response = self.client.get(reverse('book-export'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual(plain, gzip.decompress(b''.join(response.streaming_content)))
+
+    def test_parser(self):
+        self.client.force_login(self.user)
+        book = Book.objects.first()
+        response = self.client.patch(reverse('userbookrelation-detail', args=(book.id, )),
+                                     data=json.dumps({'like': False}), content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(UserBookRelation.objects.get(user=self.user, book=book).like)
+        response = self.client.patch(reverse('userbookrelation-detail', args=(book.id, )),
+                                     data='{"rating": ', content_type='application/json')
+        self.assertEqual(400, response.status_code)
+        self.assertTrue(response.data['detail'].startswith('JSON parse error'))
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_responses', '--requests', '1', '--repeat', '1', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(10, report['books'])
+        for result in report['scenarios'].values():
+            self.assertEqual({'json', 'orjson', *(f'orjson+{name}' for name in compression.get_encodings())},
+                             set(result['bytes']))
+            self.assertLess(result['bytes']['orjson+gzip'], result['bytes']['json'])
@@ -0,0 +1,156 @@
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.cache import get_cache
+from store.models import Book, UserBookRelation
+from store.routers import (
+    PRIMARY_UNTIL_KEY, ReplicaRouter, ReplicaRoutingMiddleware, RoutingState, _state, get_primary_until,
+)
+
+
+User = get_user_model()
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def route(self, state, model=Book):
+        token = _state.set(state)
+        try:
+            return self.router.db_for_read(model)
+        finally:
+            _state.reset(token)
+
+    def test_read(self):
+        self.assertEqual('replica', self.route(RoutingState(use_primary=False)))
+        self.assertEqual('default', self.route(RoutingState(use_primary=True)))
+        self.assertEqual('default', self.route(None))
+        self.assertEqual('default', self.route(RoutingState(use_primary=False), model=User))
+
+    def test_write_makes_request_sticky(self):
+        state = RoutingState(use_primary=False)
+        token = _state.set(state)
+        try:
+            self.assertEqual('default', self.router.db_for_write(UserBookRelation))
+            self.assertTrue(state.wrote)
+            self.assertEqual('default', self.router.db_for_read(Book))
+        finally:
+            _state.reset(token)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertEqual('default', self.route(RoutingState(use_primary=False)))
+
+    def test_allow_migrate(self):
+        self.assertIsNone(self.router.allow_migrate('default', 'store'))
+        self.assertFalse(self.router.allow_migrate('replica', 'store'))
+
+
+# без кеша ответов: промахи кеша читаются из primary, см. test_cache_fill_reads_primary
+@override_settings(DATABASE_REPLICAS=['replica'], BOOK_READ_YOUR_WRITES_SECONDS=5, BOOK_API_CACHE='dummy',
+                   CACHES={**settings.CACHES, 'dummy': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ReplicaRoutingTestCase(TransactionTestCase):
+    # реплика в тестах - зеркало default; TransactionTestCase, потому что чтения внутри транзакции идут в primary
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.book = Book.objects.create(name='Book', price=100)
+        caches[settings.BOOK_API_VERSION_CACHE].delete(PRIMARY_UNTIL_KEY.format(self.user.pk))
+
+    def book_queries(self, method, url, **kwargs):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 300)
+
+        def count(queries):
+            return sum('"store_book"' in query['sql'] for query in queries)
+        return response, count(primary), count(replica)
+
+    def test_safe_reads_go_to_replica(self):
+        self.client.force_login(self.user)
+        _, primary, replica = self.book_queries('get', reverse('book-list'))
+        self.assertEqual(0, primary)
+        self.assertGreater(replica, 0)
+
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.client.get(reverse('book-detail', args=(self.book.id, )))
+        self.assertFalse([query for query in replica_queries if 'django_session' in query['sql']])
+
+    def test_read_your_writes(self):
+        self.client.force_login(self.user)
+        url = reverse('userbookrelation-detail', args=(self.book.id, ))
+        response, _, replica = self.book_queries('patch', url, data=json.dumps({'like': True}),
+                                                 content_type='application/json')
+        self.assertEqual(0, replica)
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+        response, primary, replica = self.book_queries('get', reverse('book-detail', args=(self.book.id, )))
+        self.assertEqual(0, replica)
+        self.assertGreater(primary, 0)
+        self.assertEqual(1, response.data['likes_count'])
+
+        # без cookie пользователя узнаём по отметке в общем кеше, например с другого устройства
+        self.client.cookies[ReplicaRoutingMiddleware.cookie_name] = str(time.time() - 1)
+        _, primary, replica = self.book_queries('get', reverse('book-list'))
+        self.assertEqual(0, replica)
+        self.assertGreater(primary, 0)
+
+        caches[settings.BOOK_API_VERSION_CACHE].delete(PRIMARY_UNTIL_KEY.format(self.user.pk))
+        _, primary, replica = self.book_queries('get', reverse('book-list'))
+        self.assertEqual(0, primary)
+        self.assertGreater(replica, 0)
+
+    async def test_async_read_your_writes(self):
+        # в async-цепочке пользователь и отметка в кеше читаются без SynchronousOnlyOperation
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.patch(
+            reverse('async-userbookrelation-detail', args=(self.book.id, )), data=json.dumps({'like': True}),
+            content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+        primary_until = await sync_to_async(get_primary_until)(type('Request', (), {'user': self.user}))
+        self.assertGreater(primary_until, time.time())
+
+        self.async_client.cookies.pop(ReplicaRoutingMiddleware.cookie_name)
+        response = await self.async_client.get(reverse('async-book-detail', args=(self.book.id, )))
+        self.assertEqual(1, json.loads(response.content)['likes_count'])
+
+    @override_settings(BOOK_API_CACHE='default')
+    def test_cache_fill_reads_primary(self):
+        # данные отставшей реплики не должны попасть в кеш ответов: промах читается из primary
+        get_cache().clear()
+        url = reverse('book-detail', args=(self.book.id, ))
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        # из реплики - только updated_at для ETag, сам ответ - из primary
+        self.assertFalse([query for query in replica if '"store_book"."name"' in query['sql']])
+        self.assertTrue([query for query in primary if '"store_book"."name"' in query['sql']])
+
+        response, primary, replica = self.book_queries('get', url)
+        self.assertEqual('HIT', response['X-Cache'])
+        # попадание: только updated_at для ETag из реплики
+        self.assertEqual((0, 1), (primary, replica))
+
+    def test_reads_inside_transaction(self):
+        token = _state.set(RoutingState(use_primary=False))
+        try:
+            self.assertEqual('replica', Book.objects.all().db)
+            with transaction.atomic():
+                self.assertEqual('default', Book.objects.all().db)
+        finally:
+            _state.reset(token)
@@ -0,0 +1,97 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import F
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from store.models import Book, UserBookRelation
+from store.serializers import BookSerializer, BookValuesSerializer
+from store.views import BookViewSet
+
+
+User = get_user_model()
+
+
+def create_books():
+    owner = User.objects.create(username='owner')
+    reader = User.objects.create(username='reader')
+    books = [
+        Book.objects.create(name='Book', price=Decimal('100.50'), owner=owner),
+        Book.objects.create(name='Книга "в кавычках"', price=Decimal('99999.99'), discount=Decimal('0.01'),
+                            author_name='Автор'),
+        Book.objects.create(name='', price=0, discount=Decimal('12.30'), author_name=''),
+        Book.objects.create(name='Rated', price=Decimal('1.1'), author_name='Author', owner=reader),
+    ]
+    UserBookRelation.objects.create(user=owner, book=books[3], like=True, in_bookmarks=True, rating=1)
+    UserBookRelation.objects.create(user=reader, book=books[3], rating=1)
+    UserBookRelation.objects.create(user=reader, book=books[0], like=True)
+    return books
+
+
+class BookValuesSerializerTestCase(TestCase):
+    def setUp(self):
+        create_books()
+        self.queryset = Book.objects.annotate(price_with_discount=F('price') - F('discount')).order_by('id')
+
+    def assertSameJson(self, fields=None):
+        expected = BookSerializer(self.queryset.select_related('owner'), many=True,
+                                  context={'fields': fields}).data
+        serializer = BookValuesSerializer(fields)
+        actual = serializer.many(self.queryset.values(*serializer.columns))
+        self.assertEqual(JSONRenderer().render(expected), JSONRenderer().render(actual))
+
+    def test_all_fields(self):
+        self.assertSameJson()
+
+    def test_field_subsets(self):
+        for fields in ({'id'}, {'price', 'rating'}, {'owner_name', 'price_with_discount'}, {'author_name', 'name'}):
+            with self.subTest(fields=fields):
+                self.assertSameJson(fields)
+
+    def test_decimal_scale(self):
+        serializer = BookValuesSerializer({'price', 'rating'})
+        row = serializer.to_representation({'price': Decimal('5'), 'rating': Decimal('4.333')})
+        self.assertEqual({'price': '5.00', 'rating': '4.33'}, row)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', '--repeat', '1', stdout=out)
+        self.assertIn('Ускорение', out.getvalue())
+
+    def test_readers_preview_not_supported(self):
+        with self.assertRaises(ValueError):
+            BookValuesSerializer({'id', 'readers_preview'})
+
+
+class FastReadApiTestCase(APITestCase):
+    def setUp(self):
+        self.books = create_books()
+
+    def assertSameContent(self, url, data=None):
+        fast = self.client.get(url, data=data)
+        cache.clear()
+        with mock.patch.object(BookViewSet, 'fast_read_enabled', False):
+            slow = self.client.get(url, data=data)
+        self.assertEqual(200, fast.status_code)
+        self.assertEqual('MISS', slow['X-Cache'])
+        self.assertEqual(slow.content, fast.content)
+
+    def test_list(self):
+        self.assertSameContent(reverse('book-list'))
+        self.assertSameContent(reverse('book-list'), {'ordering': '-price', 'page_size': 2})
+        self.assertSameContent(reverse('book-list'), {'search': 'book', 'fields': 'id,name,owner_name'})
+
+    def test_detail(self):
+        for book in self.books:
+            self.assertSameContent(reverse('book-detail', args=(book.id, )))
+
+    def test_detail_not_found(self):
+        self.assertEqual(404, self.client.get(reverse('book-detail', args=(self.books[-1].id + 1, ))).status_code)
+        self.assertEqual(404, self.client.get('/book/abc/').status_code)
@@ -1,39 +1,239 @@
-from django.db.models import Count, Case, When, Avg, F
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Exists, F, OuterRef, Prefetch, Subquery
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import UpdateModelMixin
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
+from . import cache
+from . import exchange
+from . import leaderboards
+from . import logic
 from . import models
 from . import serializers
+from .conditional import ConditionalGetMixin
+from .fastpath import FastReadMixin
+from .filters import BookSearchFilter
+from .metrics import registry as metrics_registry
+from .pagination import KeysetPagination
 from .permissions import IsOwnerOrStaffOrReadOnly
 
 
-class BookViewSet(ModelViewSet):
+def readers_preview_prefetch(limit):
+    # не больше limit связей на книгу: коррелированный подзапрос с LIMIT вместо выборки всех читателей
+    first_relations = models.UserBookRelation.objects.filter(book=OuterRef('book')).order_by('id').values('id')[:limit]
+    relations = models.UserBookRelation.objects.filter(id__in=Subquery(first_relations)).select_related('user').only(
+        'book_id', 'user__first_name', 'user__last_name').order_by('id')
+    return Prefetch('userbookrelation_set', queryset=relations, to_attr='readers_preview')
+
+
+class BookViewSet(ConditionalGetMixin, cache.VersionedCacheMixin, FastReadMixin, ModelViewSet):
     queryset = models.Book.objects.all().annotate(
-            bookmarks_count=Count(Case(When(userbookrelation__in_bookmarks=True, then=1))),
             price_with_discount=F("price") - F("discount"),
-        ).select_related('owner').prefetch_related('readers').order_by('id')
+        ).select_related('owner').defer('search_vector').order_by('id')
     serializer_class = serializers.BookSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, BookSearchFilter, OrderingFilter]
     permission_classes = [IsOwnerOrStaffOrReadOnly]
+    pagination_class = KeysetPagination
     filterset_fields = ['price']
     search_fields = ['name', 'author_name']
     ordering_fields = ['price']
+    readers_preview_query_param = 'readers_preview'
+    max_readers_preview = 10
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+    read_actions = ('list', 'retrieve')
+    write_actions = ('update', 'partial_update')
+    # какие колонки нужны полю BookSerializer; id и price грузятся всегда - по ним курсор пагинации
+    field_columns = {
+        'name': ('name', ),
+        'author_name': ('author_name', ),
+        'likes_count': ('likes_count', ),
+        'bookmarks_count': ('bookmarks_count', ),
+        'rating': ('rating', ),
+        'owner_name': ('owner', 'owner__username'),
+        'readers_count': ('readers_count', ),
+    }
+
+    def get_readers_preview(self):
+        if self.action not in self.read_actions:
+            return 0
+        try:
+            limit = int(self.request.query_params.get(self.readers_preview_query_param, 0))
+        except ValueError:
+            return 0
+        return min(max(limit, 0), self.max_readers_preview)
+
+    def parse_field_names(self, param):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return None
+        names = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = names - set(self.serializer_class.Meta.fields)
+        if unknown:
+            raise ValidationError({param: [f'Неизвестные поля: {", ".join(sorted(unknown))}']})
+        return names
+
+    def get_output_fields(self):
+        if self.action not in self.read_actions:
+            return None
+        fields = set(self.serializer_class.Meta.fields)
+        requested = self.parse_field_names(self.fields_query_param)
+        if requested is not None:
+            fields &= requested
+        fields -= self.parse_field_names(self.exclude_query_param) or set()
+        if not self.get_readers_preview():
+            fields.discard('readers_preview')
+        if not self.request.user.is_authenticated:
+            fields -= set(self.serializer_class.USER_STATE_FIELDS)
+        return fields
+
+    def get_user_state_fields(self):
+        fields = self.get_output_fields() or set()
+        return [name for name in self.serializer_class.USER_STATE_FIELDS if name in fields]
+
+    def user_state_annotations(self, names):
+        # коррелированные подзапросы по уникальному индексу (user, book) в том же SELECT, без запроса на книгу
+        relations = models.UserBookRelation.objects.filter(book=OuterRef('pk'), user=self.request.user)
+        annotations = {
+            'my_like': Exists(relations.filter(like=True)),
+            'my_bookmark': Exists(relations.filter(in_bookmarks=True)),
+            'my_rating': Subquery(relations.values('rating')[:1]),
+        }
+        return {name: annotations[name] for name in names}
+
+    def get_response_variant(self, request):
+        if not self.get_user_state_fields():
+            return ''
+        return f':user={request.user.pk}:{cache.get_user_version(request.user.pk)}'
+
+    def get_queryset(self):
+        if self.action == 'destroy':
+            # проверке прав нужен только owner_id, остальное удаление делает по id
+            return models.Book.objects.only('id', 'owner_id')
+        if self.action in self.write_actions:
+            # поля ответа BookSerializer; скидка - чтобы пересчитать price_with_discount после изменения цены
+            fields = set(self.serializer_class.Meta.fields) - {'readers_preview',
+                                                                *self.serializer_class.USER_STATE_FIELDS}
+            return self.get_fields_queryset(fields).only(*self.get_columns(fields), 'owner_id', 'discount')
+        fields = self.get_output_fields()
+        if fields is None:
+            return super().get_queryset()
+        return self.get_fields_queryset(fields).only(*self.get_columns(fields))
+
+    def get_columns(self, fields):
+        columns = {'id', 'price'}
+        for field in fields:
+            columns.update(self.field_columns.get(field, ()))
+        return columns
+
+    def get_fields_queryset(self, fields):
+        # запрос строится под запрошенные поля: без ненужных аннотаций, JOIN и prefetch
+        queryset = models.Book.objects.order_by('id')
+        if 'price_with_discount' in fields:
+            queryset = queryset.annotate(price_with_discount=F("price") - F("discount"))
+        if 'owner_name' in fields:
+            queryset = queryset.select_related('owner')
+        if 'readers_preview' in fields:
+            queryset = queryset.prefetch_related(readers_preview_prefetch(self.get_readers_preview()))
+        user_state_fields = self.get_user_state_fields()
+        if user_state_fields:
+            queryset = queryset.annotate(**self.user_state_annotations(user_state_fields))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['readers_preview'] = self.get_readers_preview()
+        context['fields'] = self.get_output_fields()
+        context['user_state'] = bool(self.get_user_state_fields())
+        return context
 
     def perform_create(self, serializer):
         serializer.validated_data['owner'] = self.request.user
         serializer.save()
 
+    def perform_update(self, serializer):
+        book = serializer.save()
+        # аннотация посчитана по цене до изменения
+        book.price_with_discount = book.price - book.discount
+
+    @action(detail=True)
+    def readers(self, request, pk=None):
+        book = self.get_object()
+        queryset = book.readers.only('id', 'first_name', 'last_name').order_by('id')
+        page = self.paginate_queryset(queryset)
+        serializer = serializers.BookReaderSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        export_format = request.query_params.get('type', 'ndjson')
+        if export_format not in exchange.FORMATS:
+            return Response({'type': [f'Допустимые значения: {", ".join(exchange.FORMATS)}']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        content_type = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+        response = StreamingHttpResponse(
+            exchange.iter_export(self.filter_queryset(self.get_queryset()), export_format),
+            content_type=f'{content_type}; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="books.{export_format}"'
+        return response
+
+    @action(detail=False)
+    def top(self, request):
+        board = request.query_params.get('board', 'rating')
+        if board not in leaderboards.BOARDS:
+            return Response({'board': [f'Допустимые значения: {", ".join(leaderboards.BOARDS)}']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        windows = leaderboards.get_windows()
+        try:
+            window_days = int(request.query_params.get('window', 0))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            window_days, limit = None, None
+        if window_days not in windows:
+            return Response({'window': [f'Допустимые значения: {", ".join(map(str, windows))}']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if limit is None or not 1 <= limit <= settings.BOOK_LEADERBOARD_MAX_LIMIT:
+            return Response({'limit': [f'Число от 1 до {settings.BOOK_LEADERBOARD_MAX_LIMIT}']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        entries = leaderboards.top(board, window_days, limit)
+        serializer = serializers.LeaderboardEntrySerializer(entries, many=True, context={'board': board})
+        results = [{'position': position, **entry} for position, entry in enumerate(serializer.data, start=1)]
+        return Response({'board': board, 'window': window_days, 'results': results})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def pricing(self, request):
+        serializer = serializers.BookPricingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            updated = logic.apply_pricing(serializer.get_queryset(), data['rule'], data['value'])
+        except DjangoValidationError as exc:
+            raise ValidationError({'value': exc.messages})
+        return Response({'updated': updated})
+
+    @action(detail=False, url_path='cache-stats', permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(cache.get_stats())
+
 
 class UserBookRelationView(UpdateModelMixin, GenericViewSet):
     queryset = models.UserBookRelation.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.UserBookRelationSerializer
     lookup_field = 'book'
+    max_bulk_size = 500
 
     def get_object(self):
         current_user = self.request.user
@@ -42,6 +242,33 @@ class UserBookRelationView(UpdateModelMixin, GenericViewSet):
             return obj
         return HttpResponse('Unauthorized', status=401)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        if not isinstance(request.data, list) or len(request.data) > self.max_bulk_size:
+            return Response({'detail': f'Ожидается список не длиннее {self.max_bulk_size} элементов'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        items, results = [], {}
+        for index, data in enumerate(request.data):
+            serializer = serializers.UserBookRelationBulkItemSerializer(data=data)
+            if serializer.is_valid():
+                items.append((index, serializer.validated_data))
+            else:
+                results[index] = {'book': data.get('book') if isinstance(data, dict) else None,
+                                  'errors': serializer.errors}
+
+        applied = logic.apply_relation_changes(request.user, [item for _, item in items])
+        results.update((index, result) for (index, _), result in zip(items, applied))
+        return Response({'results': [results[index] for index in range(len(request.data))]})
+
 
 def auth(request):
     return render(request, 'store/oauth.html')
+
+
+def metrics(request):
+    token = settings.BOOK_METRICS_TOKEN
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')